@@ -0,0 +1,75 @@
+"""
+CPU latency of eager Nets versus their TorchScript and ONNX (onnxruntime)
+exports (see export.py), after checking that outputs match.
+
+Models are built with random weights (`pretrained=False`) and exported to a
+temporary directory. ONNX is skipped if onnxruntime is not installed.
+
+Usage (from skp/):
+    python benchmarks/exported_inference.py cfg_identify_subarticular_slices cfg_predict_sagittal_canal_coords \
+        cfg000_genv5_foramina_crops_all_slices_seq cfg000_axial_t2_seg --batch-size 1 --threads 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import export
+
+from configs.base import freeze, replace
+from importlib import import_module
+
+
+def timeit(fn, x, repeats, warmup=3):
+    for _ in range(warmup):
+        fn(x)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(x)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("configs", type=str, nargs="+")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    formats = ["torchscript"]
+    try:
+        import onnxruntime
+        formats.append("onnx")
+    except ImportError:
+        print("onnxruntime is not installed, skipping ONNX")
+
+    print(f"\nMedian latency (ms), batch size {args.batch_size}, {args.threads} threads\n")
+    print(f"{'config':<48}{'model':<24}{'eager':>10}" + "".join(f"{fmt:>14}" for fmt in formats))
+    for cfg_name in args.configs:
+        cfg = import_module(f"configs.{cfg_name}").cfg
+        cfg = freeze(replace(cfg, pretrained=False, load_pretrained_backbone=None, load_pretrained_encoder=None))
+        net = import_module(f"models.{cfg.model}").Net(cfg).eval()
+        x = torch.randn(export.get_input_shape(cfg, args.batch_size))
+
+        graph = export.get_inference_graph(net)
+        with torch.inference_mode():
+            latencies = [timeit(graph, x, args.repeats)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = export.export(net, cfg, os.path.join(tmpdir, cfg_name), formats, batch_size=args.batch_size)
+            for fmt in formats:
+                latencies.append(timeit(export.load_exported(paths[fmt]), x, args.repeats))
+        eager, exported = latencies[0], latencies[1:]
+        print(f"{cfg_name:<48}{cfg.model:<24}{eager * 1000:>10.1f}" + "".join(f"{t * 1000:>14.1f}" for t in exported))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Fold models run one after another versus as a single vmapped `FoldEnsemble`
+over stacked weights (see etl/inference.py), for:
+
+    same input:  all folds on the same batch (e.g., feature extraction in
+                 etl/26, or averaging folds at test time)
+    by fold:     out-of-fold prediction, each fold on its own samples
+                 (`predict_by_fold` in etl/000d)
+
+Models are built with random weights (`pretrained=False`), which does not
+affect timing. Outputs of both are checked to match.
+
+Usage (from skp/):
+    python benchmarks/fold_ensemble.py cfg_identify_subarticular_slices cfg_predict_sagittal_canal_coords --batch-size 16 --device cpu
+"""
+import argparse
+import os
+import sys
+import time
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "etl"))
+
+from configs.base import freeze, replace
+from importlib import import_module
+from inference import FoldEnsemble, predict_by_fold
+
+
+def get_input_shape(cfg, batch_size):
+    if cfg.image_z:
+        return (batch_size, cfg.num_input_channels, cfg.image_z, cfg.image_height, cfg.image_width)
+    return (batch_size, cfg.num_input_channels, cfg.image_height, cfg.image_width)
+
+
+def timeit(fn, device, repeats):
+    fn()
+    times = []
+    for _ in range(repeats):
+        if device == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        fn()
+        if device == "cuda":
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("configs", type=str, nargs="+")
+    parser.add_argument("--num-folds", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    print(f"{'config':<48}{'model':<16}{'':<12}{'loop (s)':>10}{'ensemble (s)':>14}{'speedup':>9}")
+    for cfg_name in args.configs:
+        cfg = import_module(f"configs.{cfg_name}").cfg
+        cfg = freeze(replace(cfg, pretrained=False, load_pretrained_backbone=None, load_pretrained_encoder=None))
+        net_class = import_module(f"models.{cfg.model}").Net
+        model_dict = {fold: net_class(cfg).eval().to(args.device) for fold in range(args.num_folds)}
+        ensemble = FoldEnsemble(model_dict)
+        x = torch.randn(get_input_shape(cfg, args.batch_size), device=args.device)
+
+        def loop():
+            return torch.stack([model({"x": x})["logits"] for model in model_dict.values()])
+
+        def stacked():
+            return ensemble({"x": x})["logits"]
+
+        with torch.inference_mode():
+            torch.testing.assert_close(stacked(), loop(), rtol=1e-3, atol=1e-4)
+            t_loop, t_stacked = timeit(loop, args.device, args.repeats), timeit(stacked, args.device, args.repeats)
+        print(f"{cfg_name:<48}{cfg.model:<16}{'same input':<12}{t_loop:>10.3f}{t_stacked:>14.3f}{t_loop / t_stacked:>8.1f}x")
+
+        # samples spread across folds as in a batch of studies
+        inputs = list(x.cpu())
+        folds = [i % args.num_folds for i in range(len(inputs))]
+        kwargs = {"batch_size": args.batch_size, "device": args.device, "activation": None}
+        for a, b in zip(predict_by_fold(model_dict, inputs, folds, **kwargs), predict_by_fold(ensemble, inputs, folds, **kwargs)):
+            torch.testing.assert_close(torch.from_numpy(b), torch.from_numpy(a), rtol=1e-3, atol=1e-4)
+        t_loop = timeit(lambda: predict_by_fold(model_dict, inputs, folds, **kwargs), args.device, args.repeats)
+        t_stacked = timeit(lambda: predict_by_fold(ensemble, inputs, folds, **kwargs), args.device, args.repeats)
+        print(f"{'':<48}{'':<16}{'by fold':<12}{t_loop:>10.3f}{t_stacked:>14.3f}{t_loop / t_stacked:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
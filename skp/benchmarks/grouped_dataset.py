@@ -0,0 +1,107 @@
+"""
+Throughput of per-sample metadata access in grouped sequence datasets
+(e.g., datasets/crop_all_slices_seq.py): a list of per-group DataFrames, as
+previously used, vs. sorting once and using start/end offsets into flat columns.
+
+Image reading is excluded, only the construction and `get` bookkeeping is timed.
+
+Usage (from skp/):
+    python benchmarks/grouped_dataset.py --num-groups 50000 --rows-per-group 20
+"""
+import argparse
+import numpy as np
+import os
+import pandas as pd
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datasets.sample_table import StringArray, group_offsets
+
+
+TARGETS = ["normal_mild", "moderate", "severe"]
+
+
+def make_annotations(num_groups, rows_per_group, seed=0):
+    rng = np.random.default_rng(seed)
+    n = num_groups * rows_per_group
+    group = np.repeat(np.arange(num_groups), rows_per_group)
+    df = pd.DataFrame({
+        "study_level_laterality_crop": np.char.add("group_", group.astype(str)),
+        "position_index": rng.permutation(n),
+        "filepath": [f"crops/{g}/slice_{i:06d}_000.png" for i, g in enumerate(group)],
+        "unique_id": group,
+    })
+    for t in TARGETS:
+        df[t] = rng.random(n)
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+class GroupedDataFrames:
+
+    def __init__(self, df, max_num_images):
+        self.max_num_images = max_num_images
+        self.df = [_df for _, _df in df.groupby("study_level_laterality_crop")]
+
+    def __len__(self):
+        return len(self.df)
+
+    def get(self, i):
+        df = self.df[i]
+        df = df.sort_values("position_index")
+        if len(df) > self.max_num_images:
+            diff = (len(df) - self.max_num_images) // 2
+            df = df.iloc[diff:(diff + self.max_num_images)]
+        return df.filepath.tolist(), df[TARGETS].values, df.unique_id.values[0]
+
+
+class GroupOffsets:
+
+    def __init__(self, df, max_num_images):
+        self.max_num_images = max_num_images
+        df = df.sort_values(["study_level_laterality_crop", "position_index"], kind="stable")
+        self.starts, self.ends = group_offsets(df.study_level_laterality_crop.values)
+        self.filepaths = StringArray(df.filepath)
+        self.targets = df[TARGETS].values
+        self.unique_ids = df.unique_id.values
+
+    def __len__(self):
+        return len(self.starts)
+
+    def get(self, i):
+        start, end = self.starts[i], self.ends[i]
+        if end - start > self.max_num_images:
+            start = start + (end - start - self.max_num_images) // 2
+            end = start + self.max_num_images
+        return [self.filepaths[j] for j in range(start, end)], self.targets[start:end], self.unique_ids[start]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-groups", type=int, default=50000)
+    parser.add_argument("--rows-per-group", type=int, default=20)
+    parser.add_argument("--max-num-images", type=int, default=16)
+    parser.add_argument("--num-gets", type=int, default=20000)
+    args = parser.parse_args()
+
+    df = make_annotations(args.num_groups, args.rows_per_group)
+    indices = np.random.default_rng(1).integers(0, args.num_groups, args.num_gets)
+    print(f"rows={len(df)}, groups={args.num_groups}, gets={args.num_gets}")
+    print(f"{'dataset':<20}{'init (s)':>10}{'get (us)':>12}{'samples/s':>12}")
+    results = {}
+    for name, cls in [("GroupedDataFrames", GroupedDataFrames), ("GroupOffsets", GroupOffsets)]:
+        start = time.perf_counter()
+        ds = cls(df, args.max_num_images)
+        t_init = time.perf_counter() - start
+        start = time.perf_counter()
+        results[name] = [ds.get(i) for i in indices]
+        t_get = (time.perf_counter() - start) / args.num_gets
+        print(f"{name:<20}{t_init:>10.2f}{t_get * 1e6:>12.1f}{1 / t_get:>12.0f}")
+    for old, new in zip(results["GroupedDataFrames"], results["GroupOffsets"]):
+        assert old[0] == new[0] and np.allclose(old[1], new[1]) and old[2] == new[2]
+    print("outputs match")
+
+
+if __name__ == "__main__":
+    main()
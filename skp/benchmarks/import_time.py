@@ -0,0 +1,83 @@
+"""
+Import time of the training entry point and the ETL inference modules, using
+`python -X importtime` in a fresh interpreter for each target, and the wall
+time of `python train.py --help`.
+
+Reports the total import time of each target and its slowest top-level imports
+(cumulative, i.e., including everything they import in turn).
+
+Usage (from skp/):
+    python benchmarks/import_time.py --top 10 --repeats 3
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+SKP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ETL_DIR = os.path.join(SKP_DIR, "etl")
+
+# (name, working directory, statement)
+TARGETS = [
+    ("train", SKP_DIR, "import train"),
+    ("metrics", SKP_DIR, "import metrics"),
+    ("losses", SKP_DIR, "import losses"),
+    ("etl/utils", ETL_DIR, "import sys; sys.path.insert(0, '../../skp'); import utils"),
+    ("etl/inference", ETL_DIR, "import sys; sys.path.insert(0, '../../skp'); import inference"),
+]
+
+
+def parse_importtime(stderr):
+    # lines look like: "import time:       123 |        456 |   package.module"
+    # where the indentation of the module name is the depth in the import tree
+    top_level = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if name.startswith("  "):
+            continue
+        top_level.append((name.strip(), int(cumulative_us)))
+    return top_level
+
+
+def time_import(cwd, stmt):
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", stmt],
+                          cwd=cwd, capture_output=True, text=True)
+    top_level = parse_importtime(proc.stderr)
+    error = proc.stderr.strip().splitlines()[-1] if proc.returncode != 0 else None
+    return top_level, error
+
+
+def time_command(cwd, cmd):
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True)
+    return time.perf_counter() - start, proc.returncode
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    for name, cwd, stmt in TARGETS:
+        # keep the fastest run, the first one may include filling the OS file cache
+        best, error = None, None
+        for _ in range(args.repeats):
+            top_level, error = time_import(cwd, stmt)
+            if best is None or sum(t for _, t in top_level) < sum(t for _, t in best):
+                best = top_level
+        total = sum(t for _, t in best) / 1e6
+        print(f"\n{name}: {total:.2f}s" + (f" (failed: {error})" if error else ""))
+        for module, t in sorted(best, key=lambda x: -x[1])[:args.top]:
+            print(f"    {module:<48}{t / 1e6:>8.3f}s")
+
+    times = [time_command(SKP_DIR, [sys.executable, "train.py", "--help"]) for _ in range(args.repeats)]
+    print(f"\npython train.py --help: {min(t for t, _ in times):.2f}s (exit code {times[0][1]})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Per-model construction time, and the cost of the dummy forward pass which was
+previously used in `Net.__init__` to find the backbone feature dimension
+(now resolved from timm metadata or on the meta device, see
+models/feature_dims.py).
+
+Models are built with `pretrained=False`, so that download and weight loading
+are not timed. `--num-models` builds each model that many times, e.g. 5 folds x
+4 stages = 20 for the crop generation pipeline.
+
+Usage (from skp/):
+    python benchmarks/model_construction.py cfg0000_noise_reduce_085_foramen_crops cfg00_sagittal_canal_coords_3d --num-models 5
+"""
+import argparse
+import os
+import sys
+import time
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configs.base import freeze, replace
+from importlib import import_module
+from models.feature_dims import get_num_features
+
+
+def get_input_shape(cfg):
+    # shape of the dummy input which the model used to run in __init__
+    if cfg.model in ["net_x3d", "net_x3d_subarticular", "net_csn_r101", "net_r2plus1d"]:
+        return (2, cfg.num_input_channels, 32, 128, 128)
+    return (2, cfg.num_input_channels, cfg.image_height, cfg.image_width)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("configs", type=str, nargs="+")
+    parser.add_argument("--num-models", type=int, default=5)
+    args = parser.parse_args()
+
+    torch.set_num_threads(os.cpu_count())
+    print(f"{'config':<60}{'model':<28}{'build (s)':>10}{'dummy fwd (s)':>15}{'metadata (s)':>14}")
+    total_build, total_forward = 0, 0
+    for cfg_name in args.configs:
+        cfg = import_module(f"configs.{cfg_name}").cfg
+        cfg = freeze(replace(cfg, pretrained=False, load_pretrained_backbone=None, load_pretrained_encoder=None))
+        net_class = import_module(f"models.{cfg.model}").Net
+        start = time.perf_counter()
+        for _ in range(args.num_models):
+            model = net_class(cfg)
+        t_build = (time.perf_counter() - start) / args.num_models
+
+        t_forward, t_metadata = float("nan"), float("nan")
+        backbone = getattr(model, "backbone", None)
+        if backbone is not None:
+            input_shape = get_input_shape(cfg)
+            start = time.perf_counter()
+            # as previously in Net.__init__, i.e., with gradients and in train mode
+            _ = backbone(torch.randn(input_shape))
+            t_forward = time.perf_counter() - start
+            start = time.perf_counter()
+            _ = get_num_features(backbone, input_shape)
+            t_metadata = time.perf_counter() - start
+            total_forward += t_forward * args.num_models
+        total_build += t_build * args.num_models
+        print(f"{cfg_name:<60}{cfg.model:<28}{t_build:>10.2f}{t_forward:>15.2f}{t_metadata:>14.4f}")
+
+    print(f"\nTotal for {args.num_models} model(s) per config: build {total_build:.1f}s, "
+          f"dummy forward passes removed {total_forward:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Time to load all folds of a pipeline stage from Lightning checkpoints (full
+`torch.load` of each checkpoint and a new Net per fold, as previously in the
+ETL scripts) versus from a weights-only bundle in the model registry (see
+registry.py). The bundle is exported first if it does not exist.
+
+Usage (from skp/):
+    python benchmarks/model_loading.py cfg_predict_sagittal_canal_coords --device cpu
+"""
+import argparse
+import os
+import sys
+import time
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import registry
+
+from importlib import import_module
+
+
+def load_from_checkpoints(checkpoint_dict, cfg, device):
+    model_dict = {}
+    for fold, checkpoint_path in checkpoint_dict.items():
+        wts = torch.load(checkpoint_path, map_location="cpu", weights_only=False)["state_dict"]
+        wts = {k.replace("model.", ""): v for k, v in wts.items()}
+        model = import_module(f"models.{cfg.model}").Net(cfg)
+        model.load_state_dict(wts)
+        model_dict[fold] = model.eval().to(device)
+    return model_dict
+
+
+def synchronize(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config", type=str)
+    parser.add_argument("--checkpoints", type=str, nargs="+")
+    parser.add_argument("--folds", type=int, nargs="+", default=[0, 1, 2, 3, 4])
+    parser.add_argument("--device", type=str, default="cuda")
+    args = parser.parse_args()
+
+    if args.checkpoints:
+        checkpoint_dict = dict(zip(args.folds, args.checkpoints))
+    else:
+        checkpoint_dict = registry.find_latest_checkpoints(args.config, args.folds)
+    if not registry.bundle_matches(args.config, checkpoint_dict):
+        registry.export_bundle(args.config, checkpoint_dict)
+
+    cfg = registry.get_inference_config(args.config)
+    start = time.perf_counter()
+    models = load_from_checkpoints(checkpoint_dict, cfg, args.device)
+    synchronize(args.device)
+    t_checkpoints = time.perf_counter() - start
+    del models
+
+    start = time.perf_counter()
+    bundle = registry.load_bundle(args.config, device=args.device)
+    synchronize(args.device)
+    t_bundle = time.perf_counter() - start
+
+    # same weights either way
+    reference = load_from_checkpoints({0: checkpoint_dict[args.folds[0]]}, cfg, "cpu")[0].state_dict()
+    for k, v in bundle["models"][args.folds[0]].state_dict().items():
+        assert torch.equal(v.cpu(), reference[k]), k
+
+    checkpoint_mb = sum(os.path.getsize(p) for p in checkpoint_dict.values()) / 1024 ** 2
+    bundle_dir = registry.get_bundle_dir(args.config)
+    bundle_mb = sum(os.path.getsize(os.path.join(bundle_dir, f)) for f in os.listdir(bundle_dir)) / 1024 ** 2
+    print(f"{len(checkpoint_dict)} folds of {args.config} ({cfg.model}) on {args.device}")
+    print(f"    checkpoints: {t_checkpoints:.2f}s ({checkpoint_mb:.0f} MB)")
+    print(f"    bundle:      {t_bundle:.2f}s ({bundle_mb:.0f} MB)")
+    print(f"    speedup:     {t_checkpoints / t_bundle:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+CPU throughput of float versus dynamic and static int8 models (see
+quantization.py) for a number of threads, on batches of the validation
+Dataset of each config (data loading is not timed).
+
+Models are built with random weights (`pretrained=False`), which does not
+affect timing. For the accuracy of quantized models, use the report in
+quantization.py with trained weights.
+
+Usage (from skp/):
+    python benchmarks/quantized_inference.py cfg0000_noise_reduce_085_foramen_crops --threads 1 4 8 --num-batches 10
+"""
+import argparse
+import os
+import sys
+import time
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import quantization
+
+from configs.base import freeze, replace
+from importlib import import_module
+
+
+def throughput(net, batches):
+    with torch.inference_mode():
+        net(batches[0])
+        start = time.perf_counter()
+        for batch in batches:
+            net(batch)
+        elapsed = time.perf_counter() - start
+    return sum(len(batch["x"]) for batch in batches) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("configs", type=str, nargs="+")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, os.cpu_count()])
+    parser.add_argument("--num-batches", type=int, default=10)
+    parser.add_argument("--num-calibration-batches", type=int, default=4)
+    args = parser.parse_args()
+
+    print("\nSamples/s on CPU\n")
+    print(f"{'config':<48}{'model':<24}{'threads':>8}{'float':>10}{'dynamic':>16}{'static':>16}")
+    for cfg_name in args.configs:
+        cfg = import_module(f"configs.{cfg_name}").cfg
+        cfg = freeze(replace(cfg, pretrained=False, load_pretrained_backbone=None, load_pretrained_encoder=None))
+        net = import_module(f"models.{cfg.model}").Net(cfg).eval()
+        batches = quantization.get_val_batches(cfg, args.num_batches)
+        models = {
+            "dynamic": quantization.quantize(net, "dynamic"),
+            "static": quantization.quantize(net, "static", calibration_batches=batches[:args.num_calibration_batches])
+                      if hasattr(net, "backbone") else None
+        }
+        for num_threads in args.threads:
+            torch.set_num_threads(num_threads)
+            t_float = throughput(net, batches)
+            row = f"{t_float:>10.1f}"
+            for mode, model in models.items():
+                if model is None:
+                    row += f"{'-':>16}"
+                    continue
+                t = throughput(model, batches)
+                row += f"{t:>8.1f} ({t / t_float:.2f}x)"
+            print(f"{cfg_name:<48}{cfg.model:<24}{num_threads:>8}" + row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Per-epoch sampler setup time: native rank-aware samplers vs. wrapping a
+single-process sampler in DistributedSamplerWrapper.
+
+The wrapper materializes the full epoch on every rank (DatasetFromSampler) and
+then shuffles and shards indices-of-indices, whereas the native samplers only
+draw (or keep) their own rank's shard.
+
+Usage (from skp/):
+    python benchmarks/sampler_setup.py --dataset-size 1000000 --world-size 8
+"""
+import argparse
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configs.base import Config
+from tasks.samplers import WeightedSampler, BalancedSampler, Upsampler, DistributedSamplerWrapper
+
+
+class DummyDataset:
+
+    def __init__(self, n, seed=0):
+        rng = np.random.default_rng(seed)
+        self.n = n
+        self.sampling_weights = rng.random(n) + 0.1
+        self.labels = (rng.random(n) < 0.1).astype("float32")
+
+    def __len__(self):
+        return self.n
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset-size", type=int, default=1_000_000)
+    parser.add_argument("--world-size", type=int, default=8)
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--num-iterations-per-epoch", type=int, default=1000)
+    return parser.parse_args()
+
+
+def time_epochs(sampler, epochs):
+    times = []
+    for epoch in range(epochs):
+        if hasattr(sampler, "set_epoch"):
+            sampler.set_epoch(epoch)
+        start = time.perf_counter()
+        indices = list(iter(sampler))
+        times.append(time.perf_counter() - start)
+    return np.median(times), len(indices)
+
+
+def main():
+    args = parse_args()
+    dataset = DummyDataset(args.dataset_size)
+    cfg = Config(batch_size=args.batch_size, num_iterations_per_epoch=args.num_iterations_per_epoch,
+                 world_size=args.world_size, seed=0)
+    n = args.dataset_size
+    builders = {
+        "WeightedSampler": lambda **kwargs: WeightedSampler(dataset, cfg, **kwargs),
+        "BalancedSampler": lambda **kwargs: BalancedSampler(dataset, N_sample=n // 2, **kwargs),
+        "Upsampler": lambda **kwargs: Upsampler(dataset, upsample_factor=2, **kwargs)
+    }
+    print(f"dataset_size={n}, world_size={args.world_size}, epochs={args.epochs} (median time per epoch, rank 0)")
+    print(f"{'sampler':<18}{'wrapper (ms)':>14}{'native (ms)':>14}{'speedup':>10}{'len':>12}")
+    for name, build in builders.items():
+        wrapped = DistributedSamplerWrapper(build(rank=0, world_size=1, seed=0),
+                                            num_replicas=args.world_size, rank=0)
+        native = build(rank=0, world_size=args.world_size, seed=0)
+        t_wrapped, _ = time_epochs(wrapped, args.epochs)
+        t_native, length = time_epochs(native, args.epochs)
+        print(f"{name:<18}{t_wrapped * 1000:>14.1f}{t_native * 1000:>14.1f}{t_wrapped / t_native:>9.1f}x{length:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Micro-benchmark of multi-aug aggregation in validation metrics: pandas
+`groupby("unique_id").mean()` / `.median()` vs. `metrics.segment.segment_reduce`.
+
+Also checks that both give the same result.
+
+Usage (from skp/):
+    python benchmarks/segment_reduce.py --num-ids 50000 --num-augs 9
+"""
+import argparse
+import numpy as np
+import os
+import pandas as pd
+import sys
+import time
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics.segment import segment_reduce
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-ids", type=int, default=50000)
+    parser.add_argument("--num-augs", type=int, default=9)
+    parser.add_argument("--num-cols", type=int, default=7)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--device", type=str, default="cpu")
+    return parser.parse_args()
+
+
+def timeit(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - start)
+    return np.median(times), out
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(0)
+    unique_id = rng.permutation(np.repeat(np.arange(args.num_ids), args.num_augs))
+    x = rng.random((len(unique_id), args.num_cols)).astype("float32")
+
+    def with_pandas():
+        df = pd.DataFrame(x, columns=[f"c{i}" for i in range(args.num_cols)])
+        df["unique_id"] = unique_id
+        return df.groupby("unique_id").mean().values, df.groupby("unique_id").median().values
+
+    x_torch = torch.from_numpy(x).to(args.device)
+    unique_id_torch = torch.from_numpy(unique_id).to(args.device)
+
+    def with_segment_reduce():
+        _, out = segment_reduce(x_torch, unique_id_torch, reductions=("mean", "median"))
+        if x_torch.is_cuda:
+            torch.cuda.synchronize()
+        return out["mean"].cpu().numpy(), out["median"].cpu().numpy()
+
+    t_pandas, (mean_pd, median_pd) = timeit(with_pandas, args.repeats)
+    t_segment, (mean_seg, median_seg) = timeit(with_segment_reduce, args.repeats)
+    print(f"rows={len(x)}, ids={args.num_ids}, cols={args.num_cols}, device={args.device}")
+    print(f"pandas groupby:  {t_pandas * 1000:8.1f} ms")
+    print(f"segment_reduce:  {t_segment * 1000:8.1f} ms  ({t_pandas / t_segment:.1f}x)")
+    print(f"max abs diff mean={np.abs(mean_pd - mean_seg).max():.2e}, median={np.abs(median_pd - median_seg).max():.2e}")
+
+
+if __name__ == "__main__":
+    main()
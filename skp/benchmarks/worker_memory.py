@@ -0,0 +1,81 @@
+"""
+Per-worker private memory over an epoch when sample metadata is a Python list
+of strings vs. a `StringArray` (see datasets/sample_table.py).
+
+Forked workers share the parent's memory copy-on-write. Each worker reports its
+private (unshared) memory, from /proc/self/smaps_rollup (Linux only), at the start
+and end of the epoch. With a list, refcount updates copy the pages holding the
+strings into each worker, so private memory grows with the number of samples
+touched. With a StringArray it stays flat.
+
+Usage (from skp/):
+    python benchmarks/worker_memory.py --num-samples 5000000 --num-workers 8
+"""
+import argparse
+import numpy as np
+import os
+import sys
+import torch
+
+from torch.utils.data import DataLoader, Dataset
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datasets.sample_table import StringArray
+
+
+def private_mb():
+    total = 0
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Private_Clean") or line.startswith("Private_Dirty"):
+                total += int(line.split()[1])
+    return total / 1024
+
+
+class MetadataDataset(Dataset):
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def __getitem__(self, i):
+        # touch metadata as a dataset would, e.g. to build a filepath
+        _ = os.path.join("/data", self.inputs[i])
+        worker_info = torch.utils.data.get_worker_info()
+        return worker_info.id if worker_info is not None else -1, private_mb()
+
+
+def run(inputs, num_workers, batch_size):
+    loader = DataLoader(MetadataDataset(inputs), batch_size=batch_size, shuffle=True,
+                        num_workers=num_workers, collate_fn=lambda batch: batch[-1],
+                        multiprocessing_context="fork")
+    first, last = {}, {}
+    for worker_id, mb in loader:
+        first.setdefault(worker_id, mb)
+        last[worker_id] = mb
+    start = np.mean(list(first.values()))
+    end = np.mean(list(last.values()))
+    return start, end
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-samples", type=int, default=5_000_000)
+    parser.add_argument("--num-workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    args = parser.parse_args()
+
+    as_list = [f"study_{i // 100}/series_{i // 10}/crop_{i:09d}_000.png" for i in range(args.num_samples)]
+    as_array = StringArray(as_list)
+    print(f"num_samples={args.num_samples}, num_workers={args.num_workers}, StringArray={as_array.nbytes / 2 ** 20:.0f} MiB")
+    print(f"{'container':<12}{'private MiB at start':>24}{'at end':>12}{'growth':>12}")
+    for name, inputs in [("list", as_list), ("StringArray", as_array)]:
+        start, end = run(inputs, args.num_workers, args.batch_size)
+        print(f"{name:<12}{start:>24.0f}{end:>12.0f}{end - start:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,68 @@ from types import SimpleNamespace
 
 class Config(SimpleNamespace):
 
-    def __getattribute__(self, value):
-        try:
-            return super().__getattribute__(value)
-        except AttributeError:
-            return None  
+    def __getattr__(self, value):
+        # only called if normal lookup fails, so missing keys return None
+        # without slowing down lookups of keys which are set
+        if value.startswith("__"):
+            raise AttributeError(value)
+        return None
+
+
+class FrozenConfig:
+    """
+    Immutable snapshot of a `Config`, created with `freeze(cfg)`.
+
+    Each snapshot gets its own subclass with one slot per key, so reading a key
+    is a plain slot lookup. Missing keys return None like `Config`. The first
+    read of a missing key stores None on the snapshot's class, so later reads
+    are class attribute lookups instead of raising and catching AttributeError.
+
+    Setting a key raises AttributeError. Use `replace(cfg, key=value)` to derive a
+    new snapshot. Values are not copied, so dicts (e.g., `optimizer_params`) can
+    still be modified in place.
+    """
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        type.__setattr__(type(self), name, None)
+        return None
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"cannot set `{name}`, config is frozen, use `replace(cfg, {name}=...)`")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"cannot delete `{name}`, config is frozen")
+
+    @property
+    def __dict__(self):
+        # copy, for code which reads `cfg.__dict__`
+        return {k: getattr(self, k) for k in type(self).__slots__}
+
+    def __repr__(self):
+        return "FrozenConfig(" + ", ".join(f"{k}={v!r}" for k, v in self.__dict__.items()) + ")"
+
+    def __reduce__(self):
+        # snapshot classes are created at runtime, so pickle as a Config
+        return freeze, (thaw(self), )
+
+
+def freeze(cfg):
+    values = dict(cfg.__dict__)
+    snapshot_class = type("FrozenConfig", (FrozenConfig, ), {"__slots__": tuple(values.keys())})
+    snapshot = object.__new__(snapshot_class)
+    for k, v in values.items():
+        object.__setattr__(snapshot, k, v)
+    return snapshot
+
+
+def thaw(cfg):
+    return Config(**cfg.__dict__)
+
+
+def replace(cfg, **kwargs):
+    # returns a copy of `cfg` (Config or FrozenConfig) with keys in `kwargs` set
+    new_cfg = Config(**{**cfg.__dict__, **kwargs})
+    return freeze(new_cfg) if isinstance(cfg, FrozenConfig) else new_cfg
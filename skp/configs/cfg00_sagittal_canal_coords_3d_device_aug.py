@@ -0,0 +1,81 @@
+import cv2
+
+from .base import Config
+
+
+cfg = Config()
+cfg.neptune_mode = "async"
+
+cfg.save_dir = "experiments/"
+cfg.project = "gradientecho/rsna-lspine"
+
+cfg.task = "classification"
+
+cfg.model = "net_x3d"
+cfg.backbone = "x3d_l"
+cfg.pretrained = True
+cfg.num_input_channels = 1
+cfg.pool = "gem"
+cfg.pool_params = dict(p=3)
+cfg.z_strides = [2, 1, 1, 1, 1]
+cfg.dropout = 0.2
+cfg.num_classes = 15
+cfg.normalization = "-1_1"
+cfg.normalization_params = {"min": 0, "max": 255}
+
+cfg.fold = 0 
+cfg.dataset = "simple_lspine_3d_png_albumentations_canal_with_flips"
+cfg.data_dir = "/home/ian/projects/rsna-lspine/data/train_pngs_v2/"
+cfg.annotations_file = "/home/ian/projects/rsna-lspine/data/train_sagittal_canal_coords_3d_kfold.csv"
+cfg.inputs = "series_folder"
+cfg.targets = [
+    "canal_l1_l2_slice", "canal_l1_l2_x", "canal_l1_l2_y",
+    "canal_l2_l3_slice", "canal_l2_l3_x", "canal_l2_l3_y",
+    "canal_l3_l4_slice", "canal_l3_l4_x", "canal_l3_l4_y",
+    "canal_l4_l5_slice", "canal_l4_l5_x", "canal_l4_l5_y",
+    "canal_l5_s1_slice", "canal_l5_s1_x", "canal_l5_s1_y"
+]
+cfg.cv2_load_flag = cv2.IMREAD_GRAYSCALE
+cfg.num_workers = 2
+cfg.pin_memory = True
+cfg.sampler = "IterationBasedSampler"
+cfg.num_iterations_per_epoch = 1000
+
+cfg.loss = "L1Loss"
+cfg.loss_params = {}
+
+cfg.batch_size = 12
+cfg.num_epochs = 10
+cfg.optimizer = "AdamW"
+cfg.optimizer_params = {"lr": 3e-4}
+
+cfg.scheduler = "CosineAnnealingLR"
+cfg.scheduler_params = {"eta_min": 0}
+cfg.scheduler_interval = "step"
+
+cfg.val_batch_size = cfg.batch_size * 2
+cfg.metrics = ["MAESigmoid"]
+cfg.val_metric = "mae"
+cfg.val_track = "min"
+
+cfg.image_height = 448
+cfg.image_width = 448
+cfg.image_z = 20
+
+# Flips, affine, gamma, noise and resizing are applied to the whole batch on GPU
+# see tasks/device_augmentation.py
+# train_transforms/val_transforms are not used in this mode
+cfg.device_augmentation = dict(
+    output_size=(cfg.image_height, cfg.image_width),
+    flip_z=0.5, flip_y=0.5, flip_x=0.5,
+    rotate=15, scale=(0.9, 1.1), translate=0.05, affine_p=0.5,
+    gamma=(0.8, 1.2), gamma_p=0.3,
+    noise_std=(0, 5), noise_p=0.3,
+    coords=dict(
+        z=[0, 3, 6, 9, 12],
+        x=[1, 4, 7, 10, 13],
+        y=[2, 5, 8, 11, 14]
+    )
+)
+cfg.train_transforms = None
+cfg.val_transforms = None
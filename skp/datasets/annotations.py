@@ -0,0 +1,166 @@
+"""
+Compiled columnar annotation index.
+
+`compile_annotations` converts an annotations CSV into a directory of one `.npy`
+file per column (plus `meta.json`), with derived columns (e.g., `crop_index`
+parsed from `filepath`) computed once at compile time:
+
+    <annotations_file without .csv>.annot/meta.json
+    <annotations_file without .csv>.annot/<column>.npy
+
+Columns are memory-mapped on load, so reading the index takes milliseconds, only
+the `fold` (and `ignore_during_val`) columns are read in full to select rows,
+and only the selected rows of the other columns are materialized. Pages are
+shared through the page cache between train/val datasets and all workers.
+
+`read_annotations(cfg, mode)` is a drop-in replacement for
+`pd.read_csv(cfg.annotations_file)` in `Dataset.__init__`. If a compiled index
+exists next to the CSV and is newer than it (or `cfg.annotations_file` points to
+the index directly), it is used and rows are filtered by fold before building the
+DataFrame. Otherwise the CSV is read as before. Datasets keep their own fold
+filters, which are then no-ops.
+
+Compile with:
+
+    python -m datasets.annotations /path/to/train_crops.csv [/path/to/other.csv ...]
+"""
+import argparse
+import json
+import numpy as np
+import os
+import pandas as pd
+
+
+INDEX_SUFFIX = ".annot"
+META_FILE = "meta.json"
+
+
+def _crop_index(df):
+    return df.filepath.str.split("_").str[-1].str.replace(".png", "", regex=False)
+
+
+def _study_level_laterality_crop(df):
+    return df.study_level_laterality + "_" + df.crop_index
+
+
+# name: (required columns, function of DataFrame)
+# derived columns are added in order, so later ones can use earlier ones
+DERIVED_COLUMNS = {
+    "crop_index": (["filepath"], _crop_index),
+    "study_level_laterality_crop": (["study_level_laterality", "crop_index"], _study_level_laterality_crop),
+}
+
+
+def get_index_dir(annotations_file):
+    if annotations_file.endswith(INDEX_SUFFIX):
+        return annotations_file
+    return os.path.splitext(annotations_file)[0] + INDEX_SUFFIX
+
+
+def is_index(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, META_FILE))
+
+
+def _column_filename(column):
+    return f"{column.replace('/', '_')}.npy"
+
+
+def compile_annotations(annotations_file, index_dir=None, derived_columns=DERIVED_COLUMNS):
+    index_dir = index_dir or get_index_dir(annotations_file)
+    df = pd.read_csv(annotations_file)
+    for name, (required, fn) in derived_columns.items():
+        if name not in df.columns and all(c in df.columns for c in required):
+            df[name] = fn(df)
+    os.makedirs(index_dir, exist_ok=True)
+    meta = {"source": os.path.abspath(annotations_file), "num_rows": len(df), "columns": []}
+    for column in df.columns:
+        values = df[column]
+        entry = {"name": column, "file": _column_filename(column), "null_file": None, "kind": "numeric"}
+        if values.dtype == object:
+            isnull = values.isnull().values
+            values = values.fillna("").astype(str)
+            # byte strings take a quarter of the space of unicode, if possible
+            try:
+                array = values.values.astype("S")
+                entry["kind"] = "bytes"
+            except UnicodeEncodeError:
+                array = values.values.astype("U")
+                entry["kind"] = "unicode"
+            if isnull.any():
+                entry["null_file"] = _column_filename(f"{column}.isnull")
+                np.save(os.path.join(index_dir, entry["null_file"]), isnull)
+        elif values.dtype == bool or np.issubdtype(values.dtype, np.number):
+            array = values.values
+        else:
+            # e.g., categoricals or datetimes
+            array = values.astype(str).values.astype("U")
+            entry["kind"] = "unicode"
+        np.save(os.path.join(index_dir, entry["file"]), array)
+        meta["columns"].append(entry)
+    # meta.json last, so an index is only recognized once complete
+    with open(os.path.join(index_dir, META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+    return index_dir
+
+
+def load_annotation_index(index_dir, rows=None, columns=None):
+    # rows: boolean mask or integer indices to select, applied before materializing
+    with open(os.path.join(index_dir, META_FILE)) as f:
+        meta = json.load(f)
+    data = {}
+    for entry in meta["columns"]:
+        if columns is not None and entry["name"] not in columns:
+            continue
+        array = np.load(os.path.join(index_dir, entry["file"]), mmap_mode="r")
+        array = array[rows] if rows is not None else np.asarray(array)
+        if entry["kind"] != "numeric":
+            array = array.astype("U").astype(object)
+            if entry["null_file"] is not None:
+                isnull = np.load(os.path.join(index_dir, entry["null_file"]), mmap_mode="r")
+                isnull = isnull[rows] if rows is not None else np.asarray(isnull)
+                array[isnull] = np.nan
+        data[entry["name"]] = array
+    return pd.DataFrame(data)
+
+
+def select_rows(index_dir, cfg, mode=None, ignore_during_val=False):
+    # fold pushdown, mirrors the filters in Dataset.__init__
+    if mode not in ["train", "val"] or cfg.fold is None or cfg.fold == -1:
+        return None
+    fold_file = os.path.join(index_dir, _column_filename("fold"))
+    if not os.path.exists(fold_file):
+        return None
+    fold = np.load(fold_file, mmap_mode="r")
+    if mode == "train":
+        return None if cfg.fullfit else np.where(fold != cfg.fold)[0]
+    rows = fold == cfg.fold
+    ignore_file = os.path.join(index_dir, _column_filename("ignore_during_val"))
+    if ignore_during_val and os.path.exists(ignore_file):
+        rows &= np.load(ignore_file, mmap_mode="r") == 0
+    return np.where(rows)[0]
+
+
+def read_annotations(cfg, mode=None, ignore_during_val=False, columns=None):
+    """
+    Returns DataFrame of annotations for `mode` ("train" or "val"), using the
+    compiled index if available. If `ignore_during_val=True`, validation rows
+    with `ignore_during_val != 0` are also dropped.
+    """
+    annotations_file = cfg.annotations_file
+    index_dir = get_index_dir(annotations_file)
+    use_index = is_index(index_dir) and (
+        annotations_file == index_dir or not os.path.exists(annotations_file)
+        or os.path.getmtime(os.path.join(index_dir, META_FILE)) >= os.path.getmtime(annotations_file)
+    )
+    if not use_index:
+        return pd.read_csv(annotations_file)
+    rows = select_rows(index_dir, cfg, mode, ignore_during_val)
+    return load_annotation_index(index_dir, rows=rows, columns=columns)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("annotations_files", type=str, nargs="+")
+    args = parser.parse_args()
+    for annotations_file in args.annotations_files:
+        print(f"Compiling {annotations_file} -> {compile_annotations(annotations_file)} ...")
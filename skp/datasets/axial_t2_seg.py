@@ -1,10 +1,10 @@
 import cv2
 import numpy as np
 import os
-import pandas as pd
 import torch
 
 from torch.utils.data import Dataset as TorchDataset, default_collate
+from .annotations import read_annotations
 
 
 train_collate_fn = default_collate
@@ -16,7 +16,7 @@ class Dataset(TorchDataset):
     def __init__(self, cfg, mode):
         self.cfg = cfg 
         self.mode = mode
-        df = pd.read_csv(self.cfg.annotations_file)
+        df = read_annotations(self.cfg, self.mode)
         if self.mode == "train":
             df = df[df.fold != self.cfg.fold]
             self.transforms = self.cfg.train_transforms
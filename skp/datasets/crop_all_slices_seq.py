@@ -1,10 +1,12 @@
 import cv2
 import numpy as np
 import os
-import pandas as pd
 import torch
 
 from torch.utils.data import Dataset as TorchDataset, default_collate
+from .annotations import read_annotations
+from .sample_table import StringArray, group_offsets
+from tasks.input_pipeline import to_input_tensor
 
 
 train_collate_fn = default_collate
@@ -16,7 +18,7 @@ class Dataset(TorchDataset):
     def __init__(self, cfg, mode):
         self.cfg = cfg 
         self.mode = mode
-        df = pd.read_csv(self.cfg.annotations_file)
+        df = read_annotations(self.cfg, self.mode, ignore_during_val=True)
         if self.mode == "train":
             df = df[df.fold != self.cfg.fold]
             self.transforms = self.cfg.train_transforms
@@ -27,27 +29,36 @@ class Dataset(TorchDataset):
                 df = df[df.ignore_during_val == 0]
             self.transforms = self.cfg.val_transforms
 
-        df["crop_index"] = df.filepath.apply(lambda x: x.split("_")[-1].replace(".png", ""))
-        df["study_level_laterality_crop"] = df.study_level_laterality + "_" + df.crop_index
-        self.df = [_df for _, _df in df.groupby("study_level_laterality_crop")]
+        # precomputed in compiled annotation index, see datasets/annotations.py
+        if "crop_index" not in df.columns:
+            df["crop_index"] = df.filepath.apply(lambda x: x.split("_")[-1].replace(".png", ""))
+        if "study_level_laterality_crop" not in df.columns:
+            df["study_level_laterality_crop"] = df.study_level_laterality + "_" + df.crop_index
+        # sort once so that each group is a contiguous run of rows ordered by position_index
+        # and keep flat columns with start/end offsets per group, see datasets/sample_table.py
+        df = df.sort_values(["study_level_laterality_crop", "position_index"], kind="stable")
+        self.starts, self.ends = group_offsets(df.study_level_laterality_crop.values)
+        self.filepaths = StringArray(df.filepath)
+        self.targets = df[self.cfg.targets].values
+        self.unique_ids = df.unique_id.values
 
         self.collate_fn = train_collate_fn if mode == "train" else val_collate_fn
 
     def __len__(self):
-        return len(self.df) 
+        return len(self.starts) 
 
     def get(self, i):
         try:
-            df = self.df[i]
-            df = df.sort_values("position_index")
-            if len(df) > self.cfg.max_num_images:
+            start, end = self.starts[i], self.ends[i]
+            if end - start > self.cfg.max_num_images:
                 # Trim off both ends equally if exceeds number of images
-                diff = len(df) - self.cfg.max_num_images
+                diff = end - start - self.cfg.max_num_images
                 diff = diff // 2
-                df = df.iloc[diff:(diff + self.cfg.max_num_images)]
-            x = [cv2.imread(os.path.join(self.cfg.data_dir, fp), self.cfg.cv2_load_flag) for fp in df.filepath.tolist()]
-            y = df[self.cfg.targets].values
-            return x, y, df.unique_id.values[0]
+                start = start + diff
+                end = start + self.cfg.max_num_images
+            x = [cv2.imread(os.path.join(self.cfg.data_dir, self.filepaths[j]), self.cfg.cv2_load_flag) for j in range(start, end)]
+            y = self.targets[start:end]
+            return x, y, self.unique_ids[start]
         except Exception as e:
             print(e)
             return None
@@ -83,7 +94,7 @@ class Dataset(TorchDataset):
             mask = mask + [True] * diff
 
         x = x.transpose(0, 3, 1, 2) # channels-last -> channels-first
-        x = torch.tensor(x).float()
+        x = to_input_tensor(x, self.cfg)
         y = torch.tensor(y).float()
 
         if self.cfg.convert_to_3d:
@@ -0,0 +1,121 @@
+"""
+Sharded cache of pre-decoded crops.
+
+Small crop PNGs are decoded once and packed into a few large flat uint8 shard
+files (`shard_XXXX.bin`) per fold, with an index (`index.npz`) holding, for each
+crop, its key (the value of `cfg.inputs`, e.g. the filepath relative to
+`cfg.data_dir`), `unique_id`, fold, shard number, byte offset and shape.
+
+Shards are memory-mapped lazily in each dataloader worker, so reading a crop is
+a slice of an mmap instead of an open + PNG decode per sample, and the number
+of files on shared storage drops from one per crop to a few per fold.
+
+Build with `build_crop_shards` (see etl/0008b_pack_gt_crops_with_augs_into_shards.py),
+then set `cfg.crop_cache_dir` to use it in the 2D datasets. The cache must be built
+with the same `cv2_load_flag` as the config using it, which is checked on load.
+"""
+import cv2
+import numpy as np
+import os
+
+from tqdm import tqdm
+
+
+INDEX_FILE = "index.npz"
+
+
+def shard_filename(shard):
+    return f"shard_{shard:04d}.bin"
+
+
+def build_crop_shards(df, data_dir, save_dir, inputs="filepath", cv2_load_flag=cv2.IMREAD_COLOR, max_shard_bytes=2 ** 30):
+    # df must contain `inputs`, unique_id and fold columns
+    os.makedirs(save_dir, exist_ok=True)
+    df = df.drop_duplicates(inputs).sort_values("fold", kind="stable").reset_index(drop=True)
+    keys, shards, offsets, shapes, found = [], [], [], [], []
+    shard, offset, current_fold, f = -1, 0, None, None
+    for row_index, (key, fold) in tqdm(enumerate(zip(df[inputs], df.fold)), total=len(df)):
+        img = cv2.imread(os.path.join(data_dir, key), cv2_load_flag)
+        if img is None:
+            print(f"Unable to read {key}, skipping ...")
+            continue
+        if img.ndim == 2:
+            img = np.expand_dims(img, axis=-1)
+        # Shards never mix folds, so a given split only touches its own shards
+        if f is None or fold != current_fold or offset + img.nbytes > max_shard_bytes:
+            if f is not None:
+                f.close()
+            shard += 1
+            offset, current_fold = 0, fold
+            f = open(os.path.join(save_dir, shard_filename(shard)), "wb")
+        f.write(np.ascontiguousarray(img).tobytes())
+        keys.append(key)
+        shards.append(shard)
+        offsets.append(offset)
+        shapes.append(img.shape)
+        found.append(row_index)
+        offset += img.nbytes
+    if f is not None:
+        f.close()
+    df = df.iloc[found]
+    unique_ids = df.unique_id.values if "unique_id" in df.columns else df[inputs].values
+    np.savez(os.path.join(save_dir, INDEX_FILE),
+             keys=np.asarray(keys).astype("U"),
+             unique_ids=unique_ids.astype("U"),
+             folds=df.fold.values.astype("int16"),
+             shards=np.asarray(shards).astype("int32"),
+             offsets=np.asarray(offsets).astype("int64"),
+             shapes=np.asarray(shapes).astype("int32"),
+             cv2_load_flag=np.asarray(cv2_load_flag))
+
+
+class CropShards:
+    """
+    Read-only view of a crop shard cache aligned to a list of dataset inputs,
+    i.e., `CropShards(cache_dir, keys=self.inputs)[i]` returns the crop for `self.inputs[i]`.
+    `cv2_load_flag` of the config must match the one the cache was built with.
+    """
+    def __init__(self, cache_dir, keys, cv2_load_flag):
+        self.cache_dir = cache_dir
+        with np.load(os.path.join(cache_dir, INDEX_FILE)) as index:
+            cache_flag = int(index["cv2_load_flag"])
+            assert cache_flag == cv2_load_flag, \
+                f"crop cache {cache_dir} was built with cv2_load_flag={cache_flag}, config has {cv2_load_flag}"
+            cache_keys = index["keys"]
+            sorter = np.argsort(cache_keys)
+            keys = np.asarray(keys).astype("U")
+            rows = np.searchsorted(cache_keys, keys, sorter=sorter)
+            rows = sorter[np.clip(rows, 0, len(cache_keys) - 1)]
+            missing = cache_keys[rows] != keys
+            assert not np.any(missing), f"{missing.sum()} inputs not found in crop cache {cache_dir}, e.g. {keys[missing][0]}"
+            # only keep the fields needed for lookup, aligned to the dataset
+            self.shards = index["shards"][rows]
+            self.offsets = index["offsets"][rows]
+            self.shapes = index["shapes"][rows]
+        # opened lazily so that each dataloader worker maps its own shards
+        self.mmaps = {}
+
+    def __len__(self):
+        return len(self.shards)
+
+    def get_shard(self, shard):
+        if shard not in self.mmaps:
+            self.mmaps[shard] = np.memmap(os.path.join(self.cache_dir, shard_filename(shard)), dtype=np.uint8, mode="r")
+        return self.mmaps[shard]
+
+    def __getitem__(self, i):
+        shape = self.shapes[i]
+        start = self.offsets[i]
+        flat = self.get_shard(int(self.shards[i]))[start:start + int(np.prod(shape))]
+        # copy so that downstream in-place ops do not touch the read-only map
+        x = np.array(flat).reshape(shape)
+        if x.shape[-1] == 1:
+            # match cv2.imread with cv2.IMREAD_GRAYSCALE, which returns (H, W)
+            x = x[..., 0]
+        return x
+
+    def __getstate__(self):
+        # do not pickle open maps when sending to spawned workers
+        state = self.__dict__.copy()
+        state["mmaps"] = {}
+        return state
@@ -1,11 +1,11 @@
 import cv2
 import numpy as np
 import os
-import pandas as pd
 import pickle
 import torch
 
 from torch.utils.data import Dataset as TorchDataset, default_collate
+from tasks.input_pipeline import to_input_tensor
 
 
 train_collate_fn = default_collate
@@ -67,7 +67,7 @@ class Dataset(TorchDataset):
         elif len(x) < num_images:
             diff = num_images - len(x)
             padding = [False] * len(x) + [True] * diff
-            img_pad = np.zeros((diff, x.shape[1], x.shape[2], x.shape[3]))
+            img_pad = np.zeros((diff, x.shape[1], x.shape[2], x.shape[3]), dtype=x.dtype)
             x = np.concatenate([x, img_pad])
             dist_pad = np.zeros((diff, y_dist.shape[1]))
             y_dist = np.concatenate([y_dist, dist_pad])
@@ -77,7 +77,7 @@ class Dataset(TorchDataset):
             padding = [False] * num_images
 
         x = torch.from_numpy(x)
-        x = x.float()
+        x = to_input_tensor(x, self.cfg)
         x = x.permute(0, 3, 1, 2) # (N, C, H, W)
         y_dist = torch.tensor(y_dist).float()
         y_coord = torch.tensor(y_coord).float()
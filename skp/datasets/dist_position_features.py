@@ -1,10 +1,11 @@
 import numpy as np
 import os
-import pandas as pd
 import torch
 import torch.nn.functional as F
 
 from torch.utils.data import Dataset as TorchDataset, default_collate
+from .annotations import read_annotations
+from .sample_table import StringArray
 
 
 train_collate_fn = default_collate
@@ -16,7 +17,7 @@ class Dataset(TorchDataset):
     def __init__(self, cfg, mode):
         self.cfg = cfg 
         self.mode = mode
-        df = pd.read_csv(self.cfg.annotations_file)
+        df = read_annotations(self.cfg, self.mode)
         if self.mode == "train":
             df = df[df.fold != self.cfg.fold]
             self.transforms = self.cfg.train_transforms
@@ -24,7 +25,7 @@ class Dataset(TorchDataset):
             df = df[df.fold == self.cfg.fold]
             self.transforms = self.cfg.val_transforms
 
-        self.inputs = df.features.tolist()
+        self.inputs = StringArray(df.features)
         self.labels = df.labels.tolist() 
 
         self.collate_fn = train_collate_fn if mode == "train" else val_collate_fn
@@ -1,10 +1,11 @@
 import numpy as np
 import os
-import pandas as pd
 import torch
 import torch.nn.functional as F
 
 from torch.utils.data import Dataset as TorchDataset, default_collate
+from .annotations import read_annotations
+from .sample_table import StringArray
 
 
 train_collate_fn = default_collate
@@ -16,7 +17,7 @@ class Dataset(TorchDataset):
     def __init__(self, cfg, mode):
         self.cfg = cfg 
         self.mode = mode
-        df = pd.read_csv(self.cfg.annotations_file)
+        df = read_annotations(self.cfg, self.mode)
         if self.mode == "train":
             df = df[df.fold != self.cfg.fold]
             self.transforms = self.cfg.train_transforms
@@ -24,7 +25,7 @@ class Dataset(TorchDataset):
             df = df[df.fold == self.cfg.fold]
             self.transforms = self.cfg.val_transforms
 
-        self.inputs = df.features.tolist()
+        self.inputs = StringArray(df.features)
         col_names = ["l1_l2", "l2_l3", "l3_l4", "l4_l5", "l5_s1"]
         col_names = [_ + "_position_index" for _ in col_names]
         self.labels = df[col_names].values
@@ -1,10 +1,12 @@
 import cv2
 import numpy as np
 import os
-import pandas as pd
 import torch
 
 from torch.utils.data import Dataset as TorchDataset, default_collate
+from .annotations import read_annotations
+from .sample_table import StringArray
+from tasks.input_pipeline import to_input_tensor
 
 
 train_collate_fn = default_collate
@@ -16,7 +18,7 @@ class Dataset(TorchDataset):
     def __init__(self, cfg, mode):
         self.cfg = cfg 
         self.mode = mode
-        df = pd.read_csv(self.cfg.annotations_file)
+        df = read_annotations(self.cfg, self.mode)
         if self.mode == "train":
             df = df[df.fold != self.cfg.fold]
             self.transforms = self.cfg.train_transforms
@@ -26,7 +28,7 @@ class Dataset(TorchDataset):
             self.transforms = self.cfg.val_transforms
 
         self.df = df.reset_index(drop=True)
-        self.inputs = df[self.cfg.inputs].tolist()
+        self.inputs = StringArray(df[self.cfg.inputs])
         self.labels = df[self.cfg.targets].values 
 
         self.collate_fn = train_collate_fn if mode == "train" else val_collate_fn
@@ -70,7 +72,7 @@ class Dataset(TorchDataset):
         transformed = self.transforms(image=x, mask=mask)
         x, mask = transformed["image"], transformed["mask"]
         x, mask = x.transpose(2, 0, 1), mask.transpose(2, 0, 1)
-        x, mask = torch.from_numpy(x).float(), torch.from_numpy(mask).float()
+        x, mask = to_input_tensor(x, self.cfg), torch.from_numpy(mask).float()
         y = torch.tensor(y).float()
 
         return {"x": x, "y_cls": y, "y_seg": mask, "index": i}
@@ -1,11 +1,12 @@
 import cv2
 import numpy as np
 import os
-import pandas as pd
 import pickle
 import torch
 
 from torch.utils.data import Dataset as TorchDataset, default_collate
+from .sample_table import StringArray
+from tasks.input_pipeline import to_input_tensor
 
 
 train_collate_fn = default_collate
@@ -26,21 +27,28 @@ class Dataset(TorchDataset):
             ann = [a for a in ann if a["fold"] == cfg.fold]
             self.transforms = self.cfg.val_transforms
 
-        self.ann = ann
         self.levels = ["L1_L2", "L2_L3", "L3_L4", "L4_L5", "L5_S1"]
+        # flatten files of all samples and levels into one array, with start/end
+        # offsets of the files of each (sample, level), see datasets/sample_table.py
+        files = [f for a in ann for each_level in self.levels for f in a["files"][each_level]]
+        lengths = np.asarray([len(a["files"][each_level]) for a in ann for each_level in self.levels], dtype=np.int64)
+        self.files = StringArray(files)
+        self.ends = np.cumsum(lengths).reshape(len(ann), len(self.levels))
+        self.starts = self.ends - lengths.reshape(len(ann), len(self.levels))
+        self.labels = np.stack([a["labels"] for a in ann]) if len(ann) > 0 else np.zeros((0, len(self.levels), 3))
         self.collate_fn = train_collate_fn if mode == "train" else val_collate_fn
 
     def __len__(self):
-        return len(self.ann) 
+        return len(self.labels) 
 
     def get(self, i):
         try:
             image_list = []
-            for each_level in self.levels:
-                level_files = self.ann[i]["files"][each_level]
-                image_list.append(np.random.choice(level_files))
+            for level_idx in range(len(self.levels)):
+                # randomly choose one of the files for each level
+                image_list.append(self.files[np.random.randint(self.starts[i, level_idx], self.ends[i, level_idx])])
             x = [cv2.imread(os.path.join(self.cfg.data_dir, img), self.cfg.cv2_load_flag) for img in image_list]
-            y = self.ann[i]["labels"]
+            y = self.labels[i].copy()
             return x, y
         except Exception as e:
             print(e)
@@ -61,7 +69,7 @@ class Dataset(TorchDataset):
         xt = self.transforms(**to_transform)
         x = np.stack([xt["image"]] + [xt[f"image{idx}"] for idx in range(1, len(x))])
         x = torch.from_numpy(x)
-        x = x.float()
+        x = to_input_tensor(x, self.cfg)
         # x.shape = (5, H, W, C)
 
         x = x.permute(0, 3, 1, 2) # channels-last -> channels-first
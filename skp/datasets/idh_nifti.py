@@ -3,10 +3,11 @@ import glob
 import nibabel as nib
 import numpy as np
 import os
-import pandas as pd
 import torch
 
 from torch.utils.data import Dataset as TorchDataset, default_collate
+from .annotations import read_annotations
+from .sample_table import StringArray
 
 
 train_collate_fn = default_collate
@@ -18,7 +19,7 @@ class Dataset(TorchDataset):
     def __init__(self, cfg, mode):
         self.cfg = cfg 
         self.mode = mode
-        df = pd.read_csv(self.cfg.annotations_file)
+        df = read_annotations(self.cfg, self.mode)
         if self.mode == "train":
             df = df[df.fold != self.cfg.fold]
             self.transforms = self.cfg.train_transforms
@@ -26,7 +27,7 @@ class Dataset(TorchDataset):
             df = df[df.fold == self.cfg.fold]
             self.transforms = self.cfg.val_transforms
 
-        self.inputs = df[self.cfg.inputs].tolist()
+        self.inputs = StringArray(df[self.cfg.inputs])
         self.labels = df[self.cfg.targets[0]].tolist() 
 
         self.collate_fn = train_collate_fn if mode == "train" else val_collate_fn
@@ -3,12 +3,12 @@ import cv2
 import glob
 import numpy as np
 import os
-import pandas as pd
 import pickle
 import torch
 
 from scipy.ndimage import zoom
 from torch.utils.data import Dataset as TorchDataset, default_collate
+from . import volume_store
 
 
 train_collate_fn = default_collate
@@ -17,6 +17,9 @@ val_collate_fn = default_collate
 
 class Dataset(TorchDataset):
 
+    # levels are cropped at random during validation too, see `crop_to_level_range`
+    val_is_random = True
+
     def __init__(self, cfg, mode):
         self.cfg = cfg 
         self.mode = mode
@@ -94,12 +97,22 @@ class Dataset(TorchDataset):
         return arr, np.asarray(coords), level_labels
 
     def load_stack_and_annotation(self, i):
-        # assumes that inputs are list of directories
-        # where each directory contains all the images in a stack as PNG 
-        # and that filenames are sortable
-        images = np.sort(glob.glob(os.path.join(self.cfg.data_dir, self.annotations[i]["series_folder"], "*.png")))
-        x = np.stack([cv2.imread(im, self.cfg.cv2_load_flag) for im in images], axis=0)
-        x, coords, level_labels = self.crop_to_level_range(x, i)
+        if self.cfg.volume_store:
+            # series is packed into a single memory-mapped array
+            # see datasets/volume_store.py
+            # cropping and resampling operate directly on the memmap
+            # so only the selected slices are read from disk
+            x = volume_store.open_volume(os.path.join(self.cfg.data_dir, self.annotations[i]["series_folder"]))
+            x, coords, level_labels = self.crop_to_level_range(x, i)
+            x = volume_store.take_slices(x)
+            x = volume_store.match_load_flag(x, self.cfg.cv2_load_flag)
+        else:
+            # assumes that inputs are list of directories
+            # where each directory contains all the images in a stack as PNG 
+            # and that filenames are sortable
+            images = np.sort(glob.glob(os.path.join(self.cfg.data_dir, self.annotations[i]["series_folder"], "*.png")))
+            x = np.stack([cv2.imread(im, self.cfg.cv2_load_flag) for im in images], axis=0)
+            x, coords, level_labels = self.crop_to_level_range(x, i)
         if x.ndim == 3:
             x = np.expand_dims(x, axis=-1)
         # x.shape = (Z, H, W, C)
@@ -1,10 +1,11 @@
 import cv2
 import numpy as np
 import os
-import pandas as pd
 import torch
 
 from torch.utils.data import Dataset as TorchDataset, default_collate
+from .annotations import read_annotations
+from .sample_table import StringArray
 
 
 train_collate_fn = default_collate
@@ -16,7 +17,7 @@ class Dataset(TorchDataset):
     def __init__(self, cfg, mode):
         self.cfg = cfg 
         self.mode = mode
-        df = pd.read_csv(self.cfg.annotations_file)
+        df = read_annotations(self.cfg, self.mode)
         if self.mode == "train":
             df = df[df.fold != self.cfg.fold]
             self.transforms = self.cfg.train_transforms
@@ -26,7 +27,7 @@ class Dataset(TorchDataset):
             self.transforms = self.cfg.val_transforms
 
         self.df = df.reset_index(drop=True)
-        self.inputs = df[cfg.inputs].values
+        self.inputs = StringArray(df[cfg.inputs])
         self.labels = df[cfg.targets].values
         if "sampling_weight" in df.columns:
             self.sampling_weights = df.sampling_weight.values
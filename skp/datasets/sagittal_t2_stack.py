@@ -2,11 +2,12 @@ import cv2
 import glob
 import numpy as np
 import os
-import pandas as pd
 import torch
 
 from scipy.ndimage import zoom
 from torch.utils.data import Dataset as TorchDataset, default_collate
+from .annotations import read_annotations
+from tasks.input_pipeline import to_input_tensor
 
 
 train_collate_fn = default_collate
@@ -18,7 +19,7 @@ class Dataset(TorchDataset):
     def __init__(self, cfg, mode):
         self.cfg = cfg 
         self.mode = mode
-        df = pd.read_csv(self.cfg.annotations_file)
+        df = read_annotations(self.cfg, self.mode)
         if self.mode == "train":
             df = df[df.fold != self.cfg.fold]
             self.transforms = self.cfg.train_transforms
@@ -84,8 +85,7 @@ class Dataset(TorchDataset):
 
         x = torch.from_numpy(x)
         x = x.permute(0, 3, 1, 2)
-        x = x.float()
-
+        x = to_input_tensor(x, self.cfg)
         y = torch.from_numpy(y)
         y = y.float()
 
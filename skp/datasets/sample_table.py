@@ -0,0 +1,74 @@
+"""
+Refcount-free containers for per-sample metadata.
+
+Dataloader workers are forked from the main process and share its memory
+copy-on-write. A Python list of N strings is N separate objects, and reading any
+of them from a worker updates its refcount, which writes to (and so copies) the
+page it lives on. Over an epoch every worker ends up with its own copy of all
+the metadata. NumPy arrays of fixed-width byte strings (or numbers) are a single
+buffer with no per-element objects, so they stay shared.
+
+`StringArray` is a drop-in replacement for `df[col].tolist()` for string columns:
+`StringArray(df[col])[i]` returns a `str`.
+"""
+import numpy as np
+
+
+class StringArray:
+
+    def __init__(self, values):
+        if isinstance(values, StringArray):
+            self.data = values.data
+            return
+        values = np.asarray(values)
+        if values.dtype.kind == "S":
+            self.data = values
+        else:
+            # utf-8, so non-ascii strings are supported, ascii is one byte per character
+            self.data = np.char.encode(values.astype("U"), "utf-8")
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, i):
+        if isinstance(i, (int, np.integer)):
+            return self.data[i].decode("utf-8")
+        return StringArray(self.data[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __array__(self, dtype=None, copy=None):
+        array = np.char.decode(self.data, "utf-8")
+        return array if dtype is None else array.astype(dtype)
+
+    def tolist(self):
+        return list(self)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+
+def compact_column(values):
+    # numeric columns as numpy arrays, strings as StringArray
+    values = np.asarray(values)
+    if values.dtype == object or values.dtype.kind in ["U", "S"]:
+        return StringArray(values)
+    return values
+
+
+def group_offsets(keys):
+    """
+    For `keys` which are already sorted (so that each group is contiguous),
+    returns (starts, ends) arrays such that rows `starts[g]:ends[g]` belong to
+    group `g`, in order of appearance.
+    """
+    keys = np.asarray(keys)
+    if len(keys) == 0:
+        return np.zeros((0, ), dtype=np.int64), np.zeros((0, ), dtype=np.int64)
+    boundaries = np.where(keys[1:] != keys[:-1])[0] + 1
+    starts = np.concatenate([[0], boundaries]).astype(np.int64)
+    ends = np.concatenate([boundaries, [len(keys)]]).astype(np.int64)
+    return starts, ends
@@ -2,10 +2,13 @@ import copy
 import cv2
 import numpy as np
 import os
-import pandas as pd
 import torch
 
 from torch.utils.data import Dataset as TorchDataset, default_collate
+from .crop_shards import CropShards
+from .annotations import read_annotations
+from .sample_table import StringArray
+from tasks.input_pipeline import to_input_tensor
 
 
 train_collate_fn = default_collate
@@ -17,7 +20,7 @@ class Dataset(TorchDataset):
     def __init__(self, cfg, mode):
         self.cfg = cfg 
         self.mode = mode
-        df = pd.read_csv(self.cfg.annotations_file)
+        df = read_annotations(self.cfg, self.mode, ignore_during_val=True)
         if self.mode == "train":
             df = df[df.fold != self.cfg.fold]
             self.transforms = self.cfg.train_transforms
@@ -28,7 +31,10 @@ class Dataset(TorchDataset):
             self.transforms = self.cfg.val_transforms
 
         self.df = df.reset_index(drop=True)
-        self.inputs = df[self.cfg.inputs].tolist()
+        self.inputs = StringArray(df[self.cfg.inputs])
+        if self.cfg.crop_cache_dir:
+            # pre-decoded crops packed into memory-mapped shards, see datasets/crop_shards.py
+            self.crop_cache = CropShards(self.cfg.crop_cache_dir, keys=self.inputs, cv2_load_flag=self.cfg.cv2_load_flag)
         self.labels = df[self.cfg.targets].values 
         self.sample_weights = np.stack([df.rt_sample_weight, df.lt_sample_weight], axis=1)
 
@@ -39,7 +45,10 @@ class Dataset(TorchDataset):
 
     def get(self, i):
         try:
-            x = cv2.imread(os.path.join(self.cfg.data_dir, self.inputs[i]), self.cfg.cv2_load_flag)
+            if self.cfg.crop_cache_dir:
+                x = self.crop_cache[i]
+            else:
+                x = cv2.imread(os.path.join(self.cfg.data_dir, self.inputs[i]), self.cfg.cv2_load_flag)
             if isinstance(self.cfg.select_image_channel, int):
                 x = x[..., self.cfg.select_image_channel]
                 x = np.expand_dims(x, axis=-1)
@@ -76,7 +85,7 @@ class Dataset(TorchDataset):
             x = np.expand_dims(x, axis=-1)
 
         x = x.transpose(2, 0, 1) # channels-last -> channels-first
-        x = torch.tensor(x).float()
+        x = to_input_tensor(x, self.cfg)
         if y.ndim == 0:
             y = torch.tensor(y).float().unsqueeze(-1)
 
@@ -1,10 +1,12 @@
 import cv2
 import numpy as np
 import os
-import pandas as pd
 import torch
 
 from torch.utils.data import Dataset as TorchDataset, default_collate
+from .annotations import read_annotations
+from .sample_table import StringArray
+from tasks.input_pipeline import to_input_tensor
 
 
 train_collate_fn = default_collate
@@ -16,7 +18,7 @@ class Dataset(TorchDataset):
     def __init__(self, cfg, mode):
         self.cfg = cfg 
         self.mode = mode
-        df = pd.read_csv(self.cfg.annotations_file)
+        df = read_annotations(self.cfg, self.mode, ignore_during_val=True)
         if self.mode == "train":
             df = df[df.fold != self.cfg.fold]
             self.transforms = self.cfg.train_transforms
@@ -28,7 +30,7 @@ class Dataset(TorchDataset):
             self.transforms = self.cfg.val_transforms
 
         self.df = df.reset_index(drop=True)
-        self.inputs = df[self.cfg.inputs].tolist()
+        self.inputs = StringArray(df[self.cfg.inputs])
         self.labels = df[self.cfg.targets].values 
         self.unique_ids = df.unique_id.values
         if "sampling_weight" in df.columns:
@@ -69,11 +71,9 @@ class Dataset(TorchDataset):
         if x2.ndim == 2: x2 = np.expand_dims(x2, axis=-1)
 
         x1 = x1.transpose(2, 0, 1) # channels-last -> channels-first
-        x1 = torch.tensor(x1).float()
-
+        x1 = to_input_tensor(x1, self.cfg)
         x2 = x2.transpose(2, 0, 1)
-        x2 = torch.tensor(x2).float()
-
+        x2 = to_input_tensor(x2, self.cfg)
         y = torch.tensor(y).float()
         if y.ndim == 0:
             y = y.unsqueeze(-1)
@@ -2,11 +2,13 @@ import cv2
 import glob
 import numpy as np
 import os
-import pandas as pd
 import torch
 
 from scipy.ndimage import zoom
 from torch.utils.data import Dataset as TorchDataset, default_collate
+from .annotations import read_annotations
+from .sample_table import StringArray
+from tasks.input_pipeline import to_input_tensor
 
 
 train_collate_fn = default_collate
@@ -18,7 +20,7 @@ class Dataset(TorchDataset):
     def __init__(self, cfg, mode):
         self.cfg = cfg 
         self.mode = mode
-        df = pd.read_csv(self.cfg.annotations_file)
+        df = read_annotations(self.cfg, self.mode)
         if self.mode == "train":
             df = df[df.fold != self.cfg.fold]
             self.transforms = self.cfg.train_transforms
@@ -26,7 +28,7 @@ class Dataset(TorchDataset):
             df = df[df.fold == self.cfg.fold]
             self.transforms = self.cfg.val_transforms
 
-        self.inputs = df[self.cfg.inputs].tolist()
+        self.inputs = StringArray(df[self.cfg.inputs])
         self.labels = df[self.cfg.targets].values 
         self.sample_weights = df.sample_weight.values
         self.collate_fn = train_collate_fn if mode == "train" else val_collate_fn
@@ -77,8 +79,7 @@ class Dataset(TorchDataset):
         xt = self.transforms(**to_transform)
         x = np.stack([xt["image"]] + [xt[f"image{idx}"] for idx in range(1, x.shape[0])])
         x = torch.from_numpy(x)
-        x = x.float()
-
+        x = to_input_tensor(x, self.cfg)
         if self.cfg.convert_to_3d:
             x = x.unsqueeze(0) # add channel dimension if wanting to use this with 3D model 
 
@@ -2,11 +2,15 @@ import cv2
 import glob
 import numpy as np
 import os
-import pandas as pd
 import torch
 
 from scipy.ndimage import zoom
 from torch.utils.data import Dataset as TorchDataset, default_collate
+from . import volume_store
+from .stack_cache import StackCache
+from .annotations import read_annotations
+from .sample_table import StringArray
+from tasks.input_pipeline import to_input_tensor
 
 
 train_collate_fn = default_collate
@@ -18,7 +22,7 @@ class Dataset(TorchDataset):
     def __init__(self, cfg, mode):
         self.cfg = cfg 
         self.mode = mode
-        df = pd.read_csv(self.cfg.annotations_file)
+        df = read_annotations(self.cfg, self.mode)
         if self.mode == "train":
             df = df[df.fold != self.cfg.fold]
             self.transforms = self.cfg.train_transforms
@@ -26,25 +30,46 @@ class Dataset(TorchDataset):
             df = df[df.fold == self.cfg.fold]
             self.transforms = self.cfg.val_transforms
 
-        self.inputs = df[self.cfg.inputs].tolist()
+        self.inputs = StringArray(df[self.cfg.inputs])
         self.labels = df[self.cfg.targets].values 
 
         self.collate_fn = train_collate_fn if mode == "train" else val_collate_fn
 
+        if self.cfg.stack_cache_bytes:
+            # decoded stacks are cached per dataloader worker, see datasets/stack_cache.py
+            self.stack_cache = StackCache(self.cfg.stack_cache_bytes, report_every=self.cfg.stack_cache_report_every)
+        else:
+            self.stack_cache = None
+
     def __len__(self):
         return len(self.inputs) 
 
+    def load_stack_cached(self, i):
+        if self.stack_cache is None:
+            return self.load_stack(i)
+        return self.stack_cache.get(self.inputs[i], lambda: self.load_stack(i))
+
     def load_stack(self, i):
-        # assumes that inputs are list of directories
-        # where each directory contains all the images in a stack as PNG 
-        # and that filenames are sortable
-        images = np.sort(glob.glob(os.path.join(self.cfg.data_dir, self.inputs[i], "*.png")))
+        if self.cfg.volume_store:
+            # series is packed into a single memory-mapped array
+            # see datasets/volume_store.py
+            volume = volume_store.open_volume(os.path.join(self.cfg.data_dir, self.inputs[i]))
+            images = np.arange(len(volume))
+        else:
+            # assumes that inputs are list of directories
+            # where each directory contains all the images in a stack as PNG 
+            # and that filenames are sortable
+            images = np.sort(glob.glob(os.path.join(self.cfg.data_dir, self.inputs[i], "*.png")))
         if self.cfg.image_z < len(images):
             indices = np.arange(len(images))
             indices = zoom(indices, self.cfg.image_z / len(images), order=0, prefilter=False).astype("int")
             assert len(indices) == self.cfg.image_z
             images = images[indices]
-        x = np.stack([cv2.imread(im, self.cfg.cv2_load_flag) for im in images], axis=0)
+        if self.cfg.volume_store:
+            x = volume_store.take_slices(volume, images)
+            x = volume_store.match_load_flag(x, self.cfg.cv2_load_flag)
+        else:
+            x = np.stack([cv2.imread(im, self.cfg.cv2_load_flag) for im in images], axis=0)
         if self.cfg.cv2_load_flag == cv2.IMREAD_GRAYSCALE:
             x = np.expand_dims(x, axis=-1)
         # channels-last -> channels-first
@@ -53,7 +78,7 @@ class Dataset(TorchDataset):
 
     def get(self, i):
         try:
-            x = self.load_stack(i)
+            x = self.load_stack_cached(i)
             y = self.labels[i]
             return x, y
         except Exception as e:
@@ -69,7 +94,7 @@ class Dataset(TorchDataset):
         x, y = data
         x = self.transforms(dict(image=x))["image"]
 
-        x = x.float()
+        x = to_input_tensor(x, self.cfg)
         if y.ndim == 0:
             y = torch.tensor(y).float().unsqueeze(-1)
 
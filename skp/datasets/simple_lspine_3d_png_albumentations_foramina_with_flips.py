@@ -2,11 +2,16 @@ import cv2
 import glob
 import numpy as np
 import os
-import pandas as pd
 import torch
 
 from scipy.ndimage import zoom
 from torch.utils.data import Dataset as TorchDataset, default_collate
+from . import volume_store
+from .stack_cache import StackCache
+from tasks.device_augmentation import pad_collate
+from .annotations import read_annotations
+from .sample_table import StringArray
+from tasks.input_pipeline import to_input_tensor
 
 
 train_collate_fn = default_collate
@@ -18,7 +23,7 @@ class Dataset(TorchDataset):
     def __init__(self, cfg, mode):
         self.cfg = cfg 
         self.mode = mode
-        df = pd.read_csv(self.cfg.annotations_file)
+        df = read_annotations(self.cfg, self.mode)
         if self.mode == "train":
             df = df[df.fold != self.cfg.fold]
             self.transforms = self.cfg.train_transforms
@@ -26,25 +31,54 @@ class Dataset(TorchDataset):
             df = df[df.fold == self.cfg.fold]
             self.transforms = self.cfg.val_transforms
 
-        self.inputs = df[self.cfg.inputs].tolist()
+        self.inputs = StringArray(df[self.cfg.inputs])
         self.labels = df[self.cfg.targets].values 
 
         self.collate_fn = train_collate_fn if mode == "train" else val_collate_fn
+        if self.cfg.device_augmentation:
+            # stacks are not resized in workers so may differ in size
+            self.collate_fn = pad_collate
+            if self.cfg.device_augmentation.get("flip_z", 0) > 0:
+                # the z-flip in `__getitem__` swaps left and right slice coordinates,
+                # DeviceAugment3d only does this with `swap_on_flip_z`
+                assert self.cfg.device_augmentation.get("swap_on_flip_z") is not None, \
+                    "set swap_on_flip_z=([0, 3, 6, 9, 12], [15, 18, 21, 24, 27]) in cfg.device_augmentation when using flip_z"
+
+        if self.cfg.stack_cache_bytes:
+            # decoded stacks are cached per dataloader worker, see datasets/stack_cache.py
+            self.stack_cache = StackCache(self.cfg.stack_cache_bytes, report_every=self.cfg.stack_cache_report_every)
+        else:
+            self.stack_cache = None
 
     def __len__(self):
         return len(self.inputs) 
 
+    def load_stack_cached(self, i):
+        if self.stack_cache is None:
+            return self.load_stack(i)
+        return self.stack_cache.get(self.inputs[i], lambda: self.load_stack(i))
+
     def load_stack(self, i):
-        # assumes that inputs are list of directories
-        # where each directory contains all the images in a stack as PNG 
-        # and that filenames are sortable
-        images = np.sort(glob.glob(os.path.join(self.cfg.data_dir, self.inputs[i], "*.png")))
+        if self.cfg.volume_store:
+            # series is packed into a single memory-mapped array
+            # see datasets/volume_store.py
+            volume = volume_store.open_volume(os.path.join(self.cfg.data_dir, self.inputs[i]))
+            images = np.arange(len(volume))
+        else:
+            # assumes that inputs are list of directories
+            # where each directory contains all the images in a stack as PNG 
+            # and that filenames are sortable
+            images = np.sort(glob.glob(os.path.join(self.cfg.data_dir, self.inputs[i], "*.png")))
         if self.cfg.image_z != len(images):
             indices = np.arange(len(images))
             indices = zoom(indices, self.cfg.image_z / len(images), order=0, prefilter=False).astype("int")
             assert len(indices) == self.cfg.image_z
             images = images[indices]
-        x = np.stack([cv2.imread(im, self.cfg.cv2_load_flag) for im in images], axis=0)
+        if self.cfg.volume_store:
+            x = volume_store.take_slices(volume, images)
+            x = volume_store.match_load_flag(x, self.cfg.cv2_load_flag)
+        else:
+            x = np.stack([cv2.imread(im, self.cfg.cv2_load_flag) for im in images], axis=0)
         if x.ndim == 3:
             x = np.expand_dims(x, axis=-1)
         # x.shape = (Z, H, W, C)
@@ -52,7 +86,7 @@ class Dataset(TorchDataset):
 
     def get(self, i):
         try:
-            x = self.load_stack(i)
+            x = self.load_stack_cached(i)
             y = self.labels[i].copy() # COPY
             return x, y
         except Exception as e:
@@ -67,6 +101,14 @@ class Dataset(TorchDataset):
 
         x, y = data
 
+        if self.cfg.device_augmentation:
+            # flips, augmentations and resizing are applied to the whole batch on device
+            # and coordinates in y are updated accordingly, see tasks/device_augmentation.py
+            x = torch.from_numpy(np.ascontiguousarray(x)).permute(3, 0, 1, 2)
+            if y.ndim == 0:
+                y = torch.tensor(y).float().unsqueeze(-1)
+            return {"x": x, "y": y, "index": i}
+
         if self.mode == "train" and np.random.binomial(1, 0.5):
             # flip along slice dimension
             x = np.ascontiguousarray(x[::-1])
@@ -99,7 +141,7 @@ class Dataset(TorchDataset):
         xt = self.transforms(**to_transform)
         x = np.stack([xt["image"]] + [xt[f"image{idx}"] for idx in range(1, x.shape[0])])
         x = torch.from_numpy(x)
-        x = x.float()
+        x = to_input_tensor(x, self.cfg)
         x = x.permute(3, 0, 1, 2)
 
         if y.ndim == 0:
@@ -2,10 +2,13 @@ import cv2
 import glob
 import numpy as np
 import os
-import pandas as pd
 import torch
 
 from torch.utils.data import Dataset as TorchDataset, default_collate
+from .stack_cache import StackCache
+from .annotations import read_annotations
+from .sample_table import StringArray
+from tasks.input_pipeline import to_input_tensor
 
 
 train_collate_fn = default_collate
@@ -17,7 +20,7 @@ class Dataset(TorchDataset):
     def __init__(self, cfg, mode):
         self.cfg = cfg 
         self.mode = mode
-        df = pd.read_csv(self.cfg.annotations_file)
+        df = read_annotations(self.cfg, self.mode)
         if self.mode == "train":
             if not self.cfg.fullfit:
                 df = df[df.fold != self.cfg.fold]
@@ -26,15 +29,26 @@ class Dataset(TorchDataset):
             df = df[df.fold == self.cfg.fold]
             self.transforms = self.cfg.val_transforms
 
-        self.series_folder = df.series_folder.tolist()
+        self.series_folder = StringArray(df.series_folder)
         self.df = df
             
         self.collate_fn = train_collate_fn if mode == "train" else val_collate_fn
 
+        if self.cfg.stack_cache_bytes:
+            # decoded stacks are cached per dataloader worker, see datasets/stack_cache.py
+            self.stack_cache = StackCache(self.cfg.stack_cache_bytes, report_every=self.cfg.stack_cache_report_every)
+        else:
+            self.stack_cache = None
+
 
     def __len__(self):
         return len(self.df)
 
+    def load_stack_cached(self, i):
+        if self.stack_cache is None:
+            return self.load_stack(i)
+        return self.stack_cache.get(self.series_folder[i], lambda: self.load_stack(i))
+
     def load_stack(self, i):
         imgfiles = np.sort(glob.glob(os.path.join(self.cfg.data_dir, self.series_folder[i], "IM*")))
         maskfiles = [_.replace("IM", "MASK") for _ in imgfiles]
@@ -58,7 +72,7 @@ class Dataset(TorchDataset):
         return arr, mask
 
     def __getitem__(self, i):
-        x, y = self.load_stack(i)
+        x, y = self.load_stack_cached(i)
         # x.shape = y.shape = (N, H, W)
 
         # if self.cfg.reverse_dim0 and self.mode == "train" and bool(np.random.binomial(1, 0.5)):
@@ -71,7 +85,7 @@ class Dataset(TorchDataset):
         transformed = self.transforms(**to_transform)
         x = np.stack([transformed["image"]] + [transformed[f"image{idx}"] for idx in range(1, x.shape[0])])
         x = torch.from_numpy(x)
-        x = x.float()
+        x = to_input_tensor(x, self.cfg)
         x = x.unsqueeze(0)
 
         y = np.stack([transformed["mask"]] + [transformed[f"mask{idx}"] for idx in range(1, y.shape[0])])
@@ -2,10 +2,11 @@ import cv2
 import glob
 import numpy as np
 import os
-import pandas as pd
 import torch
 
 from torch.utils.data import Dataset as TorchDataset, default_collate
+from .annotations import read_annotations
+from tasks.input_pipeline import to_input_tensor
 
 
 train_collate_fn = default_collate
@@ -17,7 +18,7 @@ class Dataset(TorchDataset):
     def __init__(self, cfg, mode):
         self.cfg = cfg 
         self.mode = mode
-        df = pd.read_csv(self.cfg.annotations_file)
+        df = read_annotations(self.cfg, self.mode)
         if self.mode == "train":
             df = df[df.fold != self.cfg.fold]
             self.transforms = self.cfg.train_transforms
@@ -77,7 +78,7 @@ class Dataset(TorchDataset):
         transformed = self.transforms(**to_transform)
         x = np.stack([transformed["image"]] + [transformed[f"image{idx}"] for idx in range(1, x.shape[0])])
         x = torch.from_numpy(x)
-        x = x.float()
+        x = to_input_tensor(x, self.cfg)
         # shape : N, H, W, C -> C, N, H, W
         x = x.permute(3, 0, 1, 2)
 
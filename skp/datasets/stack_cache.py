@@ -0,0 +1,102 @@
+"""
+In-memory LRU cache of decoded stacks, bounded by a byte budget.
+
+Each dataloader worker holds its own copy of the dataset, and therefore its own
+cache, so `max_bytes` is the budget per worker. Enable in the 3D datasets with
+`cfg.stack_cache_bytes`, e.g. `cfg.stack_cache_bytes = 4 * 2 ** 30` for 4 GiB per
+worker. This helps most with samplers which draw the same series several times
+per epoch (WeightedSampler, Upsampler) and when training for many epochs.
+`build_dataloader` sets `persistent_workers=True` when the cache is enabled, so
+that workers and their caches are kept across epochs instead of being rebuilt.
+
+Cached stacks are returned as copies, so downstream in-place augmentation
+never modifies the cached data.
+"""
+import numpy as np
+import torch
+
+from collections import OrderedDict
+from torch.utils.data import get_worker_info
+
+
+def nbytes(value):
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(v) for v in value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, torch.Tensor):
+        return value.element_size() * value.nelement()
+    return 0
+
+
+def copy(value):
+    if isinstance(value, tuple):
+        return tuple(copy(v) for v in value)
+    if isinstance(value, list):
+        return [copy(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    if isinstance(value, torch.Tensor):
+        return value.clone()
+    return value
+
+
+class StackCache:
+
+    def __init__(self, max_bytes, report_every=None):
+        self.max_bytes = int(max_bytes)
+        self.report_every = report_every
+        self.cache = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.cache)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def stats(self):
+        return {
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+            "hit_rate": self.hit_rate, "num_cached": len(self.cache),
+            "cached_bytes": self.current_bytes
+        }
+
+    def report(self):
+        worker_info = get_worker_info()
+        worker = worker_info.id if worker_info is not None else "main"
+        stats = self.stats()
+        print(f"StackCache [worker {worker}]: hit_rate={stats['hit_rate']:.3f} "
+              f"(hits={stats['hits']}, misses={stats['misses']}, evictions={stats['evictions']}), "
+              f"{stats['num_cached']} stacks / {stats['cached_bytes'] / 2 ** 30:.2f} GiB cached")
+
+    def put(self, key, value):
+        size = nbytes(value)
+        if size > self.max_bytes:
+            # never cache something which would evict everything else
+            return
+        while self.current_bytes + size > self.max_bytes:
+            _, evicted = self.cache.popitem(last=False)
+            self.current_bytes -= nbytes(evicted)
+            self.evictions += 1
+        self.cache[key] = value
+        self.current_bytes += size
+
+    def get(self, key, load_fn):
+        # returns copy of cached value for key, or loads with load_fn() and caches it
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            value = self.cache[key]
+        else:
+            self.misses += 1
+            value = load_fn()
+            self.put(key, value)
+        if self.report_every and (self.hits + self.misses) % self.report_every == 0:
+            self.report()
+        return copy(value)
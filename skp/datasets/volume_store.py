@@ -0,0 +1,87 @@
+"""
+Packed per-series volume store.
+
+Instead of a directory of per-slice PNGs, each series is saved as a single
+contiguous uint8 array of shape (Z, H, W) in `volume.npy`, along with a small
+`index.npz` holding the slice order, instance numbers and ImagePositionPatient
+for each slice. Slices are stored in the same order as the sorted PNG filenames
+written by the ETL converters, so existing annotations (slice indices, etc.)
+remain valid.
+
+Volumes are memory-mapped on load, so reading a whole stack or a subset of
+slices (e.g., after `zoom` index resampling) only touches the pages which are
+actually needed, and there is a single file open per sample instead of one
+`glob` plus one `cv2.imread` per slice.
+
+Layout (mirrors the PNG layout so `cfg.inputs` does not need to change):
+
+    <data_dir>/<study_id>/<series_id>/volume.npy
+    <data_dir>/<study_id>/<series_id>/index.npz
+"""
+import cv2
+import numpy as np
+import os
+
+
+VOLUME_FILE = "volume.npy"
+INDEX_FILE = "index.npz"
+
+
+def save_volume(series_dir, array, instances=None, positions=None, slice_order=None, pixel_spacing=None):
+    assert array.dtype == np.uint8, f"array.dtype is {array.dtype}, not uint8"
+    assert array.ndim in [3, 4], f"array should be (Z, H, W) or (Z, H, W, C), got {array.shape}"
+    os.makedirs(series_dir, exist_ok=True)
+    num_slices = len(array)
+    index = {
+        "slice_order": np.arange(num_slices) if slice_order is None else np.asarray(slice_order),
+        "instances": np.full((num_slices, ), -1) if instances is None else np.asarray(instances),
+        "positions": np.full((num_slices, 3), np.nan) if positions is None else np.asarray(positions).astype("float"),
+        "pixel_spacing": np.full((2, ), np.nan) if pixel_spacing is None else np.asarray(pixel_spacing).astype("float")
+    }
+    # Write to temporary files first and then rename, so that a crash
+    # never leaves behind a partially written volume which looks complete
+    tmp_volume = os.path.join(series_dir, f"tmp_{VOLUME_FILE}")
+    tmp_index = os.path.join(series_dir, f"tmp_{INDEX_FILE}")
+    np.save(tmp_volume, np.ascontiguousarray(array))
+    np.savez(tmp_index, **index)
+    os.replace(tmp_index, os.path.join(series_dir, INDEX_FILE))
+    os.replace(tmp_volume, os.path.join(series_dir, VOLUME_FILE))
+
+
+def volume_exists(series_dir):
+    return os.path.exists(os.path.join(series_dir, VOLUME_FILE)) and os.path.exists(os.path.join(series_dir, INDEX_FILE))
+
+
+def load_index(series_dir):
+    with np.load(os.path.join(series_dir, INDEX_FILE)) as index:
+        return {k: index[k] for k in index.files}
+
+
+def open_volume(series_dir):
+    # Returns a read-only memmap, no pixel data is read until it is indexed
+    return np.load(os.path.join(series_dir, VOLUME_FILE), mmap_mode="r")
+
+
+def take_slices(volume, indices=None):
+    # Materialize the requested slices from a (memory-mapped) volume
+    if indices is None:
+        return np.ascontiguousarray(volume)
+    indices = np.asarray(indices).astype("int")
+    if len(indices) > 1 and np.all(np.diff(indices) == 1):
+        # Contiguous run, read with a single basic slice
+        return np.ascontiguousarray(volume[indices[0]:indices[-1] + 1])
+    return np.ascontiguousarray(volume[indices])
+
+
+def load_volume(series_dir, indices=None):
+    return take_slices(open_volume(series_dir), indices)
+
+
+def match_load_flag(x, cv2_load_flag):
+    # Emulate what cv2.imread would have returned for the equivalent PNGs
+    # Volumes written from grayscale PNGs are (Z, H, W)
+    if cv2_load_flag == cv2.IMREAD_COLOR and x.ndim == 3:
+        x = np.repeat(np.expand_dims(x, axis=-1), 3, axis=-1)
+    elif cv2_load_flag == cv2.IMREAD_GRAYSCALE and x.ndim == 4:
+        x = np.stack([cv2.cvtColor(each_slice, cv2.COLOR_BGR2GRAY) for each_slice in x])
+    return x
@@ -0,0 +1,24 @@
+import cv2
+import os
+import pandas as pd
+import sys
+sys.path.insert(0, "../../skp")
+
+from datasets.crop_shards import build_crop_shards
+
+
+# Packs the crops generated in 0007 into a few large uint8 shards per fold
+# To use in training, set cfg.crop_cache_dir to the corresponding save_dir
+# Must use the same cv2_load_flag as the config which will use the cache
+crops = {
+	"spinal": ("../../data/train_gt_spinal_with_augs_kfold.csv", "../../data/train_crops_gt_with_augs/spinal/"),
+	"foraminal": ("../../data/train_gt_foraminal_with_augs_kfold.csv", "../../data/train_crops_gt_with_augs/foraminal/"),
+	"subarticular": ("../../data/train_gt_subarticular_with_augs_kfold.csv", "../../data/train_crops_gt_with_augs/subarticular/")
+}
+
+save_dir = "../../data/train_crops_gt_with_augs_shards/"
+
+for condition, (annotations_file, data_dir) in crops.items():
+	print(f"Packing {condition} crops ...")
+	df = pd.read_csv(annotations_file)
+	build_crop_shards(df, data_dir=data_dir, save_dir=os.path.join(save_dir, condition), inputs="filepath", cv2_load_flag=cv2.IMREAD_COLOR)
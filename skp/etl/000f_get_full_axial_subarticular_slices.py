@@ -1,31 +1,16 @@
-import albumentations as A
 import cv2
 import glob
 import numpy as np
 import os
 import pandas as pd
-import pydicom
 import sys
 sys.path.insert(0, "../../skp")
 import torch
 
 from collections import defaultdict
-from importlib import import_module
+from inference import load_stage
 from tqdm import tqdm
-
-
-def load_model_fold_dict(checkpoint_dict, cfg):
-    model_dict = {}
-    cfg.pretrained = False
-    for fold, checkpoint_path in checkpoint_dict.items():
-        print(f"Loading weights from {checkpoint_path} ...")
-        wts = torch.load(checkpoint_path)["state_dict"]
-        wts = {k.replace("model.", ""): v for k, v in wts.items()}
-        model = import_module(f"models.{cfg.model}").Net(cfg)
-        model.load_state_dict(wts)
-        model = model.eval().cuda()
-        model_dict[fold] = model
-    return model_dict
+from utils import load_dicom_stack
 
 
 def get_image_plane(vals):
@@ -35,43 +20,6 @@ def get_image_plane(vals):
     return np.argmax(plane) # 0- sagittal, 1- coronal, 2- axial
 
 
-def convert_to_8bit(x):
-    lower, upper = np.percentile(x, (1, 99))
-    x = np.clip(x, lower, upper)
-    x = x - np.min(x)
-    x = x / np.max(x) 
-    return (x * 255).astype("uint8")
-
-
-def load_dicom_stack(dicom_folder_list, plane, reverse_sort=False):
-    # Some axial T2 series are broken up into segments
-    # Thus we would pass a list of dicom folders and get all the DICOMs from those folders
-    # So we can return an array which is sorted by position
-    dicom_files = []
-    for dicom_folder in dicom_folder_list:
-        dicom_files.extend(glob.glob(os.path.join(dicom_folder, "*.dcm")))
-    dicoms = [pydicom.dcmread(f) for f in dicom_files]
-    # There was one axial T2 study where orientation was coronal but when I checked the images they were axial
-    # So we should probably just trust the series description rather than determine orientation ourselves
-    # planes = [get_image_plane(d.ImageOrientationPatient) for d in dicoms]
-    plane = {"sagittal": 0, "coronal": 1, "axial": 2}[plane.lower()]
-    # dicoms = [d for d, p in zip(dicoms, planes) if p == expected_plane]
-    instances = [int(d.InstanceNumber) for d in dicoms]
-    positions = np.asarray([float(d.ImagePositionPatient[plane]) for d in dicoms])
-    # if reverse_sort=False, then increasing array index will be from RIGHT->LEFT and CAUDAL->CRANIAL
-    # thus we do reverse_sort=True for axial so increasing array index is craniocaudal
-    idx = np.argsort(-positions if reverse_sort else positions)
-    ipp = np.asarray([d.ImagePositionPatient for d in dicoms]).astype("float")[idx]
-    array_shapes = np.vstack([d.pixel_array.shape for d in dicoms])
-    h, w = array_shapes[:, 0].max(), array_shapes[:, 1].max()
-    # Sometimes the arrays are not all the same shape, pad if necessary
-    padder = A.PadIfNeeded(min_height=h, min_width=w, p=1, border_mode=cv2.BORDER_CONSTANT, value=0)
-    array = [padder(image=d.pixel_array.astype("float32"))["image"] for d in dicoms]
-    array = np.stack(array)
-    array = array[idx]
-    return convert_to_8bit(array), ipp, np.asarray(dicoms[0].PixelSpacing).astype("float")
-
-
 def convert_array_to_submission_df(preds, condition, study_id):
     preds = np.concatenate(preds)
     levels = ["l1_l2", "l2_l3", "l3_l4", "l4_l5", "l5_s1"]
@@ -116,7 +64,6 @@ def save_list_of_images(image_list, study_id, laterality, save_dir):
 # LOAD CONFIGS AND MODELS #
 ###########################
 cfg_file = "cfg_identify_subarticular_slices_with_level"
-cfg = import_module(f"configs.{cfg_file}").cfg
 checkpoint_dict = {
     0: "../../skp/experiments/cfg_identify_subarticular_slices_with_level/a0eaf12e/fold0/checkpoints/last.ckpt",
     1: "../../skp/experiments/cfg_identify_subarticular_slices_with_level/51176343/fold1/checkpoints/last.ckpt",
@@ -125,10 +72,7 @@ checkpoint_dict = {
     4: "../../skp/experiments/cfg_identify_subarticular_slices_with_level/50ac81cd/fold4/checkpoints/last.ckpt"
 }
 
-subarticular_slice_finder_model_2d = {
-    "cfg": cfg,
-    "models": load_model_fold_dict(checkpoint_dict, cfg)
-}
+subarticular_slice_finder_model_2d = load_stage(cfg_file, checkpoint_dict)
 
 ############
 # PIPELINE #
@@ -152,7 +96,7 @@ for study_id, fold in tqdm(study_id_fold_dict.items(), total=len(study_id_fold_d
     AX_T2_AVAILABLE = len(series_path_dict["Axial T2"]) > 0
     if AX_T2_AVAILABLE:
         ax_t2 = series_path_dict["Axial T2"]
-        ax_t2, ax_t2_pos, ax_t2_pix = load_dicom_stack(ax_t2, plane="axial", reverse_sort=True)
+        ax_t2, _, ax_t2_pos, ax_t2_pix = load_dicom_stack(ax_t2, plane="axial", reverse_sort=True, resize_mode="pad")
     # dentify subarticular slices
     if AX_T2_AVAILABLE:
         ax_t2_torch = np.stack([subarticular_slice_finder_model_2d["cfg"].val_transforms(image=img)["image"] for img in ax_t2])
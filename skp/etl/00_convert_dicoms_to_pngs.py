@@ -6,7 +6,7 @@ import os
 import pandas as pd
 import pydicom
 
-from tqdm import tqdm
+from conversion import convert_all_series
 
 
 def get_image_plane(vals):
@@ -51,33 +51,36 @@ def load_dicom_stack(dicom_folder, sort_mode="instance"):
 
 DATA_DIR = "/mnt/stor/datasets/rsna-2024-lumbar-spine-degenerative-classification/"
 SAVE_DIR = os.path.join(DATA_DIR, "train_pngs")
+# Defaults to all available cores
+NUM_WORKERS = None
 
-all_series = glob.glob(os.path.join(DATA_DIR, "train_images/*/*"))
-series_df = pd.DataFrame({"series_folder": all_series})
-series_df["study_id"] = series_df.series_folder.apply(lambda x: x.split("/")[-2]).astype("int")
-series_df["series_id"] = series_df.series_folder.apply(lambda x: x.split("/")[-1]).astype("int")
 
-failed, mismatches = [], []
-total_series = len(series_df.series_id.unique())
-for each_series, tmp_series_df in tqdm(series_df.groupby("series_id"), total=total_series):
-    try:
-        study_id = tmp_series_df.study_id.iloc[0]
-        tmp_save_dir = os.path.join(SAVE_DIR, str(study_id), str(each_series))
-        os.makedirs(tmp_save_dir, exist_ok=True)
-        stack, instances, mismatch = load_dicom_stack(tmp_series_df.series_folder.iloc[0], sort_mode="instance")
-        if mismatch:
-            mismatches.append(each_series)
-        stack = convert_to_8bit(stack)
-        for each_slice, each_instance in zip(stack, instances):
-            sts = cv2.imwrite(os.path.join(tmp_save_dir, f"IM{each_instance:06d}.png"), each_slice)
-    except Exception as e:
-        print(f"FAILED {each_series}: {e}")
-        failed.append(each_series)
+def convert_series(series):
+    tmp_save_dir = os.path.join(SAVE_DIR, str(series["study_id"]), str(series["series_id"]))
+    os.makedirs(tmp_save_dir, exist_ok=True)
+    stack, instances, mismatch = load_dicom_stack(series["series_folder"], sort_mode="instance")
+    stack = convert_to_8bit(stack)
+    for each_slice, each_instance in zip(stack, instances):
+        sts = cv2.imwrite(os.path.join(tmp_save_dir, f"IM{each_instance:06d}.png"), each_slice)
+    return {"num_slices": len(stack), "mismatch": mismatch}
 
-with open("failed.txt", "w") as f:
-    for failure in failed:
-        _ = f.write(f"{failure}\n")
 
-with open("mismatch.txt", "w") as f:
-    for mm in mismatches:
-        _ = f.write(f"{mm}\n")
+if __name__ == "__main__":
+    all_series = glob.glob(os.path.join(DATA_DIR, "train_images/*/*"))
+    series_df = pd.DataFrame({"series_folder": all_series})
+    series_df["study_id"] = series_df.series_folder.apply(lambda x: x.split("/")[-2]).astype("int")
+    series_df["series_id"] = series_df.series_folder.apply(lambda x: x.split("/")[-1]).astype("int")
+    series_df = series_df.drop_duplicates("series_id")
+
+    series_list = [
+        {"study_id": int(row.study_id), "series_id": int(row.series_id), "series_folder": row.series_folder} 
+        for row in series_df.itertuples()
+    ]
+    # Completed series are tracked in SAVE_DIR/manifest.jsonl so that an interrupted run resumes
+    # Failures are reported in SAVE_DIR/failures.csv
+    manifest, failures = convert_all_series(series_list, convert_series, output_dir=SAVE_DIR, num_workers=NUM_WORKERS)
+
+    with open("mismatch.txt", "w") as f:
+        for record in manifest:
+            if record["mismatch"]:
+                _ = f.write(f"{record['series_id']}\n")
@@ -1,37 +1,19 @@
-import albumentations as A
 import cv2
 import glob
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 import pandas as pd
-import pydicom
 import sys
 sys.path.insert(0, "../../skp")
 import torch
 
 from collections import defaultdict
-from importlib import import_module
+from inference import load_stage
 from tasks.utils import build_dataloader
 from tqdm import tqdm
 
 
-def load_model_fold_dict(checkpoint_dict, cfg):
-    model_dict = {}
-    cfg.pretrained = False
-    for fold, checkpoint_path in checkpoint_dict.items():
-        print(f"Loading weights from {checkpoint_path} ...")
-        wts = torch.load(checkpoint_path)["state_dict"]
-        wts = {k.replace("model.", ""): v for k, v in wts.items()}
-        model = import_module(f"models.{cfg.model}").Net(cfg)
-        model.load_state_dict(wts)
-        model = model.eval().cuda()
-        model_dict[fold] = model
-    return model_dict
-
-
 cfg_file = "cfg_identify_subarticular_slices"
-cfg = import_module(f"configs.{cfg_file}").cfg
 checkpoint_dict = {
     0: "../../skp/experiments/cfg_identify_subarticular_slices/fda7fcb2/fold0/checkpoints/last.ckpt",
     1: "../../skp/experiments/cfg_identify_subarticular_slices/47bb2f11/fold1/checkpoints/last.ckpt",
@@ -40,10 +22,7 @@ checkpoint_dict = {
     4: "../../skp/experiments/cfg_identify_subarticular_slices/b7ea0fee/fold4/checkpoints/last.ckpt"
 }
 
-subarticular_slice_finder_model_2d = {
-    "cfg": cfg,
-    "models": load_model_fold_dict(checkpoint_dict, cfg)
-}
+subarticular_slice_finder_model_2d = load_stage(cfg_file, checkpoint_dict, fold_ensemble=True)
 
 df = pd.read_csv("../../data/train_axial_subarticular_slice_identifier_sequence.csv")
 
@@ -59,10 +38,10 @@ for series_id, series_df in df.groupby("series_id"):
 	array = np.stack([subarticular_slice_finder_model_2d["cfg"].val_transforms(image=img)["image"] for img in array])
 	array = array.transpose(0, 3, 1, 2)
 	array = torch.from_numpy(array).cuda().float()
-	feature_dict = {}
 	with torch.inference_mode():
-		for fold, fold_model in subarticular_slice_finder_model_2d["models"].items():
-			feature_dict[fold] = fold_model({"x": array}, return_features=True)["features"].cpu().numpy()
+		# all folds in one call, features of each fold along dim 0
+		features = subarticular_slice_finder_model_2d["models"]({"x": array}, return_features=True)["features"].cpu().numpy()
+	feature_dict = dict(zip(subarticular_slice_finder_model_2d["models"].folds, features))
 	for fold, fold_features in feature_dict.items():
 		np.save(os.path.join(save_dir, f"fold{fold}", f"{series_df.study_id.iloc[0]}-{series_id}-feature.npy"), fold_features)
 		np.save(os.path.join(save_dir, f"fold{fold}", f"{series_df.study_id.iloc[0]}-{series_id}-label.npy"), series_df[["l1_l2", "l2_l3", "l3_l4", "l4_l5", "l5_s1"]].values)
@@ -1,37 +1,19 @@
-import albumentations as A
 import cv2
 import glob
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 import pandas as pd
-import pydicom
 import sys
 sys.path.insert(0, "../../skp")
 import torch
 
 from collections import defaultdict
-from importlib import import_module
+from inference import load_stage
 from tasks.utils import build_dataloader
 from tqdm import tqdm
 
 
-def load_model_fold_dict(checkpoint_dict, cfg):
-    model_dict = {}
-    cfg.pretrained = False
-    for fold, checkpoint_path in checkpoint_dict.items():
-        print(f"Loading weights from {checkpoint_path} ...")
-        wts = torch.load(checkpoint_path)["state_dict"]
-        wts = {k.replace("model.", ""): v for k, v in wts.items()}
-        model = import_module(f"models.{cfg.model}").Net(cfg)
-        model.load_state_dict(wts)
-        model = model.eval().cuda()
-        model_dict[fold] = model
-    return model_dict
-
-
 cfg_file = "cfg_identify_subarticular_slices_with_level"
-cfg = import_module(f"configs.{cfg_file}").cfg
 checkpoint_dict = {
     0: "../../skp/experiments/cfg_identify_subarticular_slices_with_level/a0eaf12e/fold0/checkpoints/last.ckpt",
     1: "../../skp/experiments/cfg_identify_subarticular_slices_with_level/51176343/fold1/checkpoints/last.ckpt",
@@ -40,10 +22,7 @@ checkpoint_dict = {
     4: "../../skp/experiments/cfg_identify_subarticular_slices_with_level/50ac81cd/fold4/checkpoints/last.ckpt"
 }
 
-subarticular_slice_finder_model_2d = {
-    "cfg": cfg,
-    "models": load_model_fold_dict(checkpoint_dict, cfg)
-}
+subarticular_slice_finder_model_2d = load_stage(cfg_file, checkpoint_dict)
 
 df = pd.read_csv("../../data/train_identify_subarticular_slices_with_level.csv")
 
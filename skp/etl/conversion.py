@@ -0,0 +1,108 @@
+import cv2
+import json
+import numpy as np
+import os
+import pandas as pd
+import time
+import traceback
+
+from functools import partial
+from multiprocessing import Pool
+from tqdm import tqdm
+
+
+MANIFEST_FILE = "manifest.jsonl"
+FAILURES_FILE = "failures.csv"
+
+
+def _to_builtin(x):
+    # numpy scalars/arrays are not JSON serializable
+    if isinstance(x, np.generic):
+        return x.item()
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+    raise TypeError(f"Object of type {type(x).__name__} is not JSON serializable")
+
+
+def _init_worker():
+    # Each process converts one series at a time, so avoid oversubscribing
+    # cores with OpenCV's internal thread pool
+    cv2.setNumThreads(1)
+
+
+def _convert_one(convert_fn, series):
+    start = time.time()
+    try:
+        summary = convert_fn(series) or {}
+        return {**series, **summary, "status": "done", "elapsed": time.time() - start}
+    except Exception as e:
+        return {
+            **series,
+            "status": "failed",
+            "error_type": type(e).__name__,
+            "error": str(e),
+            "traceback": traceback.format_exc(),
+            "elapsed": time.time() - start
+        }
+
+
+def load_manifest(output_dir):
+    manifest_file = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_file):
+        return []
+    records = []
+    with open(manifest_file) as f:
+        for line in f:
+            line = line.strip()
+            if line == "":
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # last line may be truncated if the previous run was killed mid-write
+                continue
+    return records
+
+
+def convert_all_series(series_list, convert_fn, output_dir, num_workers=None, resume=True, key="series_id"):
+    """
+    Runs `convert_fn` over each series in a process pool.
+
+    Each element of `series_list` is a dict describing one series (must contain `key`
+    and be JSON serializable) and is passed to `convert_fn`, which must be defined at
+    module level so it can be pickled. `convert_fn` may return a dict of extra fields
+    (e.g., number of slices) to record in the manifest.
+
+    Completed series are appended to `<output_dir>/manifest.jsonl` as soon as they
+    finish, so if the run crashes, rerunning with `resume=True` skips them.
+    Failures are written to `<output_dir>/failures.csv` with the exception type,
+    message and traceback for each series.
+
+    Returns list of manifest records for all completed series (including those
+    completed in previous runs) and a DataFrame of failures from this run.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir) if resume else []
+    completed = {str(r[key]) for r in manifest}
+    to_convert = [s for s in series_list if str(s[key]) not in completed]
+    if len(completed) > 0:
+        print(f"Resuming: {len(completed)} series already completed, {len(to_convert)} remaining ...")
+
+    num_workers = num_workers or os.cpu_count()
+    failures = []
+    with open(os.path.join(output_dir, MANIFEST_FILE), "a" if resume else "w") as manifest_file:
+        with Pool(num_workers, initializer=_init_worker) as pool:
+            results = pool.imap_unordered(partial(_convert_one, convert_fn), to_convert)
+            for record in tqdm(results, total=len(to_convert)):
+                if record["status"] == "failed":
+                    print(f"FAILED {record[key]}: {record['error_type']}: {record['error']}")
+                    failures.append(record)
+                    continue
+                _ = manifest_file.write(json.dumps(record, default=_to_builtin) + "\n")
+                manifest_file.flush()
+                manifest.append(record)
+
+    failures = pd.DataFrame(failures, columns=None if len(failures) > 0 else [key, "error_type", "error", "traceback"])
+    failures.to_csv(os.path.join(output_dir, FAILURES_FILE), index=False)
+    print(f"{len(manifest)} series completed, {len(failures)} failed")
+    return manifest, failures
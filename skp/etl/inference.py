@@ -0,0 +1,279 @@
+import copy
+import cv2
+import numpy as np
+import registry
+import torch
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from configs.base import replace
+from torch.func import functional_call, stack_module_state, vmap
+
+
+def load_stage(cfg_file, checkpoint_dict, device="cuda", fold_ensemble=False, quantize=None):
+    """
+    Returns {"cfg": cfg, "models": {fold: model}} for all folds of a pipeline stage,
+    loaded from the weights-only bundle of `cfg_file` in the model registry (see
+    skp/registry.py). The bundle is exported from `checkpoint_dict` on first use,
+    or if the checkpoints or the config have changed since.
+
+    With `fold_ensemble=True`, "models" is a `FoldEnsemble` of the fold models.
+
+    `quantize` ("dynamic" or "static", CPU only) returns int8 models, see
+    skp/quantization.py. Static quantization calibrates each fold on the validation
+    Dataset of that fold, whose data paths must be valid from here. Quantized
+    models cannot be combined with `fold_ensemble=True`.
+    """
+    # quantized Linear layers hold packed weights, which `stack_module_state` cannot stack
+    assert not (quantize and fold_ensemble), "quantized models cannot be run as a FoldEnsemble, use fold_ensemble=False"
+    if not registry.bundle_matches(cfg_file, checkpoint_dict):
+        registry.export_bundle(cfg_file, checkpoint_dict)
+    print(f"Loading {cfg_file} ...")
+    stage = registry.load_bundle(cfg_file, device=device)
+    if quantize:
+        import quantization
+        assert torch.device(device).type == "cpu", "quantized models only run on CPU"
+        stage["models"] = {
+            fold: quantization.quantize(model, quantize, replace(stage["cfg"], fold=fold))
+            for fold, model in stage["models"].items()
+        }
+    if fold_ensemble:
+        stage["models"] = FoldEnsemble(stage["models"])
+    return stage
+
+
+class FoldEnsemble:
+    """
+    Fold models with the same architecture run as a single model: parameters and
+    buffers of all folds are stacked (`torch.func.stack_module_state`) and the
+    forward pass is vmapped over the fold dimension, so that all folds are
+    evaluated in one call instead of one after another.
+
+    Outputs have a leading fold dimension, in the order of `folds`.
+
+    Models which cannot be vmapped (e.g., data-dependent control flow or
+    `.item()` in forward) fall back to a loop over folds, using views of the
+    stacked weights.
+    """
+    def __init__(self, model_dict):
+        self.folds = list(model_dict.keys())
+        models = list(model_dict.values())
+        params, buffers = stack_module_state(models)
+        self.state = ({k: v.detach() for k, v in params.items()}, buffers)
+        # Stateless copy, weights are passed to `functional_call`
+        self.base = copy.deepcopy(models[0]).to("meta")
+        self.use_vmap = True
+
+    def __len__(self):
+        return len(self.folds)
+
+    def fold_state(self, index):
+        return tuple({k: v[index] for k, v in state.items()} for state in self.state)
+
+    def run(self, batch, batch_in_dim, kwargs):
+        def call(state, batch):
+            return functional_call(self.base, state, (batch, ), kwargs)
+
+        if not batch["x"].is_floating_point():
+            # Normalization casts integer inputs and normalizes them in place, which
+            # vmap does not allow for an input that is shared by all folds
+            batch = {**batch, "x": batch["x"].float()}
+        if self.use_vmap:
+            try:
+                return vmap(call, in_dims=(0, batch_in_dim))(self.state, batch)
+            except Exception as e:
+                print(f"Unable to vmap {type(self.base).__name__} over folds ({type(e).__name__}: {e}), running folds sequentially ...")
+                self.use_vmap = False
+        outputs = []
+        for index in range(len(self)):
+            fold_batch = batch if batch_in_dim is None else {k: v[index] for k, v in batch.items()}
+            outputs.append(call(self.fold_state(index), fold_batch))
+        return {k: torch.stack([out[k] for out in outputs]) for k in outputs[0]}
+
+    def __call__(self, batch, reduce=None, **kwargs):
+        """
+        Runs all folds on the same `batch`. Returns outputs of each fold, or their
+        mean if `reduce="mean"`.
+        """
+        out = self.run(batch, None, kwargs)
+        if reduce == "mean":
+            out = {k: v.mean(0) for k, v in out.items()}
+        return out
+
+    def forward_by_fold(self, batch, **kwargs):
+        """
+        Runs each fold on its own part of `batch`, whose tensors have a leading
+        fold dimension.
+        """
+        return self.run(batch, 0, kwargs)
+
+
+class BackgroundLoader:
+    """
+    Iterates over `load_fn(item)` for each item in `items`, in order, while the next
+    `max_prefetch` items are loaded in background threads.
+
+    DICOM reading is mostly I/O and numpy, so threads are sufficient to keep the
+    accelerator fed, and no pickling of `load_fn` is required.
+    """
+    def __init__(self, items, load_fn, num_workers=4, max_prefetch=16):
+        self.items = list(items)
+        self.load_fn = load_fn
+        self.num_workers = num_workers
+        self.max_prefetch = max(max_prefetch, num_workers)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        with ThreadPoolExecutor(self.num_workers) as executor:
+            items = iter(self.items)
+            end = object()
+            futures = deque()
+            for item in items:
+                futures.append(executor.submit(self.load_fn, item))
+                if len(futures) >= self.max_prefetch:
+                    break
+            while len(futures) > 0:
+                result = futures.popleft().result()
+                next_item = next(items, end)
+                if next_item is not end:
+                    futures.append(executor.submit(self.load_fn, next_item))
+                yield result
+
+
+def batched(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+class AsyncImageWriter:
+    """
+    Writes images with `cv2.imwrite` in a background thread so that inference
+    does not wait on disk. Call `close()` (or use as a context manager) to wait
+    for all pending writes.
+    """
+    def __init__(self, num_workers=4, max_pending=256):
+        self.executor = ThreadPoolExecutor(num_workers)
+        self.pending = deque()
+        self.max_pending = max_pending
+
+    def write(self, filepath, img):
+        if len(self.pending) >= self.max_pending:
+            # Bound memory held by queued images
+            self.pending.popleft().result()
+        self.pending.append(self.executor.submit(cv2.imwrite, filepath, img))
+
+    def close(self):
+        while len(self.pending) > 0:
+            self.pending.popleft().result()
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def get_autocast_dtype(amp):
+    # amp can be None, "fp16" or "bf16"
+    # fp16 autocast on CPU is only supported for some ops, bf16 is preferred there
+    if amp is None:
+        return None
+    return {"fp16": torch.float16, "bf16": torch.bfloat16}[amp]
+
+
+def apply_activation(out, activation, dim=1):
+    if activation == "sigmoid":
+        return out.sigmoid()
+    if activation == "softmax":
+        return out.softmax(dim=dim)
+    return out
+
+
+def predict(model, x, batch_size=32, device="cuda", amp=None, activation="sigmoid"):
+    """
+    Runs `model` over `x` (tensor or list of tensors to be stacked) in chunks of
+    `batch_size`. Outputs are kept on device and only transferred to CPU once at
+    the end, instead of after every forward pass. For a `FoldEnsemble`, returns
+    the mean over folds.
+    """
+    if isinstance(x, (list, tuple)):
+        x = torch.stack([torch.as_tensor(_) for _ in x])
+    device_type = torch.device(device).type
+    dtype = get_autocast_dtype(amp)
+    outputs = []
+    with torch.inference_mode(), torch.autocast(device_type=device_type, dtype=dtype, enabled=dtype is not None):
+        for chunk in x.split(batch_size):
+            chunk = chunk.to(device, non_blocking=True)
+            out = model({"x": chunk})["logits"].float()
+            if isinstance(model, FoldEnsemble):
+                # mean over folds of the activated outputs
+                out = apply_activation(out, activation, dim=2).mean(0)
+            else:
+                out = apply_activation(out, activation)
+            outputs.append(out)
+    return torch.cat(outputs).cpu().numpy()
+
+
+def predict_by_fold(model_dict, inputs, folds, **kwargs):
+    """
+    Out-of-fold prediction for a batch of samples from different studies.
+
+    `inputs` is a list of tensors and `folds` the fold of each, samples are grouped
+    so that each fold model runs once over all of its samples. Returns list of
+    outputs in the same order as `inputs`.
+
+    `model_dict` can also be a `FoldEnsemble`, see `predict_by_fold_ensemble`.
+    """
+    if isinstance(model_dict, FoldEnsemble):
+        return predict_by_fold_ensemble(model_dict, inputs, folds, **kwargs)
+    outputs = [None] * len(inputs)
+    folds = np.asarray(folds)
+    for fold in np.unique(folds):
+        indices = np.where(folds == fold)[0]
+        fold_out = predict(model_dict[fold], [inputs[i] for i in indices], **kwargs)
+        for i, out in zip(indices, fold_out):
+            outputs[i] = out
+    return outputs
+
+
+def predict_by_fold_ensemble(ensemble, inputs, folds, batch_size=32, device="cuda", amp=None, activation="sigmoid"):
+    """
+    Same as `predict_by_fold`, with all folds in one call per chunk. Samples of
+    each fold are padded to the size of the largest fold group, so this pays off
+    when samples are spread evenly across folds.
+    """
+    folds = np.asarray(folds)
+    assert set(folds.tolist()) <= set(ensemble.folds), f"folds {set(folds.tolist()) - set(ensemble.folds)} not in ensemble"
+    groups = [np.where(folds == fold)[0] for fold in ensemble.folds]
+    num_per_fold = max(len(indices) for indices in groups)
+    x = torch.stack([torch.as_tensor(_) for _ in inputs])
+    # (num_folds, num_per_fold, ...)
+    x_by_fold = x.new_zeros((len(ensemble), num_per_fold, *x.shape[1:]))
+    for fold_index, indices in enumerate(groups):
+        x_by_fold[fold_index, :len(indices)] = x[indices]
+
+    device_type = torch.device(device).type
+    dtype = get_autocast_dtype(amp)
+    fold_outputs = []
+    with torch.inference_mode(), torch.autocast(device_type=device_type, dtype=dtype, enabled=dtype is not None):
+        # `batch_size` samples across all folds per forward pass
+        for chunk in x_by_fold.split(max(1, batch_size // len(ensemble)), dim=1):
+            chunk = chunk.to(device, non_blocking=True)
+            out = ensemble.forward_by_fold({"x": chunk})["logits"].float()
+            fold_outputs.append(apply_activation(out, activation, dim=2))
+    fold_outputs = torch.cat(fold_outputs, dim=1).cpu().numpy()
+
+    outputs = [None] * len(inputs)
+    for fold_index, indices in enumerate(groups):
+        for i, out in zip(indices, fold_outputs[fold_index]):
+            outputs[i] = out
+    return outputs
@@ -0,0 +1,229 @@
+"""
+Study-level stages of the crop generation and inference pipeline.
+
+Each stage takes a batch of studies (dicts from `load_study`) and returns one
+result per study, with all studies of the batch run through the models
+together. Crops are returned as arrays, so that they can either be written to
+disk (etl/000d) or graded in memory (etl/predict_studies.py).
+
+Stages are dicts of {"cfg": cfg, "models": models} (see `inference.load_stage`).
+If every study has a fold, each study is predicted by the model of its fold
+(out-of-fold, for training data). Otherwise predictions are averaged over all
+folds.
+"""
+import glob
+import numpy as np
+import os
+import pandas as pd
+import torch
+
+from collections import defaultdict
+from inference import FoldEnsemble, predict, predict_by_fold
+from utils import load_dicom_stack
+
+
+LEVELS = ["L1", "L2", "L3", "L4", "L5", "S1"]
+LEVELS_DICT = {ii: lvl for ii, lvl in enumerate(LEVELS)}
+
+
+def load_study(study_id, dicom_dir, series_descriptions, folds=None):
+    """
+    Loads the sagittal T1, sagittal T2/STIR and axial T2 series of `study_id`
+    as 8-bit arrays (None if missing). `series_descriptions` maps
+    "{study_id}-{series_id}" to the series description and `folds` study_id to
+    fold.
+    """
+    series = glob.glob(os.path.join(dicom_dir, str(study_id), "*"))
+    series_path_dict = defaultdict(list)
+    for each_series in series:
+        series_path_dict[series_descriptions[f"{study_id}-{os.path.basename(each_series)}"]].append(each_series)
+    fold = folds[study_id] if folds is not None else None
+    study = {"study_id": study_id, "fold": fold, "sag_t1": None, "sag_t2": None, "ax_t2": None}
+    # A few studies had multiple sagittal T1 series
+    # Upon manual review, it seems that they were all duplicates of each other
+    # So we should be fine just taking any of them
+    if len(series_path_dict["Sagittal T1"]) > 0:
+        study["sag_t1"], _, _, _ = load_dicom_stack(series_path_dict["Sagittal T1"][:1], plane="sagittal", resize_mode="pad")
+    # There were no studies with multiple sagittal T2 series
+    # Though if there are in the test set, I assume the above would also apply
+    if len(series_path_dict["Sagittal T2/STIR"]) > 0:
+        study["sag_t2"], _, _, _ = load_dicom_stack(series_path_dict["Sagittal T2/STIR"][:1], plane="sagittal", resize_mode="pad")
+    # Some studies split axial T2s into segments
+    # So we would need to load all the available axial series
+    if len(series_path_dict["Axial T2"]) > 0:
+        study["ax_t2"], _, _, _ = load_dicom_stack(series_path_dict["Axial T2"], plane="axial", reverse_sort=True, resize_mode="pad")
+    return study
+
+
+def get_3_channel_indices(ch2, num_images):
+    ch1 = max(0, ch2 - 1)
+    ch3 = min(num_images - 1, ch2 + 1) # subtract 1 from num_images since array is 0-indexed
+    return [ch1, ch2, ch3]
+
+
+def crop_square_around_center(img, xc, yc, size_factor=0.15):
+    h, w = size_factor * img.shape[0], size_factor * img.shape[1]
+    x1, y1 = xc - w / 2, yc - h / 2
+    x2, y2 = x1 + w, y1 + h
+    x1, y1, x2, y2 = [int(_) for _ in [x1, y1, x2, y2]]
+    x1, y1 = max(0, x1), max(0, y1)
+    x2, y2 = min(img.shape[1], x2), min(img.shape[0], y2)
+    return img[y1:y2, x1:x2]
+
+
+def convert_array_to_submission_df(preds, condition, study_id):
+    preds = np.concatenate(preds)
+    levels = ["l1_l2", "l2_l3", "l3_l4", "l4_l5", "l5_s1"]
+    grades = ["normal_mild", "moderate", "severe"]
+    # assumes preds are in order from L1-L2, L2-L3, ..., L5-S1
+    assert preds.shape == (5, 3), f"preds.shape is {preds.shape}"
+    row_id_list = [f"{study_id}_{condition}_{l}" for l in levels]
+    pred_df = pd.DataFrame(preds)
+    pred_df.columns = grades
+    pred_df["row_id"] = row_id_list
+    return pred_df[["row_id"] + grades]
+
+
+def run_stage(stage, inputs, folds=None, **predict_kwargs):
+    """
+    Returns list of outputs of `stage` for `inputs`, out-of-fold if `folds` is
+    given (and has no missing values), otherwise averaged over all folds.
+    """
+    if len(inputs) == 0:
+        return []
+    models = stage["models"]
+    if folds is not None and not any(f is None for f in folds):
+        return predict_by_fold(models, inputs, folds, **predict_kwargs)
+    if isinstance(models, FoldEnsemble):
+        return list(predict(models, inputs, **predict_kwargs))
+    return list(np.mean([predict(model, inputs, **predict_kwargs) for model in models.values()], axis=0))
+
+
+def crop_foramina(stage, studies, **predict_kwargs):
+    """
+    1- Identify foramina coords (sagittal T1). Returns (left crops, right crops)
+    for each study, 1 crop per level, or None if the study has no sagittal T1.
+    """
+    results = [None] * len(studies)
+    indices = [i for i, s in enumerate(studies) if s["sag_t1"] is not None]
+    inputs = [stage["cfg"].val_transforms({"image": np.expand_dims(studies[i]["sag_t1"], axis=0)})["image"] for i in indices]
+    outputs = run_stage(stage, inputs, [studies[i]["fold"] for i in indices], **predict_kwargs)
+    for i, out in zip(indices, outputs):
+        sag_t1 = studies[i]["sag_t1"]
+        out[:10] = out[:10] * sag_t1.shape[2]
+        out[10:20] = out[10:20] * sag_t1.shape[1]
+        out[20:] = out[20:] * sag_t1.shape[0]
+        out = out.astype("int")
+        lt, rt = np.stack([out[:5], out[10:15], out[20:25]], axis=0), np.stack([out[5:10], out[15:20], out[25:]], axis=0)
+        lt_foramen_crops, rt_foramen_crops = [], []
+        for level in range(5):
+            # LEFT
+            ch1, ch2, ch3 = get_3_channel_indices(ch2=lt[2, level], num_images=sag_t1.shape[0])
+            tmp_slice = sag_t1[[ch1, ch2, ch3]].transpose(1, 2, 0)
+            cropped_foramen = crop_square_around_center(img=tmp_slice, xc=lt[0, level], yc=lt[1, level], size_factor=0.15)
+            lt_foramen_crops.append(cropped_foramen)
+            # RIGHT
+            ch1, ch2, ch3 = get_3_channel_indices(ch2=rt[2, level], num_images=sag_t1.shape[0])
+            tmp_slice = sag_t1[[ch1, ch2, ch3]].transpose(1, 2, 0)
+            cropped_foramen = crop_square_around_center(img=tmp_slice, xc=rt[0, level], yc=rt[1, level], size_factor=0.15)
+            rt_foramen_crops.append(cropped_foramen)
+        results[i] = (lt_foramen_crops, rt_foramen_crops)
+    return results
+
+
+def crop_spinal_canal(stage, studies, **predict_kwargs):
+    """
+    2- Identify spinal canal coords (sagittal T2). Returns list of crops for each
+    study, 1 per level, or None if the study has no sagittal T2.
+    """
+    results = [None] * len(studies)
+    indices = [i for i, s in enumerate(studies) if s["sag_t2"] is not None]
+    inputs = [stage["cfg"].val_transforms({"image": np.expand_dims(studies[i]["sag_t2"], axis=0)})["image"] for i in indices]
+    outputs = run_stage(stage, inputs, [studies[i]["fold"] for i in indices], **predict_kwargs)
+    for i, canal_out in zip(indices, outputs):
+        sag_t2 = studies[i]["sag_t2"]
+        canal_out[:5] = canal_out[:5] * sag_t2.shape[2]
+        canal_out[5:10] = canal_out[5:10] * sag_t2.shape[1]
+        canal_out[10:] = canal_out[10:] * sag_t2.shape[0]
+        canal_out = canal_out.astype("int")
+        canal_out = np.stack([canal_out[:5], canal_out[5:10], canal_out[10:]], axis=0)
+        canal_crops = []
+        for level in range(5):
+            ch1, ch2, ch3 = get_3_channel_indices(ch2=canal_out[2, level], num_images=sag_t2.shape[0])
+            tmp_slice = sag_t2[[ch1, ch2, ch3]].transpose(1, 2, 0)
+            cropped_canal = crop_square_around_center(img=tmp_slice, xc=canal_out[0, level], yc=canal_out[1, level], size_factor=0.15)
+            canal_crops.append(cropped_canal)
+        results[i] = canal_crops
+    return results
+
+
+def crop_subarticular(slice_stage, coord_stage, studies, **predict_kwargs):
+    """
+    3- Identify subarticular slices and 4- subarticular coords (axial T2).
+    Returns (left crops, right crops) for each study, 1 crop per level (None for
+    levels where no slice was found), or None if the study has no axial T2.
+    """
+    results = [None] * len(studies)
+    study_indices = [i for i, s in enumerate(studies) if s["ax_t2"] is not None]
+    # All axial slices from all studies in the batch are run together, then split back per study
+    inputs, folds, slice_study_index = [], [], []
+    for i in study_indices:
+        study = studies[i]
+        for img in study["ax_t2"]:
+            inputs.append(torch.from_numpy(slice_stage["cfg"].val_transforms(image=img)["image"]).unsqueeze(0))
+        folds.extend([study["fold"]] * len(study["ax_t2"]))
+        slice_study_index.extend([i] * len(study["ax_t2"]))
+    if len(inputs) == 0:
+        return results
+    outputs = np.stack(run_stage(slice_stage, inputs, folds, **predict_kwargs))
+    slice_study_index = np.asarray(slice_study_index)
+
+    target_axial_slices = {}
+    for i in study_indices:
+        ax_t2 = studies[i]["ax_t2"]
+        subout = outputs[slice_study_index == i]
+        level_preds = subout[:, 1:]
+        assigned_levels = [LEVELS_DICT[ii] for ii in np.argmax(level_preds, axis=1)]
+        # Get the first occurrence of L2-S1, then subtract 1 because the subarticular slice should be the LAST slice of a given level
+        intervertebral_spaces = []
+        for lvl in LEVELS[1:]:
+            try:
+                intervertebral_spaces.append(assigned_levels.index(lvl) - 1)
+            except ValueError:
+                intervertebral_spaces.append(None)
+        target_axial_slices[i] = [
+            ax_t2[get_3_channel_indices(ii, num_images=len(ax_t2))].transpose(1, 2, 0) if isinstance(ii, int) else None
+            for ii in intervertebral_spaces
+        ]
+
+    # All 5 target slices of all studies in the batch are run together
+    inputs, folds, slice_keys = [], [], []
+    for i, study_slices in target_axial_slices.items():
+        for level_index, each_slice in enumerate(study_slices):
+            if isinstance(each_slice, type(None)):
+                continue
+            inputs.append(torch.from_numpy(coord_stage["cfg"].val_transforms(image=each_slice)["image"].transpose(2, 0, 1)))
+            folds.append(studies[i]["fold"])
+            slice_keys.append((i, level_index))
+    outputs = dict(zip(slice_keys, run_stage(coord_stage, inputs, folds, **predict_kwargs)))
+
+    for i, study_slices in target_axial_slices.items():
+        lt_sub_crops, rt_sub_crops = [], []
+        for level_index, each_slice in enumerate(study_slices):
+            if isinstance(each_slice, type(None)):
+                lt_sub_crops.append(None)
+                rt_sub_crops.append(None)
+                continue
+            out = outputs[(i, level_index)]
+            out[[0, 2]] *= each_slice.shape[1]
+            out[[1, 3]] *= each_slice.shape[0]
+            out = out.astype("int")
+            lt_x, lt_y, rt_x, rt_y = out
+            # LEFT
+            cropped_subarticular = crop_square_around_center(img=each_slice, xc=lt_x, yc=lt_y, size_factor=0.15)
+            lt_sub_crops.append(cropped_subarticular)
+            # RIGHT
+            cropped_subarticular = crop_square_around_center(img=each_slice, xc=rt_x, yc=rt_y, size_factor=0.15)
+            rt_sub_crops.append(cropped_subarticular)
+        results[i] = (lt_sub_crops, rt_sub_crops)
+    return results
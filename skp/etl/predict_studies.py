@@ -0,0 +1,210 @@
+"""
+End-to-end inference from DICOMs to the submission CSV.
+
+For each batch of studies:
+    1- foramina coords (sagittal T1), 2- spinal canal coords (sagittal T2),
+       3- subarticular slices and 4- subarticular coords (axial T2), which give
+       crops for each level (see pipeline.py)
+    5- crops are graded in memory (no PNGs written and reread) and written as
+       rows of `row_id, normal_mild, moderate, severe`
+
+Studies are loaded in background threads while the previous batch runs through
+the models, with at most `--max-prefetch` studies in memory, and rows are
+appended to the CSV after each batch. Each stage averages over all folds of its
+bundle in the model registry (see skp/registry.py), run as one `FoldEnsemble`.
+
+Rows for levels which could not be graded (missing series, level not found,
+study failed to load) are filled with `MISSING_PREDICTION`.
+
+Prints time spent in each stage at the end.
+
+Usage (from etl/):
+    python predict_studies.py --dicom-dir ../../data/test_images/ \
+        --series-descriptions ../../data/test_series_descriptions.csv --output ../../data/submission.csv
+"""
+import argparse
+import numpy as np
+import os
+import pandas as pd
+import sys
+sys.path.insert(0, "../../skp")
+import time
+import torch
+
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import partial
+from inference import BackgroundLoader, FoldEnsemble, batched
+from pipeline import convert_array_to_submission_df, crop_foramina, crop_spinal_canal, crop_subarticular, load_study, run_stage
+from registry import load_bundle
+
+
+# stage: bundle in the model registry
+STAGES = {
+    "foramina": "cfg_predict_sagittal_foramina_coords",
+    "spinal_canal": "cfg_predict_sagittal_canal_coords",
+    "subarticular_slices": "cfg_identify_subarticular_slices_with_level",
+    "subarticular_coords": "cfg_axial_subarticular_coords",
+    "grade_foramen": "cfg0000_noise_reduce_085_foramen_crops",
+    "grade_spinal": "cfg0000_noise_reduce_085_spinal_sag_all_slices",
+    "grade_subarticular": "cfg0000_noise_reduce_085_subarticular_crops",
+}
+
+# normal_mild, moderate, severe
+MISSING_PREDICTION = [1 / 3, 1 / 3, 1 / 3]
+
+
+class StageTimer:
+    """
+    Accumulates wall time per stage, synchronizing CUDA at the end of each stage
+    so that asynchronous kernels are counted in the right stage.
+    """
+    def __init__(self, device):
+        self.times = defaultdict(float)
+        self.synchronize = torch.device(device).type == "cuda"
+
+    @contextmanager
+    def __call__(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.synchronize:
+                torch.cuda.synchronize()
+            self.times[stage] += time.perf_counter() - start
+
+    def report(self, num_studies):
+        total = sum(self.times.values())
+        print(f"\n{'stage':<24}{'total (s)':>12}{'per study (ms)':>16}{'%':>8}")
+        for stage, t in self.times.items():
+            print(f"{stage:<24}{t:>12.1f}{1000 * t / max(num_studies, 1):>16.1f}{100 * t / total:>8.1f}")
+        print(f"{'total':<24}{total:>12.1f}{1000 * total / max(num_studies, 1):>16.1f}")
+
+
+def load_stages(stage_bundles, device):
+    stages = {}
+    for stage, bundle in stage_bundles.items():
+        print(f"Loading {stage} from {bundle} ...")
+        stages[stage] = load_bundle(bundle, device=device)
+        stages[stage]["models"] = FoldEnsemble(stages[stage]["models"])
+    return stages
+
+
+def load_study_or_empty(study_id, **kwargs):
+    # a study which fails to load (e.g., corrupt DICOM, series missing from the
+    # descriptions) is returned without series rather than stopping the run
+    try:
+        return load_study(study_id, **kwargs)
+    except Exception as e:
+        print(f"Failed to load study {study_id}: {e!r}")
+        return {"study_id": study_id, "fold": None, "sag_t1": None, "sag_t2": None, "ax_t2": None}
+
+
+def grade(stage, crops, **predict_kwargs):
+    """
+    Returns (N, 3) probabilities of normal/mild, moderate and severe for each
+    of `crops`, NaN for crops which are None or empty.
+    """
+    preds = np.full((len(crops), 3), np.nan, dtype="float32")
+    indices = [i for i, crop in enumerate(crops) if crop is not None and crop.size > 0]
+    if len(indices) == 0:
+        return preds
+    inputs = [torch.from_numpy(stage["cfg"].val_transforms(image=crops[i])["image"].transpose(2, 0, 1)).float() for i in indices]
+    out = np.stack(run_stage(stage, inputs, **predict_kwargs))[:, :3]
+    preds[indices] = out / out.sum(axis=1, keepdims=True)
+    return preds
+
+
+def predict_batch(studies, stages, timer, **predict_kwargs):
+    with timer("foramina"):
+        foramina = crop_foramina(stages["foramina"], studies, **predict_kwargs)
+    with timer("spinal_canal"):
+        spinal_canal = crop_spinal_canal(stages["spinal_canal"], studies, **predict_kwargs)
+    with timer("subarticular"):
+        subarticular = crop_subarticular(stages["subarticular_slices"], stages["subarticular_coords"], studies, **predict_kwargs)
+
+    # grader: [(condition, crops of each study)]
+    to_grade = {
+        "grade_foramen": [
+            ("left_neural_foraminal_narrowing", [c[0] if c is not None else None for c in foramina]),
+            ("right_neural_foraminal_narrowing", [c[1] if c is not None else None for c in foramina]),
+        ],
+        "grade_spinal": [
+            ("spinal_canal_stenosis", spinal_canal),
+        ],
+        "grade_subarticular": [
+            ("left_subarticular_stenosis", [c[0] if c is not None else None for c in subarticular]),
+            ("right_subarticular_stenosis", [c[1] if c is not None else None for c in subarticular]),
+        ],
+    }
+    dfs = []
+    for grader, conditions in to_grade.items():
+        # all crops of all studies and conditions for a grader are run together
+        crops, keys = [], []
+        for condition, study_crops in conditions:
+            for study, level_crops in zip(studies, study_crops):
+                crops.extend(level_crops if level_crops is not None else [None] * 5)
+                keys.append((study["study_id"], condition))
+        with timer(grader):
+            preds = grade(stages[grader], crops, **predict_kwargs).reshape(len(keys), 5, 3)
+        for (study_id, condition), study_preds in zip(keys, preds):
+            study_preds = np.where(np.isnan(study_preds), np.asarray(MISSING_PREDICTION)[None], study_preds)
+            dfs.append(convert_array_to_submission_df([study_preds], condition, study_id))
+    return pd.concat(dfs)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dicom-dir", type=str, required=True)
+    parser.add_argument("--series-descriptions", type=str, required=True)
+    parser.add_argument("--output", type=str, default="submission.csv")
+    parser.add_argument("--stage", type=str, nargs="+", default=[], help="override bundle of a stage as stage=bundle")
+    parser.add_argument("--device", type=str, default="cuda")
+    parser.add_argument("--amp", type=str, default=None, choices=["fp16", "bf16"])
+    parser.add_argument("--study-batch-size", type=int, default=16)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--num-workers", type=int, default=4)
+    parser.add_argument("--max-prefetch", type=int, default=32)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    timer = StageTimer(args.device)
+    stage_bundles = dict(STAGES)
+    for override in args.stage:
+        stage, bundle = override.split("=")
+        assert stage in STAGES, f"{stage} is not a valid stage, choose from {list(STAGES)}"
+        stage_bundles[stage] = bundle
+    with timer("load_models"):
+        stages = load_stages(stage_bundles, args.device)
+
+    description_df = pd.read_csv(args.series_descriptions)
+    series_descriptions = {f"{row.study_id}-{row.series_id}": row.series_description for row in description_df.itertuples()}
+    study_ids = description_df.study_id.unique().tolist()
+    load_fn = partial(load_study_or_empty, dicom_dir=args.dicom_dir, series_descriptions=series_descriptions)
+    loader = BackgroundLoader(study_ids, load_fn, num_workers=args.num_workers, max_prefetch=args.max_prefetch)
+    predict_kwargs = dict(batch_size=args.max_batch_size, device=args.device, amp=args.amp)
+
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    batches = iter(batched(loader, args.study_batch_size))
+    num_studies = 0
+    while True:
+        # time spent waiting for studies which were not loaded in the background yet
+        with timer("load_studies"):
+            studies = next(batches, None)
+        if studies is None:
+            break
+        pred_df = predict_batch(studies, stages, timer, **predict_kwargs)
+        with timer("write"):
+            pred_df.to_csv(args.output, mode="w" if num_studies == 0 else "a", header=num_studies == 0, index=False)
+        num_studies += len(studies)
+        print(f"{num_studies}/{len(study_ids)} studies")
+
+    print(f"\nSaved predictions for {num_studies} studies to {args.output}")
+    timer.report(num_studies)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,9 @@
 import cv2
+import glob
 import numpy as np
 import os, os.path as osp
 import pandas as pd
-
-from sklearn.model_selection import GroupKFold, StratifiedGroupKFold
+import pydicom
 
 
 def create_dir(d):
@@ -18,6 +18,9 @@ def draw_bounding_boxes(img, bboxes):
 
 
 def create_double_cv(df, id_column, num_inner, num_outer, stratified=None, seed=88):
+    # imported here so that inference scripts using this module do not import sklearn
+    from sklearn.model_selection import GroupKFold, StratifiedGroupKFold
+
     np.random.seed(seed)
     df = df.reset_index(drop=True)
     df["outer"] = -1
@@ -82,3 +85,68 @@ def convert_to_2dc(list_of_files, size=3):
         list_of_files_2dc.append(file_2dc)
     return list_of_files_2dc
 
+
+def convert_to_8bit(x):
+    lower, upper = np.percentile(x, (1, 99))
+    x = np.clip(x, lower, upper)
+    # x is a new array after clipping, so the remaining ops can be done in-place
+    x -= np.min(x)
+    x /= np.max(x)
+    x *= 255
+    return x.astype("uint8")
+
+
+def load_dicom_stack(dicom_folder_list, plane, reverse_sort=False, resize_mode="resize", pool=None):
+    """
+    Loads all DICOMs in `dicom_folder_list` into an 8-bit array sorted by position.
+
+    Some axial T2 series are broken up into segments, so a list of folders can be
+    passed and all of their DICOMs will be sorted together.
+
+    Headers are read first (without pixel data) to determine the sort order and
+    the output shape, then each file's pixel data is decoded once directly into
+    its sorted position in a preallocated float32 buffer. If the images are not
+    all the same shape, they are either resized (`resize_mode="resize"`) or
+    zero-padded around the center (`resize_mode="pad"`) to the largest shape.
+
+    `pool` is an optional executor (e.g., `concurrent.futures.ThreadPoolExecutor`)
+    used to read the DICOMs in parallel.
+
+    Returns array, instance numbers, ImagePositionPatient and pixel spacing.
+    """
+    assert resize_mode in ["resize", "pad"]
+    dicom_files = []
+    for dicom_folder in dicom_folder_list:
+        dicom_files.extend(glob.glob(os.path.join(dicom_folder, "*.dcm")))
+    map_fn = pool.map if pool is not None else map
+
+    # 1- header-only pass
+    headers = list(map_fn(lambda f: pydicom.dcmread(f, stop_before_pixels=True), dicom_files))
+    # There was one axial T2 study where orientation was coronal but when I checked the images they were axial
+    # So we should probably just trust the series description rather than determine orientation ourselves
+    plane = {"sagittal": 0, "coronal": 1, "axial": 2}[plane.lower()]
+    instances = np.asarray([int(d.InstanceNumber) for d in headers])
+    positions = np.asarray([float(d.ImagePositionPatient[plane]) for d in headers])
+    # if reverse_sort=False, then increasing array index will be from RIGHT->LEFT and CAUDAL->CRANIAL
+    # thus we do reverse_sort=True for axial so increasing array index is craniocaudal
+    idx = np.argsort(-positions if reverse_sort else positions)
+    ipp = np.asarray([d.ImagePositionPatient for d in headers]).astype("float")[idx]
+    array_shapes = np.asarray([(int(d.Rows), int(d.Columns)) for d in headers])
+    h, w = array_shapes[:, 0].max(), array_shapes[:, 1].max()
+
+    # 2- decode pixel data once per file into preallocated buffer, already in sorted order
+    array = np.empty((len(dicom_files), h, w), dtype="float32")
+
+    def _read_pixels(array_index, dicom_file):
+        img = pydicom.dcmread(dicom_file).pixel_array
+        if img.shape == (h, w):
+            array[array_index] = img
+        elif resize_mode == "resize":
+            array[array_index] = cv2.resize(img.astype("float32"), (w, h), interpolation=cv2.INTER_LINEAR)
+        else:
+            pad_h, pad_w = (h - img.shape[0]) // 2, (w - img.shape[1]) // 2
+            array[array_index] = 0
+            array[array_index, pad_h:pad_h + img.shape[0], pad_w:pad_w + img.shape[1]] = img
+
+    _ = list(map_fn(_read_pixels, range(len(idx)), [dicom_files[i] for i in idx]))
+    return convert_to_8bit(array), instances[idx], ipp, np.asarray(headers[0].PixelSpacing).astype("float")
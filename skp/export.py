@@ -0,0 +1,181 @@
+"""
+Export of Nets to TorchScript and ONNX for inference.
+
+Nets take a batch dict, compute the loss when asked and branch on `cfg` in
+`forward`, none of which is needed at inference time. `InferenceGraph` wraps
+a Net (without its criterion) as `forward(x) -> logits`, which is traced with
+the config branches resolved. Normalization is part of the Net
+(`models.normalization.Normalization`), so its constants are folded into the
+graph.
+
+    TorchScript: traced and frozen (weights inlined as constants), `<name>.ts`
+    ONNX:        opset 17, `<name>.onnx`
+
+Inputs and outputs are named "x" and "logits" (and "features" with
+`--return-features`), with a dynamic batch dimension. Each export is checked
+against the eager Net on a new input with a different batch size.
+
+Intended for net_2d, net_2d_all_slices_seq, net_x3d and unet_2d.
+
+net_2d_all_slices_seq is exported without its padding `mask` input, so the
+transformer head attends to all slices. Exported graphs are therefore only valid
+for unpadded sequences of `cfg.max_num_images` slices (16 if not set), and
+functions from `load_exported` raise if they are given a mask with padding. Use
+the eager Net for padded sequences.
+
+Usage (from skp/):
+    python export.py cfg_identify_subarticular_slices --formats torchscript onnx --folds 0 1 2 3 4
+
+Exports folds of bundles in the model registry (see registry.py) into the
+bundle directory.
+"""
+import argparse
+import copy
+import os
+import torch
+import torch.nn as nn
+
+import registry
+
+
+INPUT_NAMES = ["x"]
+
+
+class InferenceGraph(nn.Module):
+
+    def __init__(self, net, return_features=False):
+        super().__init__()
+        self.net = net
+        self.return_features = return_features
+
+    def forward(self, x):
+        out = self.net({"x": x}, return_features=self.return_features)
+        if self.return_features:
+            return out["logits"], out["features"]
+        return out["logits"]
+
+
+def get_output_names(return_features=False):
+    return ["logits", "features"] if return_features else ["logits"]
+
+
+def get_input_shape(cfg, batch_size=1):
+    if cfg.model == "net_2d_all_slices_seq":
+        return (batch_size, cfg.max_num_images or 16, cfg.num_input_channels, cfg.image_height, cfg.image_width)
+    if cfg.image_z:
+        return (batch_size, cfg.num_input_channels, cfg.image_z, cfg.image_height, cfg.image_width)
+    return (batch_size, cfg.num_input_channels, cfg.image_height, cfg.image_width)
+
+
+def get_inference_graph(net, return_features=False):
+    net = copy.deepcopy(net).cpu().eval()
+    # loss is not part of the inference graph
+    if hasattr(net, "criterion"):
+        del net.criterion
+    for param in net.parameters():
+        param.requires_grad = False
+    return InferenceGraph(net, return_features=return_features).eval()
+
+
+def export_torchscript(net, x, path, return_features=False):
+    graph = get_inference_graph(net, return_features)
+    with torch.no_grad():
+        traced = torch.jit.trace(graph, (x, ))
+    traced = torch.jit.freeze(traced)
+    torch.jit.save(traced, path)
+    return path
+
+
+def export_onnx(net, x, path, return_features=False, opset_version=17):
+    graph = get_inference_graph(net, return_features)
+    output_names = get_output_names(return_features)
+    # first dim of outputs is not always the batch size (e.g., B * Z for net_2d_all_slices_seq)
+    dynamic_axes = {name: {0: f"{name}_dim0"} for name in INPUT_NAMES + output_names}
+    with torch.no_grad():
+        torch.onnx.export(graph, (x, ), path, input_names=INPUT_NAMES, output_names=output_names,
+                          dynamic_axes=dynamic_axes, opset_version=opset_version)
+    return path
+
+
+EXPORT_FUNCTIONS = {
+    "torchscript": (export_torchscript, ".ts"),
+    "onnx": (export_onnx, ".onnx")
+}
+
+
+def check_unpadded(mask):
+    if mask is not None and bool(mask.any()):
+        raise ValueError("exported graphs do not apply the padding mask, use the eager Net for padded sequences")
+
+
+def load_exported(path):
+    # returns function of x (CPU tensor) -> list of output tensors
+    # `mask` (padding of net_2d_all_slices_seq) is only checked, it is not an input of the graph
+    if path.endswith(".onnx"):
+        import onnxruntime as ort
+        session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        def run(x, mask=None):
+            check_unpadded(mask)
+            return [torch.from_numpy(out) for out in session.run(None, {"x": x.numpy()})]
+        return run
+    module = torch.jit.load(path, map_location="cpu")
+    def run(x, mask=None):
+        check_unpadded(mask)
+        with torch.no_grad():
+            out = module(x)
+        return list(out) if isinstance(out, tuple) else [out]
+    return run
+
+
+def check_parity(net, path, x, return_features=False, rtol=1e-3, atol=1e-4):
+    """
+    Checks that outputs of the exported graph at `path` match the eager Net on
+    `x`. Returns max absolute difference.
+    """
+    graph = get_inference_graph(net, return_features)
+    with torch.no_grad():
+        expected = graph(x)
+    expected = list(expected) if isinstance(expected, tuple) else [expected]
+    actual = load_exported(path)(x)
+    max_diff = 0
+    for name, a, e in zip(get_output_names(return_features), actual, expected):
+        torch.testing.assert_close(a, e, rtol=rtol, atol=atol, msg=lambda m: f"{path} output `{name}`: {m}")
+        max_diff = max(max_diff, (a - e).abs().max().item())
+    return max_diff
+
+
+def export(net, cfg, path_prefix, formats, batch_size=1, return_features=False):
+    x = torch.randn(get_input_shape(cfg, batch_size))
+    # different batch size to check that it is not fixed in the graph
+    x_check = torch.randn(get_input_shape(cfg, batch_size + 1))
+    paths = {}
+    for fmt in formats:
+        export_fn, ext = EXPORT_FUNCTIONS[fmt]
+        paths[fmt] = export_fn(net, x, path_prefix + ext, return_features=return_features)
+        max_diff = check_parity(net, paths[fmt], x_check, return_features=return_features)
+        print(f"Saved {paths[fmt]} (max abs diff vs eager {max_diff:.2e})")
+    return paths
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("bundle", type=str)
+    parser.add_argument("--formats", type=str, nargs="+", default=["torchscript", "onnx"], choices=list(EXPORT_FUNCTIONS))
+    parser.add_argument("--folds", type=int, nargs="+", default=None)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--return-features", action="store_true")
+    parser.add_argument("--registry-dir", type=str, default=None)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    bundle = registry.load_bundle(args.bundle, device="cpu", folds=args.folds, registry_dir=args.registry_dir)
+    bundle_dir = registry.get_bundle_dir(args.bundle, args.registry_dir)
+    for fold, net in bundle["models"].items():
+        export(net, bundle["cfg"], os.path.join(bundle_dir, f"fold{fold}"), args.formats,
+               batch_size=args.batch_size, return_features=args.return_features)
+
+
+if __name__ == "__main__":
+    main()
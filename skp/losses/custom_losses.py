@@ -2,7 +2,6 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from monai.losses import DiceLoss, GeneralizedDiceLoss, DiceCELoss
 from torchvision.ops import sigmoid_focal_loss
 
 
@@ -527,6 +526,8 @@ class GeneralizedDSC(nn.Module):
 
     def __init__(self, *args, **kwargs):
         super().__init__()
+        # imported here, monai is slow to import and only needed for this loss
+        from monai.losses import DiceLoss
         self.loss_func = DiceLoss(include_background=True, to_onehot_y=True, sigmoid=False, softmax=True)
 
     def forward(self, p, t):
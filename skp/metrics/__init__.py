@@ -1,8 +1,23 @@
+import importlib
 import torchmetrics as tm
 
-from .classification import *
-from .segmentation import *
-from .detection import *
+
+# metrics are resolved by name on first use, e.g. `getattr(metrics, "AUROC")`,
+# importing only the submodules needed to find them (in this order)
+# rather than all of them (and their dependencies) on `import metrics`
+SUBMODULES = ["classification", "segmentation", "detection"]
+
+
+def __getattr__(name):
+    if name.startswith("__"):
+        raise AttributeError(name)
+    for submodule in SUBMODULES:
+        module = importlib.import_module(f".{submodule}", __name__)
+        if hasattr(module, name):
+            value = getattr(module, name)
+            globals()[name] = value
+            return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class Dummy(tm.Metric):
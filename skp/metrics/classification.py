@@ -1,5 +1,4 @@
 import numpy as np
-import pandas as pd
 import pytorch_lightning as pl
 import torch
 import torch.nn.functional as F
@@ -8,6 +7,9 @@ import torchmetrics as tm
 from functools import partial
 from sklearn import metrics as skm 
 
+from .segment import segment_reduce
+from .streaming import StreamingMetric
+
 
 def _roc_auc_score(t, p):
     try:
@@ -28,28 +30,80 @@ def _average_precision_score(t, p):
         return torch.tensor(0)
 
 
-class _BaseMetric(tm.Metric):
-    def __init__(self, cfg, dist_sync_on_step=False):
-        super().__init__(dist_sync_on_step=dist_sync_on_step)
-        
-        self.cfg = cfg 
-
-        self.add_state("p", default=[], dist_reduce_fx=None)
-        self.add_state("t", default=[], dist_reduce_fx=None)
+def _multiaug_metrics(p, t, unique_id):
+    """
+    Loss and AUC over crops, and after taking the mean and median of the
+    predictions over all crop augs of each `unique_id`. `p` and `t` are (N, 3).
+    """
+    wts = np.ones((len(p), ))
+    wts[t[:, 1] == 1] = 2
+    wts[t[:, 2] == 1] = 4
+    metrics_dict = {}
+    metrics_dict["loss_crop"] = skm.log_loss(y_true=t, y_pred=p, sample_weight=wts)
+    for c in range(p.shape[1]):
+        metrics_dict[f"auc_crop{c}"] = _roc_auc_score(t=t[:, c], p=p[:, c])
+    metrics_dict["auc_crop_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_crop" in k])
+    # Take mean and median of crop augs
+    _, agg = segment_reduce(np.concatenate([p[:, :3], t[:, :3], wts[:, None]], axis=1), unique_id, reductions=("mean", "median"))
+    for name, by_agg in agg.items():
+        by_agg = by_agg.numpy()
+        metrics_dict[f"loss_{name}"] = skm.log_loss(y_true=by_agg[:, 3:6], 
+                                                    y_pred=by_agg[:, :3], 
+                                                    sample_weight=by_agg[:, 6])
+        for c in range(p.shape[1]):
+            metrics_dict[f"auc_{name}agg{c}"] = _roc_auc_score(t=by_agg[:, 3 + c], p=by_agg[:, c])
+        metrics_dict[f"auc_{name}agg_mean"] = np.mean([v for k, v in metrics_dict.items() if f"auc_{name}agg" in k])
+    return metrics_dict
+
+
+class _BaseMetric(StreamingMetric):
+
+    fields = ("p", "t")
 
     def update(self, p, t):
-        self.p.append(p.float())
-        self.t.append(t.float())
+        super().update(p.float(), t.float())
+
+    @property
+    def p(self):
+        return self.gather()["p"]
+
+    @property
+    def t(self):
+        return self.gather()["t"]
 
     def compute(self):
         raise NotImplementedError
 
 
+class _SeqMetric(_BaseMetric):
+
+    def update(self, p, t):
+        # use batch_size 1, only keep the sequence
+        super().update(p[0], t[0])
+
+
+class _MultiAugMetric(StreamingMetric):
+
+    fields = ("p", "t", "unique_id")
+
+    @property
+    def p(self):
+        return self.gather()["p"]
+
+    @property
+    def t(self):
+        return self.gather()["t"]
+
+    @property
+    def unique_id(self):
+        return self.gather()["unique_id"]
+
+
 class _ScoreBased(_BaseMetric):
 
     def compute(self):
-        p = torch.cat(self.p, dim=0).cpu().numpy()  # (N,) or (N,C)
-        t = torch.cat(self.t, dim=0).cpu().numpy()  # (N,) or (N,C)
+        p = self.p.cpu().numpy()  # (N,) or (N,C)
+        t = self.t.cpu().numpy()  # (N,) or (N,C)
         if p.ndim == 1:
             # Binary classification
             return {f"{self.name}_mean": self.metric_func(t, p)}
@@ -66,8 +120,8 @@ class _ScoreBased(_BaseMetric):
 class _ClassBased(_BaseMetric):
 
     def compute(self):
-        p = torch.cat(self.p, dim=0).cpu().numpy()  # (N,) or (N,C)
-        t = torch.cat(self.t, dim=0).cpu().numpy()  # (N,) or (N,C)
+        p = self.p.cpu().numpy()  # (N,) or (N,C)
+        t = self.t.cpu().numpy()  # (N,) or (N,C)
         if p.ndim == 1:
             # Binary classification
             return {f"{self.name}": self.metric_func(t, p)}
@@ -84,8 +138,8 @@ class AUROC(_ScoreBased):
 class AUROCFlatten(_BaseMetric):
 
     def compute(self):
-        p = torch.cat(self.p, dim=0).cpu() # (N, seq_len, C)
-        t = torch.cat(self.t, dim=0).cpu() # (N, seq_len, C)
+        p = self.p.cpu() # (N, seq_len, C)
+        t = self.t.cpu() # (N, seq_len, C)
         p, t = p.view(-1, p.shape[-1]).numpy(), t.view(-1, t.shape[-1]).numpy()
         metrics_dict = {}
         for c in range(p.shape[1]):
@@ -100,8 +154,8 @@ class AUROCFlatten(_BaseMetric):
 class AUROCBilat(_BaseMetric):
 
     def compute(self):
-        p = torch.cat(self.p, dim=0).cpu() # (N, 6)
-        t = torch.cat(self.t, dim=0).cpu() # (N, 6)
+        p = self.p.cpu() # (N, 6)
+        t = self.t.cpu() # (N, 6)
         p = torch.cat([p[:, :3], p[:, 3:]], dim=0).numpy()
         t = torch.cat([t[:, :3], t[:, 3:]], dim=0).numpy()
         metrics_dict = {}
@@ -117,11 +171,12 @@ class AUROCBilat(_BaseMetric):
 class AUROCAxT2(_BaseMetric):
 
     def compute(self):
-        p = torch.cat(self.p, dim=0).cpu()
+        # clone, `self.p` is the cached state and must not be modified
+        p = self.p.cpu().clone()
         p[:, :11] = F.softmax(p[:, :11], dim=1)
         p[:, [11, 12]] = p[:, [11, 12]].sigmoid()
         p = p.numpy()[:, :13]
-        t = torch.cat(self.t, dim=0).cpu().numpy()[:, :13]
+        t = self.t.cpu().numpy()[:, :13]
         metrics_dict = {}
         for c in range(p.shape[1]):
             # Depends on whether it is multilabel or multiclass
@@ -132,12 +187,11 @@ class AUROCAxT2(_BaseMetric):
         return metrics_dict
 
 
-class AUROCSeq(_BaseMetric):
+class AUROCSeq(_SeqMetric):
 
     def compute(self):
-        # use batch_size 1
-        p = torch.cat([_[0] for _ in self.p], dim=0).cpu().sigmoid().numpy()[:, :16] # (N, C)
-        t = torch.cat([_[0] for _ in self.t], dim=0).cpu().numpy()[:, :16] # (N, C)
+        p = self.p.cpu().sigmoid().numpy()[:, :16] # (N, C)
+        t = self.t.cpu().numpy()[:, :16] # (N, C)
         metrics_dict = {}
         for c in range(p.shape[1]):
             # Depends on whether it is multilabel or multiclass
@@ -148,12 +202,11 @@ class AUROCSeq(_BaseMetric):
         return metrics_dict
 
 
-class AUROCDistSeq(_BaseMetric):
+class AUROCDistSeq(_SeqMetric):
 
     def compute(self):
-        # use batch_size 1
-        p = torch.cat([_[0] for _ in self.p], dim=0).cpu()
-        t = torch.cat([_[0] for _ in self.t], dim=0).cpu().numpy()
+        p = self.p.cpu()
+        t = self.t.cpu().numpy()
         p1, p2 = p.sigmoid().numpy()[:, :5], p.numpy()[:, 5:]
         t1, t2 = t[:, :5], t[:, 5:]
         metrics_dict = {}
@@ -169,12 +222,11 @@ class AUROCDistSeq(_BaseMetric):
         return metrics_dict
 
 
-class AUROCDistSeq2(_BaseMetric):
+class AUROCDistSeq2(_SeqMetric):
 
     def compute(self):
-        # use batch_size 1
-        p = torch.cat([_[0] for _ in self.p], dim=0).cpu()
-        t = torch.cat([_[0] for _ in self.t], dim=0).cpu().numpy()
+        p = self.p.cpu()
+        t = self.t.cpu().numpy()
         p1, p2 = p.sigmoid().numpy()[:, :10], p.numpy()[:, 10:]
         t1, t2 = t[:, :10], t[:, 10:]
         metrics_dict = {}
@@ -190,12 +242,11 @@ class AUROCDistSeq2(_BaseMetric):
         return metrics_dict
 
 
-class AUROCDistSeq3(_BaseMetric):
+class AUROCDistSeq3(_SeqMetric):
 
     def compute(self):
-        # use batch_size 1
-        p = torch.cat([_[0] for _ in self.p], dim=0).cpu()
-        t = torch.cat([_[0] for _ in self.t], dim=0).cpu().numpy()
+        p = self.p.cpu()
+        t = self.t.cpu().numpy()
         p1, p2 = p.sigmoid().numpy()[:, :2], p.numpy()[:, 2:]
         t1, t2 = t[:, :2], t[:, 2:]
         metrics_dict = {}
@@ -237,16 +288,16 @@ class QWK(_ClassBased):
 class MAE(_BaseMetric):
 
     def compute(self):
-        p = torch.cat(self.p, dim=0).cpu().numpy()
-        t = torch.cat(self.t, dim=0).cpu().numpy()
+        p = self.p.cpu().numpy()
+        t = self.t.cpu().numpy()
         return {"mae": np.mean(np.abs(p - t))}
 
 
 class MAE10(_BaseMetric):
 
     def compute(self):
-        p = torch.cat(self.p, dim=0).cpu().numpy()
-        t = torch.cat(self.t, dim=0).cpu().numpy()
+        p = self.p.cpu().numpy()
+        t = self.t.cpu().numpy()
         metrics_dict = {"mae": np.mean(np.abs(p - t))}
         for i in range(p.shape[1]):
             metrics_dict[f"mae{i:02d}"] = np.mean(np.abs(p[:, i] - t[:, i]))
@@ -256,10 +307,10 @@ class MAE10(_BaseMetric):
 class MAEDistAndCoords(_BaseMetric):
 
     def compute(self):
-        p = torch.cat(self.p, dim=0).cpu()
+        p = self.p.cpu().clone()
         p[:, 10:] = p[:, 10:].sigmoid()
         p = p.numpy()
-        t = torch.cat(self.t, dim=0).cpu().numpy()
+        t = self.t.cpu().numpy()
         metrics_dict = {"mae": np.mean(np.abs(p - t))}
         for i in range(p.shape[1]):
             metrics_dict[f"mae{i:02d}"] = np.mean(np.abs(p[:, i] - t[:, i]))
@@ -271,16 +322,16 @@ class MAEDistAndCoords(_BaseMetric):
 class MAESigmoid(_BaseMetric):
 
     def compute(self):
-        p = torch.cat(self.p, dim=0).sigmoid().cpu().numpy()
-        t = torch.cat(self.t, dim=0).cpu().numpy()
+        p = self.p.sigmoid().cpu().numpy()
+        t = self.t.cpu().numpy()
         return {"mae": np.mean(np.abs(p - t))}
 
 
 class MAETanh(_BaseMetric):
 
     def compute(self):
-        p = torch.cat(self.p, dim=0).tanh().cpu().numpy()
-        t = torch.cat(self.t, dim=0).cpu().numpy()
+        p = self.p.tanh().cpu().numpy()
+        t = self.t.cpu().numpy()
         metrics_dict = {"mae": np.mean(np.abs(p - t))}
         for i in range(p.shape[1]):
             metrics_dict[f"mae{i:02d}"] = np.mean(np.abs(p[:, i] - t[:, i]))
@@ -290,17 +341,17 @@ class MAETanh(_BaseMetric):
 class MAEScale100(_BaseMetric):
 
     def compute(self):
-        p = torch.cat(self.p, dim=0).cpu().numpy()
-        t = torch.cat(self.t, dim=0).cpu().numpy()
+        p = self.p.cpu().numpy()
+        t = self.t.cpu().numpy()
         return {"mae": np.mean(np.abs(p - t)) * 100}
 
 
 class MAE_CE(_BaseMetric):
 
     def compute(self):
-        p = torch.cat(self.p, dim=0).cpu().numpy()
+        p = self.p.cpu().numpy()
         p = np.argmax(p, axis=1) + 18 
-        t = torch.cat(self.t, dim=0).cpu().numpy()[:, 0] + 18
+        t = self.t.cpu().numpy()[:, 0] + 18
         assert p.shape == t.shape, f"p.shape is {p.shape} while t.shape is {t.shape}"
         return {"mae": np.mean(np.abs(p - t))}
 
@@ -308,9 +359,9 @@ class MAE_CE(_BaseMetric):
 class CompetitionMetricTorch(_BaseMetric):
 
     def compute(self):
-        p = torch.cat(self.p, dim=0).cpu().sigmoid()
+        p = self.p.cpu().sigmoid()
         p = p / (p.sum(1).unsqueeze(1) + 1e-10)
-        t = torch.cat(self.t, dim=0).cpu()
+        t = self.t.cpu()
         w = torch.ones((len(p), ))
         w[t[:, 1] == 1] = 2
         w[t[:, 2] == 1] = 4
@@ -323,10 +374,10 @@ class CompetitionMetricTorch(_BaseMetric):
 class CompetitionMetric(_BaseMetric):
 
     def compute(self):
-        p = torch.cat(self.p, dim=0).cpu().sigmoid()
+        p = self.p.cpu().sigmoid()
         p = p / (p.sum(1).unsqueeze(1) + 1e-10)
         p = p.numpy()
-        t = torch.cat(self.t, dim=0).cpu().numpy()
+        t = self.t.cpu().numpy()
         wts = np.ones((len(p), ))
         wts[t[:, 1] == 1] = 2
         wts[t[:, 2] == 1] = 4
@@ -345,8 +396,8 @@ class CompetitionMetricWithSoftmaxTorch(_BaseMetric):
             return loss.mean()
 
     def compute(self):
-        p = torch.cat(self.p, dim=0).cpu()
-        t = torch.cat(self.t, dim=0).cpu()
+        p = self.p.cpu()
+        t = self.t.cpu()
         wts = torch.ones((len(p), ))
         wts[t[:, 1] == 1] = 2
         wts[t[:, 2] == 1] = 4
@@ -356,9 +407,9 @@ class CompetitionMetricWithSoftmaxTorch(_BaseMetric):
 class CompetitionMetricWithSoftmax(_BaseMetric):
 
     def compute(self):
-        p = F.softmax(torch.cat(self.p, dim=0).cpu(), dim=1)
+        p = F.softmax(self.p.cpu(), dim=1)
         p = p.numpy()
-        t = torch.cat(self.t, dim=0).cpu().numpy()
+        t = self.t.cpu().numpy()
         wts = np.ones((len(p), ))
         wts[t[:, 1] == 1] = 2
         wts[t[:, 2] == 1] = 4
@@ -368,8 +419,8 @@ class CompetitionMetricWithSoftmax(_BaseMetric):
 class CompetitionMetricTorchAndNumpy(_BaseMetric):
 
     def compute(self):
-        p = torch.cat(self.p, dim=0).cpu().sigmoid()
-        t = torch.cat(self.t, dim=0).cpu()
+        p = self.p.cpu().sigmoid()
+        t = self.t.cpu()
         w = torch.ones((len(p), 1))
         w[t[:, 1] == 1] = 2
         w[t[:, 2] == 1] = 4
@@ -384,8 +435,8 @@ class CompetitionMetricTorchAndNumpy(_BaseMetric):
 class CompetitionMetricPlusAUROCBilateralSoftmax(_BaseMetric):
 
     def compute(self):
-        p = torch.cat(self.p, dim=0).cpu()
-        t = torch.cat(self.t, dim=0).cpu()
+        p = self.p.cpu()
+        t = self.t.cpu()
         p = F.softmax(torch.cat([p[:, :3], p[:, 3:]], dim=0), dim=1).numpy()
         t = torch.cat([t[:, :3], t[:, 3:]], dim=0).numpy()
         wts = np.ones((len(p), ))
@@ -401,8 +452,8 @@ class CompetitionMetricPlusAUROCBilateralSoftmax(_BaseMetric):
 class CompetitionMetricPlusAUROCSigmoid(_BaseMetric):
 
     def compute(self):
-        p = torch.cat(self.p, dim=0).cpu().sigmoid()
-        t = torch.cat(self.t, dim=0).cpu()
+        p = self.p.cpu().sigmoid()
+        t = self.t.cpu()
         wts = np.ones((len(p), ))
         wts[t[:, 1] == 1] = 2
         wts[t[:, 2] == 1] = 4
@@ -417,8 +468,8 @@ class CompetitionMetricPlusAUROCSigmoid(_BaseMetric):
 class CompetitionMetricPlusAUROCSoftmax(_BaseMetric):
 
     def compute(self):
-        p = torch.softmax(torch.cat(self.p, dim=0).cpu(), dim=1)
-        t = torch.cat(self.t, dim=0).cpu()
+        p = torch.softmax(self.p.cpu(), dim=1)
+        t = self.t.cpu()
         wts = np.ones((len(p), ))
         wts[t[:, 1] == 1] = 2
         wts[t[:, 2] == 1] = 4
@@ -429,123 +480,29 @@ class CompetitionMetricPlusAUROCSoftmax(_BaseMetric):
         return metrics_dict
 
 
-class CompetitionMetricPlusAUROCMultiAug(tm.Metric):
-
-    def __init__(self, cfg, dist_sync_on_step=False):
-        super().__init__(dist_sync_on_step=dist_sync_on_step)
-
-        self.add_state("p", default=[], dist_reduce_fx=None)
-        self.add_state("t", default=[], dist_reduce_fx=None)
-        self.add_state("unique_id", default=[], dist_reduce_fx=None)
-
-    def update(self, p, t, unique_id):
-        self.p.append(p)
-        self.t.append(t)
-        self.unique_id.append(unique_id)
+class CompetitionMetricPlusAUROCMultiAug(_MultiAugMetric):
 
     def compute(self):
-        p = F.softmax(torch.cat(self.p, dim=0).cpu().float(), dim=1).numpy()
-        t = torch.cat(self.t).cpu().numpy()
-        wts = np.ones((len(p), ))
-        wts[t[:, 1] == 1] = 2
-        wts[t[:, 2] == 1] = 4
-        metrics_dict = {}
-        metrics_dict["loss_crop"] = skm.log_loss(y_true=t, y_pred=p, sample_weight=wts)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_crop{c}"] = _roc_auc_score(t=t[:, c], p=p[:, c])
-        metrics_dict["auc_crop_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_crop" in k])
-        # Take mean and median of crop augs
-        tmp_df = pd.DataFrame({
-            "p0": p[:, 0], "p1": p[:, 1], "p2": p[:, 2], 
-            "t0": t[:, 0], "t1": t[:, 1], "t2": t[:, 2],  
-            "wts": wts, 
-            "unique_id": torch.cat(self.unique_id).cpu().numpy()
-        })
-        df_by_mean = tmp_df.groupby("unique_id").mean() 
-        df_by_median = tmp_df.groupby("unique_id").median()
-        metrics_dict["loss_mean"] = skm.log_loss(y_true=df_by_mean[["t0", "t1", "t2"]].values, 
-                                                 y_pred=df_by_mean[["p0", "p1", "p2"]].values, 
-                                                 sample_weight=df_by_mean.wts.values)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_meanagg{c}"] = _roc_auc_score(t=df_by_mean[f"t{c}"].values, p=df_by_mean[f"p{c}"].values)
-        metrics_dict["auc_meanagg_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_meanagg" in k])
-        metrics_dict["loss_median"] = skm.log_loss(y_true=df_by_median[["t0", "t1", "t2"]].values, 
-                                                   y_pred=df_by_median[["p0", "p1", "p2"]].values, 
-                                                   sample_weight=df_by_median.wts.values)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_medianagg{c}"] = _roc_auc_score(t=df_by_median[f"t{c}"].values, p=df_by_median[f"p{c}"].values)
-        metrics_dict["auc_medianagg_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_medianagg" in k])
-        return metrics_dict
-
+        p = F.softmax(self.p.cpu().float(), dim=1).numpy()
+        t = self.t.cpu().numpy()
+        return _multiaug_metrics(p, t, self.unique_id.cpu().numpy())
 
-class CompetitionMetricPlusAUROCMultiAugSigmoid(tm.Metric):
 
-    def __init__(self, cfg, dist_sync_on_step=False):
-        super().__init__(dist_sync_on_step=dist_sync_on_step)
-
-        self.add_state("p", default=[], dist_reduce_fx=None)
-        self.add_state("t", default=[], dist_reduce_fx=None)
-        self.add_state("unique_id", default=[], dist_reduce_fx=None)
-
-    def update(self, p, t, unique_id):
-        self.p.append(p)
-        self.t.append(t)
-        self.unique_id.append(unique_id)
+class CompetitionMetricPlusAUROCMultiAugSigmoid(_MultiAugMetric):
 
     def compute(self):
-        p = torch.cat(self.p).sigmoid().cpu().float().numpy()[:, :3]
-        t = torch.cat(self.t).cpu().numpy()[:, :3]
-        wts = np.ones((len(p), ))
-        wts[t[:, 1] == 1] = 2
-        wts[t[:, 2] == 1] = 4
-        metrics_dict = {}
-        metrics_dict["loss_crop"] = skm.log_loss(y_true=t, y_pred=p, sample_weight=wts)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_crop{c}"] = _roc_auc_score(t=t[:, c], p=p[:, c])
-        metrics_dict["auc_crop_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_crop" in k])
-        # Take mean and median of crop augs
-        tmp_df = pd.DataFrame({
-            "p0": p[:, 0], "p1": p[:, 1], "p2": p[:, 2], 
-            "t0": t[:, 0], "t1": t[:, 1], "t2": t[:, 2],  
-            "wts": wts, 
-            "unique_id": torch.cat(self.unique_id).cpu().numpy()
-        })
-        df_by_mean = tmp_df.groupby("unique_id").mean() 
-        df_by_median = tmp_df.groupby("unique_id").median()
-        metrics_dict["loss_mean"] = skm.log_loss(y_true=df_by_mean[["t0", "t1", "t2"]].values, 
-                                                 y_pred=df_by_mean[["p0", "p1", "p2"]].values, 
-                                                 sample_weight=df_by_mean.wts.values)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_meanagg{c}"] = _roc_auc_score(t=df_by_mean[f"t{c}"].values, p=df_by_mean[f"p{c}"].values)
-        metrics_dict["auc_meanagg_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_meanagg" in k])
-        metrics_dict["loss_median"] = skm.log_loss(y_true=df_by_median[["t0", "t1", "t2"]].values, 
-                                                   y_pred=df_by_median[["p0", "p1", "p2"]].values, 
-                                                   sample_weight=df_by_median.wts.values)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_medianagg{c}"] = _roc_auc_score(t=df_by_median[f"t{c}"].values, p=df_by_median[f"p{c}"].values)
-        metrics_dict["auc_medianagg_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_medianagg" in k])
-        return metrics_dict
-
-
-class CompetitionMetricPlusAUROCMultiAugSigmoidValidSlice(tm.Metric):
-
-    def __init__(self, cfg, dist_sync_on_step=False):
-        super().__init__(dist_sync_on_step=dist_sync_on_step)
+        p = self.p.sigmoid().cpu().float().numpy()[:, :3]
+        t = self.t.cpu().numpy()[:, :3]
+        return _multiaug_metrics(p, t, self.unique_id.cpu().numpy())
 
-        self.add_state("p", default=[], dist_reduce_fx=None)
-        self.add_state("t", default=[], dist_reduce_fx=None)
-        self.add_state("unique_id", default=[], dist_reduce_fx=None)
 
-    def update(self, p, t, unique_id):
-        self.p.append(p)
-        self.t.append(t)
-        self.unique_id.append(unique_id)
+class CompetitionMetricPlusAUROCMultiAugSigmoidValidSlice(_MultiAugMetric):
 
     def compute(self):
         metrics_dict = {}
-        p = torch.cat(self.p).sigmoid().cpu().float().numpy()
-        t = torch.cat(self.t).cpu().reshape(p.shape[0], -1).numpy()
-        ids = torch.cat(self.unique_id).cpu().reshape(p.shape[0]).numpy()
+        p = self.p.sigmoid().cpu().float().numpy()
+        t = self.t.cpu().reshape(p.shape[0], -1).numpy()
+        ids = self.unique_id.cpu().reshape(p.shape[0]).numpy()
         p, pv = p[:, :3], p[:, 3]
         t, tv = t[:, :3], t[:, 3]
         metrics_dict["auc_valid_slice"] = _roc_auc_score(t=(tv > 0).astype("int"), p=pv)
@@ -557,56 +514,17 @@ class CompetitionMetricPlusAUROCMultiAugSigmoidValidSlice(tm.Metric):
             predicted_valid = pv >= thresh
             num_pred_val = np.sum(predicted_valid)
         p, t, ids = p[predicted_valid], t[predicted_valid], ids[predicted_valid]
-        wts = np.ones((len(p), ))
-        wts[t[:, 1] == 1] = 2
-        wts[t[:, 2] == 1] = 4
-        metrics_dict["loss_crop"] = skm.log_loss(y_true=t, y_pred=p, sample_weight=wts)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_crop{c}"] = _roc_auc_score(t=t[:, c], p=p[:, c])
-        metrics_dict["auc_crop_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_crop" in k])
-        # Take mean and median of crop augs
-        tmp_df = pd.DataFrame({
-            "p0": p[:, 0], "p1": p[:, 1], "p2": p[:, 2], 
-            "t0": t[:, 0], "t1": t[:, 1], "t2": t[:, 2],  
-            "wts": wts, 
-            "unique_id": ids
-        })
-        df_by_mean = tmp_df.groupby("unique_id").mean() 
-        df_by_median = tmp_df.groupby("unique_id").median()
-        metrics_dict["loss_mean"] = skm.log_loss(y_true=df_by_mean[["t0", "t1", "t2"]].values, 
-                                                 y_pred=df_by_mean[["p0", "p1", "p2"]].values, 
-                                                 sample_weight=df_by_mean.wts.values)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_meanagg{c}"] = _roc_auc_score(t=df_by_mean[f"t{c}"].values, p=df_by_mean[f"p{c}"].values)
-        metrics_dict["auc_meanagg_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_meanagg" in k])
-        metrics_dict["loss_median"] = skm.log_loss(y_true=df_by_median[["t0", "t1", "t2"]].values, 
-                                                   y_pred=df_by_median[["p0", "p1", "p2"]].values, 
-                                                   sample_weight=df_by_median.wts.values)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_medianagg{c}"] = _roc_auc_score(t=df_by_median[f"t{c}"].values, p=df_by_median[f"p{c}"].values)
-        metrics_dict["auc_medianagg_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_medianagg" in k])
+        metrics_dict.update(_multiaug_metrics(p, t, ids))
         return metrics_dict
 
 
-class CompetitionMetricPlusAUROCMultiAugSoftmaxValidSlice(tm.Metric):
-
-    def __init__(self, cfg, dist_sync_on_step=False):
-        super().__init__(dist_sync_on_step=dist_sync_on_step)
-
-        self.add_state("p", default=[], dist_reduce_fx=None)
-        self.add_state("t", default=[], dist_reduce_fx=None)
-        self.add_state("unique_id", default=[], dist_reduce_fx=None)
-
-    def update(self, p, t, unique_id):
-        self.p.append(p)
-        self.t.append(t)
-        self.unique_id.append(unique_id)
+class CompetitionMetricPlusAUROCMultiAugSoftmaxValidSlice(_MultiAugMetric):
 
     def compute(self):
         metrics_dict = {}
-        p = torch.cat(self.p).cpu().float()
-        t = torch.cat(self.t).cpu().numpy()
-        ids = torch.cat(self.unique_id).cpu().numpy()
+        p = self.p.cpu().float()
+        t = self.t.cpu().numpy()
+        ids = self.unique_id.cpu().numpy()
         p, pv = torch.softmax(p[:, :3], dim=1).numpy(), p[:, 3].sigmoid().numpy()
         t, tv = t[:, :3], t[:, 3]
         metrics_dict["auc_valid_slice"] = _roc_auc_score(t=(tv > 0).astype("int"), p=pv)
@@ -618,223 +536,46 @@ class CompetitionMetricPlusAUROCMultiAugSoftmaxValidSlice(tm.Metric):
             predicted_valid = pv >= thresh
             num_pred_val = np.sum(predicted_valid)
         p, t, ids = p[predicted_valid], t[predicted_valid], ids[predicted_valid]
-        wts = np.ones((len(p), ))
-        wts[t[:, 1] == 1] = 2
-        wts[t[:, 2] == 1] = 4
-        metrics_dict["loss_crop"] = skm.log_loss(y_true=t, y_pred=p, sample_weight=wts)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_crop{c}"] = _roc_auc_score(t=t[:, c], p=p[:, c])
-        metrics_dict["auc_crop_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_crop" in k])
-        # Take mean and median of crop augs
-        tmp_df = pd.DataFrame({
-            "p0": p[:, 0], "p1": p[:, 1], "p2": p[:, 2], 
-            "t0": t[:, 0], "t1": t[:, 1], "t2": t[:, 2],  
-            "wts": wts, 
-            "unique_id": ids
-        })
-        df_by_mean = tmp_df.groupby("unique_id").mean() 
-        df_by_median = tmp_df.groupby("unique_id").median()
-        metrics_dict["loss_mean"] = skm.log_loss(y_true=df_by_mean[["t0", "t1", "t2"]].values, 
-                                                 y_pred=df_by_mean[["p0", "p1", "p2"]].values, 
-                                                 sample_weight=df_by_mean.wts.values)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_meanagg{c}"] = _roc_auc_score(t=df_by_mean[f"t{c}"].values, p=df_by_mean[f"p{c}"].values)
-        metrics_dict["auc_meanagg_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_meanagg" in k])
-        metrics_dict["loss_median"] = skm.log_loss(y_true=df_by_median[["t0", "t1", "t2"]].values, 
-                                                   y_pred=df_by_median[["p0", "p1", "p2"]].values, 
-                                                   sample_weight=df_by_median.wts.values)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_medianagg{c}"] = _roc_auc_score(t=df_by_median[f"t{c}"].values, p=df_by_median[f"p{c}"].values)
-        metrics_dict["auc_medianagg_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_medianagg" in k])
+        metrics_dict.update(_multiaug_metrics(p, t, ids))
         return metrics_dict
 
 
-class CompetitionMetricPlusAUROCMultiAugSigmoidPseudo(tm.Metric):
-
-    def __init__(self, cfg, dist_sync_on_step=False):
-        super().__init__(dist_sync_on_step=dist_sync_on_step)
-
-        self.add_state("p", default=[], dist_reduce_fx=None)
-        self.add_state("t", default=[], dist_reduce_fx=None)
-        self.add_state("unique_id", default=[], dist_reduce_fx=None)
-
-    def update(self, p, t, unique_id):
-        self.p.append(p)
-        self.t.append(t)
-        self.unique_id.append(unique_id)
+class CompetitionMetricPlusAUROCMultiAugSigmoidPseudo(_MultiAugMetric):
 
     def compute(self):
-        p = torch.cat(self.p).sigmoid().cpu().float().numpy()
-        t = torch.cat(self.t).cpu().numpy()[:, :3]
-        wts = np.ones((len(p), ))
-        wts[t[:, 1] == 1] = 2
-        wts[t[:, 2] == 1] = 4
-        metrics_dict = {}
-        metrics_dict["loss_crop"] = skm.log_loss(y_true=t, y_pred=p, sample_weight=wts)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_crop{c}"] = _roc_auc_score(t=t[:, c], p=p[:, c])
-        metrics_dict["auc_crop_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_crop" in k])
-        # Take mean and median of crop augs
-        tmp_df = pd.DataFrame({
-            "p0": p[:, 0], "p1": p[:, 1], "p2": p[:, 2], 
-            "t0": t[:, 0], "t1": t[:, 1], "t2": t[:, 2],  
-            "wts": wts, 
-            "unique_id": torch.cat(self.unique_id).cpu().numpy()
-        })
-        df_by_mean = tmp_df.groupby("unique_id").mean() 
-        df_by_median = tmp_df.groupby("unique_id").median()
-        metrics_dict["loss_mean"] = skm.log_loss(y_true=df_by_mean[["t0", "t1", "t2"]].values, 
-                                                 y_pred=df_by_mean[["p0", "p1", "p2"]].values, 
-                                                 sample_weight=df_by_mean.wts.values)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_meanagg{c}"] = _roc_auc_score(t=df_by_mean[f"t{c}"].values, p=df_by_mean[f"p{c}"].values)
-        metrics_dict["auc_meanagg_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_meanagg" in k])
-        metrics_dict["loss_median"] = skm.log_loss(y_true=df_by_median[["t0", "t1", "t2"]].values, 
-                                                   y_pred=df_by_median[["p0", "p1", "p2"]].values, 
-                                                   sample_weight=df_by_median.wts.values)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_medianagg{c}"] = _roc_auc_score(t=df_by_median[f"t{c}"].values, p=df_by_median[f"p{c}"].values)
-        metrics_dict["auc_medianagg_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_medianagg" in k])
-        return metrics_dict
+        p = self.p.sigmoid().cpu().float().numpy()
+        t = self.t.cpu().numpy()[:, :3]
+        return _multiaug_metrics(p, t, self.unique_id.cpu().numpy())
 
 
-class CompetitionMetricPlusAUROCMultiAugSigmoidSubarticularBilat(tm.Metric):
-
-    def __init__(self, cfg, dist_sync_on_step=False):
-        super().__init__(dist_sync_on_step=dist_sync_on_step)
-
-        self.add_state("p", default=[], dist_reduce_fx=None)
-        self.add_state("t", default=[], dist_reduce_fx=None)
-        self.add_state("unique_id", default=[], dist_reduce_fx=None)
-
-    def update(self, p, t, unique_id):
-        self.p.append(p)
-        self.t.append(t)
-        self.unique_id.append(unique_id)
+class CompetitionMetricPlusAUROCMultiAugSigmoidSubarticularBilat(_MultiAugMetric):
 
     def compute(self):
-        p = torch.cat(self.p)
+        p = self.p
         p = F.softmax(torch.cat([p[:, :3], p[:, 3:]], dim=0), dim=1).cpu().float().numpy()
-        t = torch.cat(self.t)
+        t = self.t
         t = torch.cat([t[:, :3], t[:, 3:]], dim=0).cpu().numpy()
-        wts = np.ones((len(p), ))
-        wts[t[:, 1] == 1] = 2
-        wts[t[:, 2] == 1] = 4
-        metrics_dict = {}
-        metrics_dict["loss_crop"] = skm.log_loss(y_true=t, y_pred=p, sample_weight=wts)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_crop{c}"] = _roc_auc_score(t=t[:, c], p=p[:, c])
-        metrics_dict["auc_crop_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_crop" in k])
-        unique_id = torch.cat(self.unique_id)
+        unique_id = self.unique_id
         unique_id = torch.cat([unique_id, unique_id + 1000000]).cpu().numpy()
-        # Take mean and median of crop augs
-        tmp_df = pd.DataFrame({
-            "p0": p[:, 0], "p1": p[:, 1], "p2": p[:, 2], 
-            "t0": t[:, 0], "t1": t[:, 1], "t2": t[:, 2],  
-            "wts": wts, 
-            "unique_id": unique_id
-        })
-        df_by_mean = tmp_df.groupby("unique_id").mean() 
-        df_by_median = tmp_df.groupby("unique_id").median()
-        metrics_dict["loss_mean"] = skm.log_loss(y_true=df_by_mean[["t0", "t1", "t2"]].values, 
-                                                 y_pred=df_by_mean[["p0", "p1", "p2"]].values, 
-                                                 sample_weight=df_by_mean.wts.values)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_meanagg{c}"] = _roc_auc_score(t=df_by_mean[f"t{c}"].values, p=df_by_mean[f"p{c}"].values)
-        metrics_dict["auc_meanagg_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_meanagg" in k])
-        metrics_dict["loss_median"] = skm.log_loss(y_true=df_by_median[["t0", "t1", "t2"]].values, 
-                                                   y_pred=df_by_median[["p0", "p1", "p2"]].values, 
-                                                   sample_weight=df_by_median.wts.values)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_medianagg{c}"] = _roc_auc_score(t=df_by_median[f"t{c}"].values, p=df_by_median[f"p{c}"].values)
-        metrics_dict["auc_medianagg_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_medianagg" in k])
-        return metrics_dict
-
-
-class CompetitionMetricPlusAUROCMultiAugSigmoidSpinalSubarticular(tm.Metric):
+        return _multiaug_metrics(p, t, unique_id)
 
-    def __init__(self, cfg, dist_sync_on_step=False):
-        super().__init__(dist_sync_on_step=dist_sync_on_step)
 
-        self.add_state("p", default=[], dist_reduce_fx=None)
-        self.add_state("t", default=[], dist_reduce_fx=None)
-        self.add_state("unique_id", default=[], dist_reduce_fx=None)
-
-    def update(self, p, t, unique_id):
-        self.p.append(p)
-        self.t.append(t)
-        self.unique_id.append(unique_id)
+class CompetitionMetricPlusAUROCMultiAugSigmoidSpinalSubarticular(_MultiAugMetric):
 
     def compute_subarticular(self):
-        p = torch.cat(self.p)[:, :6]
-        t = torch.cat(self.t)[:, :6]
+        p = self.p[:, :6]
+        t = self.t[:, :6]
         p = torch.cat([p[:, :3], p[:, 3:]], dim=0).sigmoid().cpu().float().numpy()
         t = torch.cat([t[:, :3], t[:, 3:]], dim=0).cpu().numpy()
-        wts = np.ones((len(p), ))
-        wts[t[:, 1] == 1] = 2
-        wts[t[:, 2] == 1] = 4
-        metrics_dict = {}
-        metrics_dict["loss_crop"] = skm.log_loss(y_true=t, y_pred=p, sample_weight=wts)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_crop{c}"] = _roc_auc_score(t=t[:, c], p=p[:, c])
-        metrics_dict["auc_crop_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_crop" in k])
-        unique_id = torch.cat(self.unique_id)
+        unique_id = self.unique_id
         unique_id = torch.cat([unique_id, unique_id + 1000000]).cpu().numpy()
-        # Take mean and median of crop augs
-        tmp_df = pd.DataFrame({
-            "p0": p[:, 0], "p1": p[:, 1], "p2": p[:, 2], 
-            "t0": t[:, 0], "t1": t[:, 1], "t2": t[:, 2],  
-            "wts": wts, 
-            "unique_id": unique_id
-        })
-        df_by_mean = tmp_df.groupby("unique_id").mean() 
-        df_by_median = tmp_df.groupby("unique_id").median()
-        metrics_dict["loss_mean"] = skm.log_loss(y_true=df_by_mean[["t0", "t1", "t2"]].values, 
-                                                 y_pred=df_by_mean[["p0", "p1", "p2"]].values, 
-                                                 sample_weight=df_by_mean.wts.values)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_meanagg{c}"] = _roc_auc_score(t=df_by_mean[f"t{c}"].values, p=df_by_mean[f"p{c}"].values)
-        metrics_dict["auc_meanagg_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_meanagg" in k])
-        metrics_dict["loss_median"] = skm.log_loss(y_true=df_by_median[["t0", "t1", "t2"]].values, 
-                                                   y_pred=df_by_median[["p0", "p1", "p2"]].values, 
-                                                   sample_weight=df_by_median.wts.values)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_medianagg{c}"] = _roc_auc_score(t=df_by_median[f"t{c}"].values, p=df_by_median[f"p{c}"].values)
-        metrics_dict["auc_medianagg_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_medianagg" in k])
+        metrics_dict = _multiaug_metrics(p, t, unique_id)
         return {f"{k}_subart": v for k, v in metrics_dict.items()}
 
     def compute_spinal(self):
-        p = torch.cat(self.p)[:, 6:].sigmoid().cpu().float().numpy()
-        t = torch.cat(self.t)[:, 6:].cpu().numpy()
-        wts = np.ones((len(p), ))
-        wts[t[:, 1] == 1] = 2
-        wts[t[:, 2] == 1] = 4
-        metrics_dict = {}
-        metrics_dict["loss_crop"] = skm.log_loss(y_true=t, y_pred=p, sample_weight=wts)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_crop{c}"] = _roc_auc_score(t=t[:, c], p=p[:, c])
-        metrics_dict["auc_crop_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_crop" in k])
-        # Take mean and median of crop augs
-        tmp_df = pd.DataFrame({
-            "p0": p[:, 0], "p1": p[:, 1], "p2": p[:, 2], 
-            "t0": t[:, 0], "t1": t[:, 1], "t2": t[:, 2],  
-            "wts": wts, 
-            "unique_id": torch.cat(self.unique_id).cpu().numpy()
-        })
-        df_by_mean = tmp_df.groupby("unique_id").mean() 
-        df_by_median = tmp_df.groupby("unique_id").median()
-        metrics_dict["loss_mean"] = skm.log_loss(y_true=df_by_mean[["t0", "t1", "t2"]].values, 
-                                                 y_pred=df_by_mean[["p0", "p1", "p2"]].values, 
-                                                 sample_weight=df_by_mean.wts.values)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_meanagg{c}"] = _roc_auc_score(t=df_by_mean[f"t{c}"].values, p=df_by_mean[f"p{c}"].values)
-        metrics_dict["auc_meanagg_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_meanagg" in k])
-        metrics_dict["loss_median"] = skm.log_loss(y_true=df_by_median[["t0", "t1", "t2"]].values, 
-                                                   y_pred=df_by_median[["p0", "p1", "p2"]].values, 
-                                                   sample_weight=df_by_median.wts.values)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_medianagg{c}"] = _roc_auc_score(t=df_by_median[f"t{c}"].values, p=df_by_median[f"p{c}"].values)
-        metrics_dict["auc_medianagg_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_medianagg" in k])
+        p = self.p[:, 6:].sigmoid().cpu().float().numpy()
+        t = self.t[:, 6:].cpu().numpy()
+        metrics_dict = _multiaug_metrics(p, t, self.unique_id.cpu().numpy())
         return {f"{k}_spinal": v for k, v in metrics_dict.items()}
 
     def compute(self):
@@ -845,56 +586,16 @@ class CompetitionMetricPlusAUROCMultiAugSigmoidSpinalSubarticular(tm.Metric):
         return subart_metrics
 
 
-class CompetitionMetricPlusAUROCMultiAugSigmoidAll(tm.Metric):
-
-    def __init__(self, cfg, dist_sync_on_step=False):
-        super().__init__(dist_sync_on_step=dist_sync_on_step)
-
-        self.add_state("p", default=[], dist_reduce_fx=None)
-        self.add_state("t", default=[], dist_reduce_fx=None)
-        self.add_state("unique_id", default=[], dist_reduce_fx=None)
-
-    def update(self, p, t, unique_id):
-        self.p.append(p)
-        self.t.append(t)
-        self.unique_id.append(unique_id)
+class CompetitionMetricPlusAUROCMultiAugSigmoidAll(_MultiAugMetric):
 
     def compute_one(self, p, t, unique_id, suffix):
-        wts = np.ones((len(p), ))
-        wts[t[:, 1] == 1] = 2
-        wts[t[:, 2] == 1] = 4
-        metrics_dict = {}
-        metrics_dict["loss_crop"] = skm.log_loss(y_true=t, y_pred=p, sample_weight=wts)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_crop{c}"] = _roc_auc_score(t=t[:, c], p=p[:, c])
-        metrics_dict["auc_crop_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_crop" in k])
-        # Take mean and median of crop augs
-        tmp_df = pd.DataFrame({
-            "p0": p[:, 0], "p1": p[:, 1], "p2": p[:, 2], 
-            "t0": t[:, 0], "t1": t[:, 1], "t2": t[:, 2],  
-            "wts": wts, 
-            "unique_id": unique_id
-        })
-        df_by_mean = tmp_df.groupby("unique_id").mean() 
-        df_by_median = tmp_df.groupby("unique_id").median()
-        metrics_dict["loss_mean"] = skm.log_loss(y_true=df_by_mean[["t0", "t1", "t2"]].values, 
-                                                 y_pred=df_by_mean[["p0", "p1", "p2"]].values, 
-                                                 sample_weight=df_by_mean.wts.values)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_meanagg{c}"] = _roc_auc_score(t=df_by_mean[f"t{c}"].values, p=df_by_mean[f"p{c}"].values)
-        metrics_dict["auc_meanagg_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_meanagg" in k])
-        metrics_dict["loss_median"] = skm.log_loss(y_true=df_by_median[["t0", "t1", "t2"]].values, 
-                                                   y_pred=df_by_median[["p0", "p1", "p2"]].values, 
-                                                   sample_weight=df_by_median.wts.values)
-        for c in range(p.shape[1]):
-            metrics_dict[f"auc_medianagg{c}"] = _roc_auc_score(t=df_by_median[f"t{c}"].values, p=df_by_median[f"p{c}"].values)
-        metrics_dict["auc_medianagg_mean"] = np.mean([v for k, v in metrics_dict.items() if "auc_medianagg" in k])
+        metrics_dict = _multiaug_metrics(p, t, unique_id)
         return {f"{k}_{suffix}": v for k, v in metrics_dict.items()}
 
     def compute(self):
-        p = torch.cat(self.p, dim=0).sigmoid().cpu().numpy()
-        t = torch.cat(self.t, dim=0).cpu().numpy()
-        unique_id = torch.cat(self.unique_id).cpu().numpy()
+        p = self.p.sigmoid().cpu().numpy()
+        t = self.t.cpu().numpy()
+        unique_id = self.unique_id.cpu().numpy()
         try:
             foramen_metrics = self.compute_one(p=p[unique_id < 100000, :3], t=t[unique_id < 100000, :3], unique_id=unique_id[unique_id < 100000], suffix="foramen")
             spinal_metrics = self.compute_one(p=p[((unique_id >= 100000) & (unique_id < 200000)), 3:6], 
@@ -914,8 +615,8 @@ class CompetitionMetricPlusAUROCMultiAugSigmoidAll(tm.Metric):
 class CompetitionMetricPlusAUROCWholeSpinal(_BaseMetric):
 
     def compute(self):
-        p = torch.cat(self.p, dim=0)[:, :15]
-        t = torch.cat(self.t, dim=0)[:, :15]
+        p = self.p[:, :15]
+        t = self.t[:, :15]
         p = torch.cat([p[:, i:i+3] for i in range(0, 15, 3)], dim=0)
         t = torch.cat([t[:, i:i+3] for i in range(0, 15, 3)], dim=0)
         p = p.sigmoid().cpu().numpy()
@@ -931,37 +632,22 @@ class CompetitionMetricPlusAUROCWholeSpinal(_BaseMetric):
         return metrics_dict
 
 
-class SubarticularLevelsAndCoords(tm.Metric):
-    
-    def __init__(self, cfg, dist_sync_on_step=False):
-        super().__init__(dist_sync_on_step=dist_sync_on_step)
-        
-        self.cfg = cfg 
-
-        self.add_state("p_coords", default=[], dist_reduce_fx=None)
-        self.add_state("p_levels", default=[], dist_reduce_fx=None)
-        self.add_state("t_coords", default=[], dist_reduce_fx=None)
-        self.add_state("t_levels", default=[], dist_reduce_fx=None)
-        self.add_state("included_levels", default=[], dist_reduce_fx=None)
+class SubarticularLevelsAndCoords(StreamingMetric):
 
-    def update(self, p_coords, p_levels, t_coords, t_levels, included_levels):
-        self.p_coords.append(p_coords)
-        self.p_levels.append(p_levels)
-        self.t_coords.append(t_coords)
-        self.t_levels.append(t_levels)
-        self.included_levels.append(included_levels)
+    fields = ("p_coords", "p_levels", "t_coords", "t_levels", "included_levels")
 
     def compute(self):
-        p_levels = torch.cat(self.p_levels, dim=0).cpu().numpy()
-        t_levels = torch.cat(self.t_levels, dim=0).cpu().numpy()
+        gathered = self.gather()
+        p_levels = gathered["p_levels"].cpu().numpy()
+        t_levels = gathered["t_levels"].cpu().numpy()
         metrics_dict = {}
         for c in range(p_levels.shape[1]):
             metrics_dict[f"auc{c}"] = _roc_auc_score(t=t_levels[:, c], p=p_levels[:, c])
         metrics_dict["auc_mean"] = np.mean([v for v in metrics_dict.values()])
-        p_coords = torch.cat(self.p_coords, dim=0).sigmoid().cpu().numpy()
-        t_coords = torch.cat(self.t_coords, dim=0).cpu().numpy()
+        p_coords = gathered["p_coords"].sigmoid().cpu().numpy()
+        t_coords = gathered["t_coords"].cpu().numpy()
         coords_loss = np.abs(p_coords - t_coords)
-        included_levels = torch.cat(self.included_levels, dim=0).cpu().numpy()
+        included_levels = gathered["included_levels"].cpu().numpy()
         coords_mean_loss = []
         for b_idx, inc in enumerate(included_levels):
             tmp_indices = np.where(inc)[0]
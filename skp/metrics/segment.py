@@ -0,0 +1,58 @@
+"""
+Segment reductions over groups of rows, e.g. aggregating the predictions of
+all crop augs of each `unique_id` during validation.
+
+Replaces `pd.DataFrame(x).groupby(ids).mean()` / `.median()` / `.max()` with a
+single sort of the ids followed by segment ops in torch, on whichever device
+`x` is on.
+"""
+import torch
+
+
+REDUCTIONS = ("mean", "median", "max")
+
+
+def segment_reduce(x, segment_ids, reductions=("mean", "median")):
+    """
+    Reduces the rows of `x` (N, C) or (N, ) over each unique value of
+    `segment_ids` (N, ).
+
+    Returns the sorted unique ids (G, ) and a dict mapping each reduction in
+    `reductions` to a tensor of shape (G, C) or (G, ), in the same order as the
+    ids. As in pandas, the median of a group with an even number of rows is the
+    mean of the two middle values.
+
+    Accepts numpy arrays or tensors, float inputs are computed in float64 to
+    match pandas.
+    """
+    for r in reductions:
+        assert r in REDUCTIONS, f"`{r}` is not one of {REDUCTIONS}"
+    x = torch.as_tensor(x)
+    if x.is_floating_point():
+        x = x.double()
+    squeeze = x.ndim == 1
+    if squeeze:
+        x = x.unsqueeze(1)
+    segment_ids = torch.as_tensor(segment_ids, device=x.device).reshape(-1)
+    assert len(segment_ids) == len(x), f"got {len(segment_ids)} ids for {len(x)} rows"
+    ids, inverse, counts = torch.unique(segment_ids, return_inverse=True, return_counts=True)
+    num_segments, num_cols = len(ids), x.shape[1]
+    out = {}
+    if "mean" in reductions:
+        sums = x.new_zeros((num_segments, num_cols)).index_add_(0, inverse, x)
+        out["mean"] = sums / counts.unsqueeze(1).to(sums.dtype)
+    if "max" in reductions:
+        index = inverse.unsqueeze(1).expand(-1, num_cols)
+        out["max"] = x.new_zeros((num_segments, num_cols)).scatter_reduce_(0, index, x, reduce="amax", include_self=False)
+    if "median" in reductions:
+        # sort each column by value, then stably by segment, so that values
+        # are in order within each (now contiguous) segment
+        values, order = x.sort(dim=0, stable=True)
+        _, segment_order = inverse[order].sort(dim=0, stable=True)
+        values = values.gather(0, segment_order)
+        starts = torch.cumsum(counts, dim=0) - counts
+        lo, hi = starts + (counts - 1) // 2, starts + counts // 2
+        out["median"] = (values[lo] + values[hi]) / 2
+    if squeeze:
+        out = {k: v[:, 0] for k, v in out.items()}
+    return ids, {k: out[k] for k in reductions}
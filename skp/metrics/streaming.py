@@ -0,0 +1,128 @@
+"""
+Streaming accumulation for validation metrics.
+
+Instead of appending every batch to a Python list of tensors (torchmetrics list
+states), which are concatenated, synced element by element under DDP and moved
+to CPU on `compute()`, each field is written into a preallocated buffer on the
+device of the incoming tensors. Buffers grow geometrically and keep their
+allocation across epochs, so after the first epoch no further allocation happens.
+
+On `compute()`, all fields are packed into a single tensor and gathered across
+ranks with one `all_gather` (plus one for the number of rows per rank).
+"""
+import torch
+import torch.distributed as dist
+import torchmetrics as tm
+
+
+class GrowableBuffer:
+
+    def __init__(self, initial_capacity=4096, growth_factor=2):
+        self.initial_capacity = initial_capacity
+        self.growth_factor = growth_factor
+        self.data = None
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def allocate(self, capacity, like):
+        return torch.empty((capacity, *like.shape[1:]), dtype=like.dtype, device=like.device)
+
+    def append(self, x):
+        x = x.detach()
+        if x.ndim == 0:
+            x = x.unsqueeze(0)
+        n = len(x)
+        if self.data is None or self.data.device != x.device or self.data.shape[1:] != x.shape[1:]:
+            assert self.length == 0, f"cannot append {tuple(x.shape)} to buffer of {tuple(self.data.shape)}"
+            self.data = self.allocate(max(self.initial_capacity, n), x)
+        elif self.length + n > len(self.data):
+            capacity = max(int(len(self.data) * self.growth_factor), self.length + n)
+            data = self.allocate(capacity, self.data)
+            data[:self.length] = self.data[:self.length]
+            self.data = data
+        # casts to the dtype of the buffer, which is set by the first append
+        self.data[self.length:self.length + n] = x
+        self.length += n
+
+    def tensor(self):
+        if self.data is None:
+            return None
+        return self.data[:self.length]
+
+    def reset(self):
+        # keep the allocation for the next epoch
+        self.length = 0
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+
+def all_gather_rows(x):
+    """
+    Concatenates `x` (N, ...) from all ranks along dim 0, where N may differ
+    between ranks. Rows are padded to the largest N so that a single
+    `all_gather` of the data is needed.
+    """
+    if not is_distributed():
+        return x
+    world_size = dist.get_world_size()
+    length = torch.tensor([len(x)], device=x.device)
+    lengths = [torch.zeros_like(length) for _ in range(world_size)]
+    dist.all_gather(lengths, length)
+    lengths = [int(_) for _ in lengths]
+    max_length = max(lengths)
+    padded = x.new_zeros((max_length, *x.shape[1:]))
+    padded[:len(x)] = x
+    gathered = [torch.zeros_like(padded) for _ in range(world_size)]
+    dist.all_gather(gathered, padded)
+    return torch.cat([g[:l] for g, l in zip(gathered, lengths)])
+
+
+class StreamingMetric(tm.Metric):
+    """
+    Base class for metrics which accumulate one row per sample for each name in
+    `fields` (in the order passed to `update`). All fields must have the same
+    number of rows. `gather()` returns a dict of the accumulated tensors from all
+    ranks, which is cached until the next `update` or `reset`.
+    """
+    fields = ("p", "t")
+
+    def __init__(self, cfg=None, dist_sync_on_step=False):
+        super().__init__(dist_sync_on_step=dist_sync_on_step)
+
+        self.cfg = cfg
+        self._streams = {k: GrowableBuffer() for k in self.fields}
+        self._gathered = None
+
+    def update(self, *args):
+        assert len(args) == len(self.fields), f"expected {self.fields}, got {len(args)} arguments"
+        for k, v in zip(self.fields, args):
+            self._streams[k].append(v)
+        self._gathered = None
+
+    def reset(self):
+        super().reset()
+        for stream in self._streams.values():
+            stream.reset()
+        self._gathered = None
+
+    def gather(self):
+        if self._gathered is not None:
+            return self._gathered
+        tensors = {k: stream.tensor() for k, stream in self._streams.items()}
+        if is_distributed():
+            # pack all fields into one (N, D) float64 tensor for a single all_gather
+            # float64 is exact for integer ids up to 2 ** 53
+            flat = [tensors[k].reshape(len(tensors[k]), -1) for k in self.fields]
+            packed = all_gather_rows(torch.cat([f.double() for f in flat], dim=1))
+            sizes = [f.shape[1] for f in flat]
+            tensors = {
+                k: v.to(tensors[k].dtype).reshape(-1, *tensors[k].shape[1:])
+                for k, v in zip(self.fields, packed.split(sizes, dim=1))
+            }
+        self._gathered = tensors
+        return tensors
+
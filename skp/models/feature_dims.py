@@ -0,0 +1,78 @@
+"""
+Feature dimensions of backbones, without a dummy forward pass.
+
+Nets need the number of output channels of the backbone (or, for encoders, of
+each feature level) to build their heads. Previously this was found by running
+the backbone on a random input at full resolution in `__init__`. That is slow
+for 3D backbones and adds up when building many fold models for inference.
+
+In order of preference:
+    1. timm metadata: `feature_info.channels()` for `features_only` models,
+       otherwise `head_hidden_size` or `num_features`
+    2. a forward pass on the meta device, which only propagates shapes
+    3. a forward pass with a batch size of 1 in eval mode without gradients,
+       for backbones with ops that do not support the meta device
+"""
+import itertools
+import torch
+
+from torch.func import functional_call
+
+
+def _meta_forward(module, input_shape):
+    tensors = {
+        k: torch.empty_like(v, device="meta")
+        for k, v in itertools.chain(module.named_parameters(), module.named_buffers())
+    }
+    with torch.no_grad():
+        return functional_call(module, tensors, (torch.empty(input_shape, device="meta"), ))
+
+
+def _eval_forward(module, input_shape):
+    training = module.training
+    module.eval()
+    try:
+        with torch.no_grad():
+            return module(torch.zeros((1, *input_shape[1:])))
+    finally:
+        module.train(training)
+
+
+def forward_shapes(module, input_shape):
+    # output of module as a shape or list of shapes
+    try:
+        out = _meta_forward(module, input_shape)
+    except Exception:
+        out = _eval_forward(module, input_shape)
+    if isinstance(out, (list, tuple)):
+        return [o.shape for o in out]
+    return out.shape
+
+
+def is_timm_features(backbone):
+    # timm models created with features_only=True
+    return hasattr(getattr(backbone, "feature_info", None), "channels")
+
+
+def get_num_features(backbone, input_shape, dim=1):
+    """
+    Returns the size of `dim` of the output of `backbone` for an input of
+    `input_shape`, which is the number of features for timm backbones with
+    `num_classes=0`.
+    """
+    if is_timm_features(backbone):
+        return backbone.feature_info.channels()[-1]
+    num_features = getattr(backbone, "head_hidden_size", None) or getattr(backbone, "num_features", None)
+    if isinstance(num_features, int):
+        return num_features
+    return forward_shapes(backbone, input_shape)[dim]
+
+
+def get_feature_channels(encoder, input_shape):
+    """
+    Returns list of the number of channels of each feature level output by
+    `encoder` (e.g., timm `features_only` models).
+    """
+    if is_timm_features(encoder):
+        return list(encoder.feature_info.channels())
+    return [shape[1] for shape in forward_shapes(encoder, input_shape)]
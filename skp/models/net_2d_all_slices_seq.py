@@ -6,6 +6,8 @@ import torch.nn.functional as F
 
 from timm import create_model
 from timm.models.layers import SelectAdaptivePool2d
+from .feature_dims import get_num_features
+from .normalization import Normalization
 
 
 class GeM(nn.Module):
@@ -26,6 +28,7 @@ class Net(nn.Module):
     def __init__(self, cfg):
         super().__init__()
         self.cfg = cfg
+        self.normalize = Normalization(self.cfg.normalization, self.cfg.normalization_params)
         backbone_args = {
             "pretrained": self.cfg.pretrained,
             "num_classes": 0,
@@ -40,7 +43,7 @@ class Net(nn.Module):
                 backbone_args["img_size"] = (self.cfg.image_height, self.cfg.image_width) 
         self.backbone = create_model(self.cfg.backbone, 
             **backbone_args)
-        self.dim_feats = self.backbone(torch.randn((2, self.cfg.num_input_channels, self.cfg.image_height, self.cfg.image_width))).size(1)
+        self.dim_feats = get_num_features(self.backbone, (2, self.cfg.num_input_channels, self.cfg.image_height, self.cfg.image_width), dim=1)
         self.dim_feats = self.dim_feats * (2 if self.cfg.pool == "catavgmax" else 1)
         self.pooling = self.get_pool_layer()
 
@@ -87,31 +90,6 @@ class Net(nn.Module):
             if isinstance(module, nn.SiLU):
                 module.inplace = False
 
-    def normalize(self, x):
-        if self.cfg.normalization == "-1_1":
-            mini, maxi = self.cfg.normalization_params["min"], self.cfg.normalization_params["max"]
-            x = x - mini
-            x = x / (maxi - mini) 
-            x = x - 0.5 
-            x = x * 2.0
-        elif self.cfg.normalization == "0_1":
-            mini, maxi = self.cfg.normalization_params["min"], self.cfg.normalization_params["max"]
-            x = x - mini
-            x = x / (maxi - mini) 
-        elif self.cfg.normalization == "mean_sd":
-            mean, sd = self.cfg.normalization_params["mean"], self.cfg.normalization_params["sd"]
-            x = (x - mean) / sd
-        elif self.cfg.normalization == "per_channel_mean_sd":
-            mean, sd = self.cfg.normalization_params["mean"], self.cfg.normalization_params["sd"]
-            assert len(mean) == len(sd) == x.size(1)
-            mean, sd = torch.tensor(mean).unsqueeze(0), torch.tensor(sd).unsqueeze(0)
-            for i in range(x.ndim - 2):
-                mean, sd = mean.unsqueeze(-1), sd.unsqueeze(-1)
-            x = (x - mean) / sd
-        elif self.cfg.normalization == "none": 
-            x = x
-        return x 
-
     def forward(self, batch, return_loss=False, return_features=False):
         x = batch["x"]
         y = batch["y"] if "y" in batch else None
@@ -147,7 +125,7 @@ class Net(nn.Module):
         logits = logits.reshape(B*Z, -1)
         if isinstance(y, torch.Tensor):
             y = y.reshape(B*Z, -1)
-        assert logits.shape == y.shape
+            assert logits.shape == y.shape
 
         out = {"logits": logits, "mask": mask}
 
@@ -0,0 +1,67 @@
+import torch
+import torch.nn as nn
+
+
+def get_scale_shift(normalization, params):
+    """
+    Returns (scale, shift) such that `x * scale + shift` is equal to
+    `normalization` ("-1_1", "0_1", "mean_sd" or "per_channel_mean_sd").
+    For per-channel normalization, scale and shift are lists with one value
+    per channel. For any other value (e.g., "none"), returns (None, None), i.e.,
+    the identity.
+    """
+    if normalization == "-1_1":
+        mini, maxi = params["min"], params["max"]
+        # ((x - mini) / (maxi - mini) - 0.5) * 2
+        return 2.0 / (maxi - mini), -2.0 * mini / (maxi - mini) - 1.0
+    if normalization == "0_1":
+        mini, maxi = params["min"], params["max"]
+        return 1.0 / (maxi - mini), -mini / (maxi - mini)
+    if normalization == "mean_sd":
+        mean, sd = params["mean"], params["sd"]
+        return 1.0 / sd, -mean / sd
+    if normalization == "per_channel_mean_sd":
+        mean, sd = params["mean"], params["sd"]
+        assert len(mean) == len(sd)
+        return [1.0 / s for s in sd], [-m / s for m, s in zip(mean, sd)]
+    return None, None
+
+
+class Normalization(nn.Module):
+    """
+    Input normalization as a single `x * scale + shift`, with scale and shift
+    precomputed once and kept in buffers. The buffers move with the model, so
+    a forward pass allocates nothing apart from the output and never copies
+    from the host. Per-channel values are applied along dim 1.
+
+    Integer inputs (e.g., uint8) are cast to float32 first. The cast output
+    is then normalized in place.
+
+    Buffers are not persistent, so existing checkpoints load unchanged.
+    """
+    def __init__(self, normalization, normalization_params=None):
+        super().__init__()
+        self.normalization = normalization
+        scale, shift = get_scale_shift(normalization, normalization_params)
+        self.identity = scale is None
+        if self.identity:
+            scale, shift = 1.0, 0.0
+        self.register_buffer("scale", torch.tensor(scale, dtype=torch.float32), persistent=False)
+        self.register_buffer("shift", torch.tensor(shift, dtype=torch.float32), persistent=False)
+
+    def forward(self, x):
+        if self.identity:
+            return x if x.is_floating_point() else x.float()
+        scale, shift = self.scale, self.shift
+        if scale.ndim == 1:
+            scale = scale.view(1, -1, *([1] * (x.ndim - 2)))
+            shift = shift.view(1, -1, *([1] * (x.ndim - 2)))
+        if not x.is_floating_point():
+            out = x.float()
+            return torch.addcmul(shift, out, scale, out=out)
+        if x.dtype != scale.dtype:
+            scale, shift = scale.to(x.dtype), shift.to(x.dtype)
+        return torch.addcmul(shift, x, scale)
+
+    def extra_repr(self):
+        return f"normalization={self.normalization}"
@@ -3,8 +3,11 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from configs.base import replace
 from timm import create_model
 from timm.models.layers import SelectAdaptivePool2d
+from .feature_dims import get_feature_channels
+from .normalization import Normalization
 
 
 class Conv2dReLU(nn.Sequential):
@@ -226,6 +229,7 @@ class Net(nn.Module):
     def __init__(self, cfg):
         super().__init__()
         self.cfg = cfg
+        self.normalize = Normalization(self.cfg.normalization, self.cfg.normalization_params)
 
         self.encoder = create_model(self.cfg.backbone,
             pretrained=self.cfg.pretrained,
@@ -234,10 +238,8 @@ class Net(nn.Module):
             features_only=True,
             in_chans=self.cfg.num_input_channels)
         # self.change_num_input_channels() - use timm 
-        with torch.no_grad():
-            out = self.encoder(torch.randn((1, self.cfg.num_input_channels, self.cfg.image_height, self.cfg.image_width)))
-            self.cfg.encoder_channels = [self.cfg.num_input_channels] + [o.shape[1] for o in out]
-            del out
+        encoder_channels = get_feature_channels(self.encoder, (1, self.cfg.num_input_channels, self.cfg.image_height, self.cfg.image_width))
+        self.cfg = replace(self.cfg, encoder_channels=[self.cfg.num_input_channels] + encoder_channels)
 
         self.decoder = UnetDecoder(self.cfg)
         self.segmentation_head = SegmentationHead(self.cfg.decoder_channels[-1], self.cfg.num_classes, 
@@ -282,29 +284,6 @@ class Net(nn.Module):
             self.encoder.load_state_dict(encoder_weights)
             self.decoder.load_state_dict(decoder_weights)
 
-    def normalize(self, x):
-        if self.cfg.normalization == "-1_1":
-            mini, maxi = self.cfg.normalization_params["min"], self.cfg.normalization_params["max"]
-            x = x - mini
-            x = x / (maxi - mini) 
-            x = x - 0.5 
-            x = x * 2.0
-        elif self.cfg.normalization == "0_1":
-            mini, maxi = self.cfg.normalization_params["min"], self.cfg.normalization_params["max"]
-            x = x - mini
-            x = x / (maxi - mini) 
-        elif self.cfg.normalization == "mean_sd":
-            mean, sd = self.cfg.normalization_params["mean"], self.cfg.normalization_params["sd"]
-            x = (x - mean) / sd
-        elif self.cfg.normalization == "per_channel_mean_sd":
-            mean, sd = self.cfg.normalization_params["mean"], self.cfg.normalization_params["sd"]
-            assert len(mean) == len(sd) == x.size(1)
-            mean, sd = torch.tensor(mean).unsqueeze(0), torch.tensor(sd).unsqueeze(0)
-            for i in range(x.ndim - 2):
-                mean, sd = mean.unsqueeze(-1), sd.unsqueeze(-1)
-            x = (x - mean) / sd
-        return x 
-
     def forward(self, batch, return_loss=False, return_features=False, cls_only=False):
         x = batch["x"]
         y = batch["y"] if "y" in batch else None
@@ -0,0 +1,189 @@
+"""
+Post-training int8 quantization of Nets for CPU inference.
+
+    dynamic: weights of `nn.Linear` layers (heads, and the feed-forward and
+             output projections of transformers) are int8, activations are
+             quantized on the fly. No calibration data needed.
+    static:  the conv backbone (`net.backbone`) is quantized with FX graph
+             mode, with activation ranges calibrated on batches of the
+             validation Dataset. Remaining Linear layers are quantized
+             dynamically.
+
+Quantized models only run on CPU. Whether accuracy holds up depends on the
+model, so compare per stage with the report below before switching a stage.
+
+The report evaluates the float and quantized models of one fold of a bundle
+in the model registry (see registry.py) on the validation set of that fold,
+with the metrics of the config (`cfg.metrics`), and prints each metric, the
+difference from float and the throughput.
+
+Usage (from skp/):
+    python quantization.py cfg0000_noise_reduce_085_foramen_crops --fold 0 --modes dynamic static
+"""
+import argparse
+import copy
+import itertools
+import time
+import torch
+import torch.nn as nn
+
+import registry
+
+from configs.base import replace
+from importlib import import_module
+from tasks.metric_inputs import get_metric_inputs
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+from torch.utils.data import DataLoader
+
+
+MODES = ["dynamic", "static"]
+
+
+def _skip_fastpath(module, args):
+    # The fast path of nn.TransformerEncoderLayer reads `linear1.weight` etc. as
+    # tensors, which dynamically quantized Linear layers do not have. It is not
+    # taken by layers with hooks.
+    return None
+
+
+def quantize_dynamic(net, inplace=False):
+    net = net if inplace else copy.deepcopy(net)
+    net = net.cpu().eval()
+    torch.ao.quantization.quantize_dynamic(net, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    for module in net.modules():
+        if isinstance(module, nn.TransformerEncoder):
+            module.use_nested_tensor = False
+        if isinstance(module, nn.TransformerEncoderLayer):
+            module.register_forward_pre_hook(_skip_fastpath)
+    return net
+
+
+def get_backbone_input(net, batch):
+    # input of `net.backbone` after normalization and reshaping in `net.forward`
+    inputs = []
+    handle = net.backbone.register_forward_pre_hook(lambda module, args: inputs.append(args[0]))
+    try:
+        with torch.no_grad():
+            net(batch)
+    finally:
+        handle.remove()
+    return inputs[0]
+
+
+def quantize_static(net, calibration_batches, backend="x86"):
+    """
+    Quantizes `net.backbone` with activation ranges from running `net` on
+    `calibration_batches` (batch dicts), and the remaining Linear layers
+    dynamically. Use backend="qnnpack" on ARM.
+    """
+    assert hasattr(net, "backbone"), f"{type(net).__module__} has no `backbone` to quantize statically"
+    torch.backends.quantized.engine = backend
+    net = copy.deepcopy(net).cpu().eval()
+    example_inputs = (get_backbone_input(net, calibration_batches[0]), )
+    net.backbone = prepare_fx(net.backbone, get_default_qconfig_mapping(backend), example_inputs)
+    with torch.no_grad():
+        for batch in calibration_batches:
+            net(batch)
+    net.backbone = convert_fx(net.backbone)
+    return quantize_dynamic(net, inplace=True)
+
+
+def get_val_loader(cfg):
+    if isinstance(cfg.data_dir, str) and "foldx" in cfg.data_dir:
+        # bundle configs are not resolved by train.load_config
+        cfg = replace(cfg, data_dir=cfg.data_dir.replace("foldx", f"fold{cfg.fold}"))
+    dataset = import_module(f"datasets.{cfg.dataset}").Dataset(cfg, "val")
+    # not tasks.utils.build_dataloader, which needs the training arguments (`cfg.args`)
+    return DataLoader(dataset, batch_size=cfg.val_batch_size, shuffle=False,
+                      collate_fn=dataset.collate_fn, num_workers=cfg.num_workers or 0)
+
+
+def get_val_batches(cfg, num_batches):
+    return list(itertools.islice(get_val_loader(cfg), num_batches))
+
+
+def quantize(net, mode, cfg=None, calibration_batches=None, num_calibration_batches=8):
+    """
+    Returns quantized copy of `net` (mode "dynamic" or "static"). For "static",
+    calibration batches are taken from the validation Dataset of `cfg` if not
+    given.
+    """
+    assert mode in MODES, f"{mode} is not a valid quantization mode, choose from {MODES}"
+    if mode == "dynamic":
+        return quantize_dynamic(net)
+    if calibration_batches is None:
+        calibration_batches = get_val_batches(cfg, num_calibration_batches)
+    return quantize_static(net, calibration_batches)
+
+
+def evaluate(net, cfg, loader, num_batches=None):
+    """
+    Returns ({metric: value}, number of samples, samples per second) of `net`
+    over the first `num_batches` batches of `loader` (all if None), using the
+    metrics of `cfg`. Batches are streamed and only the forward pass is timed.
+    """
+    import metrics
+
+    if cfg.task == "segmentation":
+        # validated with a sliding window inferer rather than `net(batch)`
+        raise ValueError(f"evaluation of task {cfg.task} is not supported")
+    metric_list = [getattr(metrics, m)(cfg) for m in cfg.metrics]
+    num_samples, elapsed = 0, 0
+    with torch.inference_mode():
+        for batch in itertools.islice(loader, num_batches):
+            start = time.perf_counter()
+            out = net(batch)
+            elapsed += time.perf_counter() - start
+            num_samples += len(batch["x"])
+            metric_inputs = get_metric_inputs(cfg, batch, out)
+            for m in metric_list:
+                m.update(*metric_inputs)
+    results = {}
+    for m in metric_list:
+        results.update(m.compute())
+    return {k: float(v) for k, v in results.items()}, num_samples, num_samples / elapsed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("bundle", type=str)
+    parser.add_argument("--fold", type=int, default=0)
+    parser.add_argument("--modes", type=str, nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--num-calibration-batches", type=int, default=8)
+    parser.add_argument("--num-eval-batches", type=int, default=None)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--registry-dir", type=str, default=None)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    bundle = registry.load_bundle(args.bundle, device="cpu", folds=[args.fold], registry_dir=args.registry_dir)
+    cfg = replace(bundle["cfg"], fold=args.fold)
+    net = bundle["models"][args.fold]
+
+    loader = get_val_loader(cfg)
+    modes = [mode for mode in args.modes if mode != "static" or hasattr(net, "backbone")]
+    if modes != args.modes:
+        print(f"{cfg.model} has no conv backbone, skipping static quantization")
+    # calibrate on the first batches, models are evaluated on `--num-eval-batches` (all if not set)
+    calibration_batches = get_val_batches(cfg, args.num_calibration_batches) if "static" in modes else None
+    results = {"float": evaluate(net, cfg, loader, args.num_eval_batches)}
+    for mode in modes:
+        results[mode] = evaluate(quantize(net, mode, cfg, calibration_batches), cfg, loader, args.num_eval_batches)
+
+    float_metrics, num_samples, float_throughput = results["float"]
+    print(f"\n{args.bundle} fold {args.fold} ({cfg.model}), {num_samples} samples\n")
+    print(f"{'':<24}{'float':>20}" + "".join(f"{mode:>21}" for mode in modes))
+    for k, v in float_metrics.items():
+        row = f"{v:>20.4f}" + "".join(f"{results[mode][0][k]:>11.4f} ({results[mode][0][k] - v:+.4f})" for mode in modes)
+        print(f"{k:<24}" + row)
+    row = f"{float_throughput:>20.1f}" + "".join(f"{results[mode][2]:>11.1f} ({results[mode][2] / float_throughput:>6.2f}x)" for mode in modes)
+    print(f"{'samples/s':<24}" + row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Weights-only model registry for inference.
+
+Lightning checkpoints hold the whole Task state (optimizer state, loss and
+metric state, callbacks, hyperparameters) and have to be unpickled in full.
+`export_bundle` extracts the weights of the Net from one checkpoint per fold and
+writes them with the config as a bundle:
+
+    registry/<name>/
+        manifest.json   config name and hash, model, fold files and source
+                        checkpoints (with size and mtime)
+        config.pkl      config with pretrained weights disabled
+        fold0.pt, ...   state dict of the Net for each fold
+
+`load_bundle` builds the models for all folds in one call. Weights are loaded
+with `torch.load(mmap=True, weights_only=True)`, i.e., tensors are mapped from
+the file rather than read and unpickled, and are assigned to the model without
+a copy on CPU (a single host-to-device copy otherwise). The Net is built once
+and copied for each fold.
+
+Usage (from skp/):
+    python registry.py cfg_predict_sagittal_canal_coords --checkpoints \
+        experiments/cfg_predict_sagittal_canal_coords/016642e2/fold0/checkpoints/last.ckpt ...
+
+Without `--checkpoints`, the most recent `last.ckpt` of each fold in
+experiments/<config>/ is used.
+"""
+import argparse
+import copy
+import glob
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import torch
+
+from configs.base import freeze, replace, thaw
+from importlib import import_module
+
+
+REGISTRY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "registry")
+
+
+def get_bundle_dir(name, registry_dir=None):
+    if os.path.isdir(name):
+        return name
+    return os.path.join(registry_dir or REGISTRY_DIR, name)
+
+
+def load_manifest(name, registry_dir=None):
+    manifest_path = os.path.join(get_bundle_dir(name, registry_dir), "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def get_checkpoint_info(checkpoint_dict):
+    # path, size and mtime of each checkpoint, `last.ckpt` is overwritten in place
+    info = {}
+    for fold, path in checkpoint_dict.items():
+        stat = os.stat(path)
+        info[str(fold)] = {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    return info
+
+
+def get_config_hash(config):
+    with open(inspect.getsourcefile(import_module(f"configs.{config}")), "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def bundle_matches(name, checkpoint_dict, config=None, registry_dir=None):
+    # True if the bundle exists and was exported from the same config and unchanged checkpoints
+    config = config or name
+    manifest = load_manifest(name, registry_dir)
+    if manifest is None:
+        return False
+    return manifest["config"] == config and manifest.get("config_hash") == get_config_hash(config) \
+        and manifest["checkpoints"] == get_checkpoint_info(checkpoint_dict)
+
+
+def get_inference_config(config):
+    cfg = import_module(f"configs.{config}").cfg
+    return replace(cfg, pretrained=False, load_pretrained_backbone=None,
+                   load_pretrained_encoder=None, load_pretrained_model=None)
+
+
+def extract_model_weights(checkpoint_path):
+    state_dict = torch.load(checkpoint_path, map_location="cpu", weights_only=False)["state_dict"]
+    # Task holds the Net as `model`, drop loss and metric state
+    return {k[len("model."):]: v.contiguous() for k, v in state_dict.items() if k.startswith("model.")}
+
+
+def find_latest_checkpoints(config, folds, experiments_dir="experiments"):
+    checkpoint_dict = {}
+    for fold in folds:
+        checkpoints = glob.glob(os.path.join(experiments_dir, config, "*", f"fold{fold}", "checkpoints", "last.ckpt"))
+        if len(checkpoints) == 0:
+            raise FileNotFoundError(f"No checkpoint found for {config} fold {fold} in {experiments_dir}")
+        checkpoint_dict[fold] = max(checkpoints, key=os.path.getmtime)
+    return checkpoint_dict
+
+
+def export_bundle(config, checkpoint_dict, name=None, registry_dir=None):
+    """
+    Exports weights of each fold in `checkpoint_dict` ({fold: checkpoint_path})
+    with the config `configs.<config>` as bundle `name` (defaults to `config`).
+    A single model is a bundle with one fold.
+    """
+    bundle_dir = get_bundle_dir(name or config, registry_dir)
+    os.makedirs(bundle_dir, exist_ok=True)
+    cfg = get_inference_config(config)
+    model = import_module(f"models.{cfg.model}").Net(cfg)
+    folds = {}
+    for fold, checkpoint_path in checkpoint_dict.items():
+        print(f"Exporting weights from {checkpoint_path} ...")
+        weights = extract_model_weights(checkpoint_path)
+        # fail on export rather than at inference time
+        model.load_state_dict(weights)
+        folds[str(fold)] = f"fold{fold}.pt"
+        torch.save(weights, os.path.join(bundle_dir, folds[str(fold)]))
+
+    with open(os.path.join(bundle_dir, "config.pkl"), "wb") as f:
+        pickle.dump(thaw(cfg), f)
+    # manifest is written last, so that an interrupted export is not loaded
+    manifest = {
+        "config": config,
+        "model": cfg.model,
+        "folds": folds,
+        "config_hash": get_config_hash(config),
+        "checkpoints": get_checkpoint_info(checkpoint_dict)
+    }
+    with open(os.path.join(bundle_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return bundle_dir
+
+
+def load_bundle(name, device="cuda", folds=None, registry_dir=None):
+    """
+    Returns {"cfg": cfg, "models": {fold: model}} for bundle `name` (or path to
+    a bundle directory), with models in eval mode on `device`. `folds` selects
+    a subset of folds.
+    """
+    bundle_dir = get_bundle_dir(name, registry_dir)
+    manifest = load_manifest(bundle_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"{bundle_dir} is not an exported bundle, see `export_bundle`")
+    with open(os.path.join(bundle_dir, "config.pkl"), "rb") as f:
+        cfg = freeze(pickle.load(f))
+
+    # weights are replaced below, so the Net is only built (and initialized) once
+    template = import_module(f"models.{cfg.model}").Net(cfg)
+    models = {}
+    for fold, filename in manifest["folds"].items():
+        fold = int(fold)
+        if folds is not None and fold not in folds:
+            continue
+        weights = torch.load(os.path.join(bundle_dir, filename), map_location="cpu", mmap=True, weights_only=True)
+        model = copy.deepcopy(template)
+        model.load_state_dict(weights, assign=True)
+        models[fold] = model.eval().to(device)
+    return {"cfg": cfg, "models": models}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config", type=str)
+    parser.add_argument("--checkpoints", type=str, nargs="+", help="checkpoint for each fold, in order of --folds")
+    parser.add_argument("--folds", type=int, nargs="+", default=[0, 1, 2, 3, 4])
+    parser.add_argument("--name", type=str, default=None)
+    parser.add_argument("--registry-dir", type=str, default=None)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.checkpoints:
+        assert len(args.checkpoints) == len(args.folds), f"{len(args.checkpoints)} checkpoints for {len(args.folds)} folds"
+        checkpoint_dict = dict(zip(args.folds, args.checkpoints))
+    else:
+        checkpoint_dict = find_latest_checkpoints(args.config, args.folds)
+    bundle_dir = export_bundle(args.config, checkpoint_dict, name=args.name, registry_dir=args.registry_dir)
+    print(f"Saved bundle to {bundle_dir}")
+
+
+if __name__ == "__main__":
+    main()
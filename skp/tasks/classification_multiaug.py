@@ -5,8 +5,9 @@ import torch.nn as nn
 import torch
 
 from collections import defaultdict
-from neptune.utils import stringify_unsupported
 from torch.optim.lr_scheduler import ReduceLROnPlateau
+from .input_pipeline import InputPipeline
+from .metric_inputs import get_metric_inputs
 from .utils import build_dataloader
 
 
@@ -16,6 +17,8 @@ class Task(pl.LightningModule):
         super().__init__()
         self.cfg = cfg
         self.val_loss = defaultdict(list)
+        if self.cfg.uint8_inputs:
+            self.input_pipeline = InputPipeline(self.cfg)
 
     def set(self, name, attr):
         if name == "metrics":
@@ -26,7 +29,16 @@ class Task(pl.LightningModule):
         for obj in ["model", "datasets", "optimizer", "scheduler", "metrics", "val_metric"]:
             assert hasattr(self, obj)
 
-        self.logger.experiment["cfg"] = stringify_unsupported(self.cfg.__dict__)
+        if self.logger is not None:
+            # imported here so that neptune is only loaded when logging is enabled
+            from neptune.utils import stringify_unsupported
+            self.logger.experiment["cfg"] = stringify_unsupported(self.cfg.__dict__)
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        if self.cfg.uint8_inputs:
+            # cast and normalize uint8 images on device, see tasks/input_pipeline.py
+            batch = self.input_pipeline(batch)
+        return batch
 
     def mixup(self, batch):
         x, y =  batch["x"], batch["y"]
@@ -69,26 +81,9 @@ class Task(pl.LightningModule):
         for k, v in out.items():
             if "loss" in k:
                 self.val_loss[k].append(v)
+        metric_inputs = get_metric_inputs(self.cfg, batch, out)
         for m in self.metrics:
-            if self.cfg.model == "all_levels_net_2d":
-                unique_ids = batch["unique_id"]
-                unique_ids = [_[i] for i in range(len(unique_ids[0])) for _ in unique_ids]
-                unique_ids = torch.tensor(unique_ids, device=unique_ids[0].device)
-                y = batch["y"]
-                y = y.reshape(len(y) * 5, -1)
-                m.update(out.get("logits", None), y, unique_ids)
-            elif self.cfg.model == "net_2d_all_slices_seq":
-                logits = out["logits"]
-                sz = len(logits)
-                y = batch["y"].reshape(sz, -1)
-                mask = out["mask"].reshape(sz)
-                unique_ids = batch["unique_id"].reshape(sz)
-                logits = logits[~mask]
-                y = y[~mask]
-                unique_ids = unique_ids[~mask]
-                m.update(logits, y, unique_ids)
-            else:
-                m.update(out.get("logits", None), batch.get("y", None), batch.get("unique_id", None))
+            m.update(*metric_inputs)
         return out["loss"]
 
     def on_validation_epoch_end(self, *args, **kwargs):
@@ -114,8 +109,9 @@ class Task(pl.LightningModule):
 
         if self.trainer.state.stage != pl.trainer.states.RunningStage.SANITY_CHECKING: # don't log metrics during sanity check
 
-            for k,v in metrics.items():
-                self.logger.experiment[f"val/{k}"].append(v)
+            if self.logger is not None:
+                for k,v in metrics.items():
+                    self.logger.experiment[f"val/{k}"].append(v)
 
             self.log("val_metric", metrics["val_metric"], sync_dist=True)
 
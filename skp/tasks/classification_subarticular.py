@@ -4,8 +4,9 @@ import pytorch_lightning as pl
 import torch.nn as nn
 import torch
 
-from neptune.utils import stringify_unsupported
 from torch.optim.lr_scheduler import ReduceLROnPlateau
+from .input_pipeline import InputPipeline
+from .metric_inputs import get_metric_inputs
 from .utils import build_dataloader
 
 
@@ -15,6 +16,8 @@ class Task(pl.LightningModule):
         super().__init__()
         self.cfg = cfg
         self.val_loss = []
+        if self.cfg.uint8_inputs:
+            self.input_pipeline = InputPipeline(self.cfg)
 
     def set(self, name, attr):
         if name == "metrics":
@@ -25,7 +28,16 @@ class Task(pl.LightningModule):
         for obj in ["model", "datasets", "optimizer", "scheduler", "metrics", "val_metric"]:
             assert hasattr(self, obj)
 
-        self.logger.experiment["cfg"] = stringify_unsupported(self.cfg.__dict__)
+        if self.logger is not None:
+            # imported here so that neptune is only loaded when logging is enabled
+            from neptune.utils import stringify_unsupported
+            self.logger.experiment["cfg"] = stringify_unsupported(self.cfg.__dict__)
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        if self.cfg.uint8_inputs:
+            # cast and normalize uint8 images on device, see tasks/input_pipeline.py
+            batch = self.input_pipeline(batch)
+        return batch
 
     def _apply_mixaug(self, X, y):
         return apply_mixaug(X, y, self.mixaug)
@@ -42,8 +54,9 @@ class Task(pl.LightningModule):
     def validation_step(self, batch, batch_idx): 
         out = self.model(batch, return_loss=True) 
         self.val_loss += [out["loss"]]
+        metric_inputs = get_metric_inputs(self.cfg, batch, out)
         for m in self.metrics:
-            m.update(out["logits_coords"], out["logits_levels"], batch["coords"], batch["level_labels"], batch["included_levels"])
+            m.update(*metric_inputs)
         return out["loss"]
 
     def on_validation_epoch_end(self, *args, **kwargs):
@@ -66,8 +79,9 @@ class Task(pl.LightningModule):
             for k,v in metrics.items(): 
                 print(f"{k.ljust(max_strlen)} | {v.item():.4f}")
 
-        for k,v in metrics.items():
-            self.logger.experiment[f"val/{k}"].append(v)
+        if self.logger is not None:
+            for k,v in metrics.items():
+                self.logger.experiment[f"val/{k}"].append(v)
 
         self.log("val_metric", metrics["val_metric"], sync_dist=True)
 
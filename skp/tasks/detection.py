@@ -4,8 +4,8 @@ import pytorch_lightning as pl
 import torch.nn as nn
 import torch
 
-from neptune.utils import stringify_unsupported
 from torch.optim.lr_scheduler import ReduceLROnPlateau
+from .metric_inputs import get_metric_inputs
 from .utils import build_dataloader
 
 
@@ -24,7 +24,10 @@ class Task(pl.LightningModule):
         for obj in ["model", "datasets", "optimizer", "scheduler", "metrics", "val_metric"]:
             assert hasattr(self, obj)
 
-        self.logger.experiment["cfg"] = stringify_unsupported(self.cfg.__dict__)
+        if self.logger is not None:
+            # imported here so that neptune is only loaded when logging is enabled
+            from neptune.utils import stringify_unsupported
+            self.logger.experiment["cfg"] = stringify_unsupported(self.cfg.__dict__)
 
     def _apply_mixaug(self, X, y):
         return apply_mixaug(X, y, self.mixaug)
@@ -41,8 +44,9 @@ class Task(pl.LightningModule):
 
     def validation_step(self, batch, batch_idx): 
         out = self.model(batch) 
+        metric_inputs = get_metric_inputs(self.cfg, batch, out)
         for m in self.metrics:
-            m.update(out, batch["targets"])
+            m.update(*metric_inputs)
         return 0
 
     def on_validation_epoch_end(self, *args, **kwargs):
@@ -63,8 +67,9 @@ class Task(pl.LightningModule):
             for k,v in metrics.items(): 
                 print(f"{k.ljust(max_strlen)} | {v.item() if isinstance(v, torch.Tensor) else v:.4f}")
 
-        for k,v in metrics.items():
-            self.logger.experiment[f"val/{k}"].append(v)
+        if self.logger is not None:
+            for k,v in metrics.items():
+                self.logger.experiment[f"val/{k}"].append(v)
 
         self.log("val_metric", metrics["val_metric"], sync_dist=True)
 
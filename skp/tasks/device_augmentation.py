@@ -0,0 +1,161 @@
+import math
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from torch.utils.data import default_collate
+
+
+def pad_collate(batch):
+    """
+    Collates raw uint8 stacks `x` of shape (C, Z, H, W) which may differ in H, W
+    by zero-padding to the largest H, W in the batch (bottom/right). The original
+    sizes are returned as `x_size` so that `DeviceAugment3d` only samples from
+    the valid region of each stack.
+    """
+    h = max(b["x"].shape[-2] for b in batch)
+    w = max(b["x"].shape[-1] for b in batch)
+    x_size = torch.tensor([b["x"].shape[-2:] for b in batch])
+    x = torch.stack([F.pad(b["x"], (0, w - b["x"].shape[-1], 0, h - b["x"].shape[-2])) for b in batch])
+    batch = default_collate([{k: v for k, v in b.items() if k != "x"} for b in batch])
+    batch["x"] = x
+    batch["x_size"] = x_size
+    return batch
+
+
+class DeviceAugment3d(nn.Module):
+    """
+    Batched augmentation for 3D stacks on the compute device.
+
+    Flips, in-plane affine (rotation, scale, translation) and resizing are composed
+    into a single per-sample affine transform and applied with one `grid_sample`
+    over the whole (B, C, Z, H, W) batch, followed by per-sample gamma and Gaussian
+    noise. This replaces per-slice albumentations in the dataloader workers, which
+    then only need to ship raw uint8 stacks (see `pad_collate`).
+
+    Coordinate targets (normalized to [0, 1]) in `batch[coords_key]` are transformed
+    along with the image. `coords` should be a dict with keys `x`, `y` and `z`
+    specifying the indices of each coordinate type, where `x` and `y` are aligned
+    (i.e., `x[i]` and `y[i]` belong to the same point). `swap_on_flip_z` is an optional
+    pair of equal-length index lists which are swapped when the slice dimension is
+    flipped (e.g., left and right foramina on sagittal stacks).
+
+    Params (all optional except output_size):
+        output_size: (H, W) of output
+        flip_z, flip_y, flip_x: probability of flipping each axis
+        rotate: max in-plane rotation in degrees
+        scale: (min, max) in-plane scale factor
+        translate: max in-plane translation as a fraction of image size
+        affine_p: probability of applying rotate/scale/translate
+        gamma: (min, max) gamma, gamma_p: probability
+        noise_std: (min, max) std of Gaussian noise on the 0-255 scale, noise_p: probability
+        coords, coords_key, swap_on_flip_z: see above
+
+    During validation only resizing is applied.
+    """
+    def __init__(self, params):
+        super().__init__()
+        self.params = params
+        self.output_size = tuple(params["output_size"])
+        self.coords = params.get("coords", None)
+        self.coords_key = params.get("coords_key", "y")
+        self.swap_on_flip_z = params.get("swap_on_flip_z", None)
+
+    def random_mask(self, p, batch_size, device):
+        return torch.rand(batch_size, device=device) < p
+
+    def uniform(self, bounds, batch_size, device):
+        low, high = bounds
+        return torch.rand(batch_size, device=device) * (high - low) + low
+
+    def get_affine(self, batch_size, device, train):
+        # Returns 2x2 in-plane matrix, 2D translation and z sign, all mapping
+        # output normalized coordinates to (unpadded) input normalized coordinates
+        p = self.params
+        ones = torch.ones(batch_size, device=device)
+        zeros = torch.zeros(batch_size, device=device)
+        sign_x, sign_y, sign_z = ones.clone(), ones.clone(), ones.clone()
+        angle, scale, tx, ty = zeros.clone(), ones.clone(), zeros.clone(), zeros.clone()
+        if train:
+            for axis, sign in zip(["flip_x", "flip_y", "flip_z"], [sign_x, sign_y, sign_z]):
+                if p.get(axis, 0) > 0:
+                    sign[self.random_mask(p[axis], batch_size, device)] = -1
+            apply_affine = self.random_mask(p.get("affine_p", 1.0), batch_size, device)
+            if p.get("rotate", 0) > 0:
+                angle = torch.where(apply_affine, self.uniform((-p["rotate"], p["rotate"]), batch_size, device), angle)
+            if "scale" in p:
+                # scaling the image by s means sampling the input at 1 / s
+                scale = torch.where(apply_affine, 1 / self.uniform(p["scale"], batch_size, device), scale)
+            if p.get("translate", 0) > 0:
+                # normalized coordinates span 2
+                tx = torch.where(apply_affine, self.uniform((-p["translate"], p["translate"]), batch_size, device) * 2, tx)
+                ty = torch.where(apply_affine, self.uniform((-p["translate"], p["translate"]), batch_size, device) * 2, ty)
+        angle = angle * math.pi / 180
+        cos, sin = torch.cos(angle) * scale, torch.sin(angle) * scale
+        # rotation/scale applied after flips
+        matrix = torch.stack([
+            torch.stack([cos * sign_x, -sin * sign_y], dim=-1),
+            torch.stack([sin * sign_x, cos * sign_y], dim=-1)
+        ], dim=1)
+        translation = torch.stack([tx, ty], dim=-1)
+        return matrix, translation, sign_z
+
+    def transform_coords(self, coords, matrix, translation, sign_z):
+        # coords are in [0, 1] relative to the original image
+        # q = M @ p_out + t -> p_out = M^-1 @ (q - t)
+        coords = coords.clone().float()
+        x_idx, y_idx, z_idx = self.coords.get("x", []), self.coords.get("y", []), self.coords.get("z", [])
+        if len(x_idx) > 0:
+            q = torch.stack([coords[:, x_idx], coords[:, y_idx]], dim=-1) * 2 - 1
+            q = q - translation.unsqueeze(1)
+            p_out = torch.einsum("bij,bnj->bni", torch.linalg.inv(matrix), q)
+            p_out = (p_out + 1) / 2
+            coords[:, x_idx], coords[:, y_idx] = p_out[..., 0], p_out[..., 1]
+        flipped = (sign_z < 0).unsqueeze(1)
+        if len(z_idx) > 0:
+            coords[:, z_idx] = torch.where(flipped, 1 - coords[:, z_idx], coords[:, z_idx])
+        if self.swap_on_flip_z is not None:
+            left, right = list(self.swap_on_flip_z[0]), list(self.swap_on_flip_z[1])
+            swapped = coords.clone()
+            swapped[:, left], swapped[:, right] = coords[:, right], coords[:, left]
+            coords = torch.where(flipped, swapped, coords)
+        return coords
+
+    @torch.no_grad()
+    def forward(self, batch, train=True):
+        x = batch["x"]
+        b, c, z, h, w = x.shape
+        device = x.device
+        matrix, translation, sign_z = self.get_affine(b, device, train)
+
+        # map from (unpadded) input normalized coordinates to padded input normalized coordinates
+        if "x_size" in batch:
+            size = batch["x_size"].to(device).float()
+            s_h, s_w = size[:, 0] / h, size[:, 1] / w
+        else:
+            s_h, s_w = torch.ones(b, device=device), torch.ones(b, device=device)
+        theta = torch.zeros((b, 3, 4), device=device)
+        theta[:, 0, :2] = matrix[:, 0] * s_w.unsqueeze(1)
+        theta[:, 0, 3] = translation[:, 0] * s_w + s_w - 1
+        theta[:, 1, :2] = matrix[:, 1] * s_h.unsqueeze(1)
+        theta[:, 1, 3] = translation[:, 1] * s_h + s_h - 1
+        theta[:, 2, 2] = sign_z
+
+        grid = F.affine_grid(theta, (b, c, z) + self.output_size, align_corners=False)
+        x = F.grid_sample(x.float(), grid, mode="bilinear", padding_mode="zeros", align_corners=False)
+
+        if train:
+            p = self.params
+            if "gamma" in p:
+                gamma = self.uniform(p["gamma"], b, device)
+                gamma = torch.where(self.random_mask(p.get("gamma_p", 0.5), b, device), gamma, torch.ones_like(gamma))
+                x = 255 * (x / 255).clamp(min=0).pow(gamma.view(b, 1, 1, 1, 1))
+            if "noise_std" in p:
+                std = self.uniform(p["noise_std"], b, device)
+                std = std * self.random_mask(p.get("noise_p", 0.5), b, device)
+                x = (x + torch.randn_like(x) * std.view(b, 1, 1, 1, 1)).clamp(0, 255)
+
+        batch["x"] = x
+        if self.coords is not None and self.coords_key in batch:
+            batch[self.coords_key] = self.transform_coords(batch[self.coords_key], matrix, translation, sign_z)
+        return batch
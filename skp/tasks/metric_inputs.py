@@ -0,0 +1,70 @@
+"""
+Arguments passed to `metric.update` for each Task, from the batch and the output
+of the model. Used by `validation_step` of the Tasks, and by evaluation outside
+of Lightning (e.g., quantization.py) so that both feed metrics the same way.
+"""
+import torch
+
+
+def _default(cfg, batch, out):
+    return out.get("logits", None), batch.get("y", None)
+
+
+def _classification_multiaug(cfg, batch, out):
+    if cfg.model == "all_levels_net_2d":
+        unique_ids = batch["unique_id"]
+        unique_ids = [_[i] for i in range(len(unique_ids[0])) for _ in unique_ids]
+        unique_ids = torch.tensor(unique_ids, device=unique_ids[0].device)
+        y = batch["y"]
+        y = y.reshape(len(y) * 5, -1)
+        return out.get("logits", None), y, unique_ids
+    if cfg.model == "net_2d_all_slices_seq":
+        logits = out["logits"]
+        sz = len(logits)
+        y = batch["y"].reshape(sz, -1)
+        unique_ids = batch["unique_id"].reshape(sz)
+        if out["mask"] is not None:
+            mask = out["mask"].reshape(sz)
+            logits = logits[~mask]
+            y = y[~mask]
+            unique_ids = unique_ids[~mask]
+        return logits, y, unique_ids
+    return out.get("logits", None), batch.get("y", None), batch.get("unique_id", None)
+
+
+def _classification_subarticular(cfg, batch, out):
+    return out["logits_coords"], out["logits_levels"], batch["coords"], batch["level_labels"], batch["included_levels"]
+
+
+def _detection(cfg, batch, out):
+    return out, batch["targets"]
+
+
+def _segmentation(cfg, batch, out):
+    # `out` is the output of the sliding window inferer
+    return out, batch["y"]
+
+
+def _segmentation_2d(cfg, batch, out):
+    return out["logits"], batch["y"]
+
+
+def _segmentation_2d_cls(cfg, batch, out):
+    return out["logits_cls"], batch["y_cls"]
+
+
+METRIC_INPUTS = {
+    "classification": _default,
+    "classification_multiaug": _classification_multiaug,
+    "classification_subarticular": _classification_subarticular,
+    "detection": _detection,
+    "segmentation": _segmentation,
+    "segmentation_2d": _segmentation_2d,
+    "segmentation_2d_cls": _segmentation_2d_cls,
+}
+
+
+def get_metric_inputs(cfg, batch, out):
+    if cfg.task not in METRIC_INPUTS:
+        raise ValueError(f"{cfg.task} is not a valid task, choose from {list(METRIC_INPUTS)}")
+    return METRIC_INPUTS[cfg.task](cfg, batch, out)
@@ -1,10 +1,81 @@
 import numpy as np
+import torch.distributed as dist
 
 from operator import itemgetter
 from torch.utils.data import Dataset, Sampler, DistributedSampler
 from typing import Optional
 
 
+def get_distributed_info(rank=None, world_size=None):
+    if rank is None:
+        rank = dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+    if world_size is None:
+        world_size = dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+    return rank, world_size
+
+
+def get_shared_seed(seed=None):
+    # All ranks must draw the same global stream so that their shards do not overlap
+    # If no seed is specified, use a random one from rank 0
+    if seed is not None:
+        return seed
+    seed = [int(np.random.randint(2 ** 31))]
+    if dist.is_available() and dist.is_initialized():
+        dist.broadcast_object_list(seed, src=0)
+    return seed[0]
+
+
+def get_rank_rng(seed, rank):
+    # Independent stream per rank, for samplers which draw with replacement and
+    # therefore do not need to coordinate across ranks
+    return np.random.default_rng([seed, rank])
+
+
+def get_index_dtype(n):
+    return np.int32 if n < np.iinfo(np.int32).max else np.int64
+
+
+class PermutationCursor:
+    """
+    Draws indices without replacement from a random permutation of range(n),
+    continuing where the previous draw stopped. When the permutation is exhausted,
+    a new one is generated.
+
+    If `exclude_last_on_refill=True`, indices drawn from the end of the exhausted
+    permutation within the same call are left out of the new one, so that a single
+    draw never contains duplicates (requires k <= n).
+    """
+    def __init__(self, n, rng):
+        self.n = n
+        self.rng = rng
+        self.dtype = get_index_dtype(n)
+        self.refill()
+
+    def refill(self):
+        self.permutation = self.rng.permutation(self.n).astype(self.dtype)
+        self.cursor = 0
+
+    def take(self, k, exclude_last_on_refill=False):
+        chunks = []
+        while k > 0:
+            if self.cursor == len(self.permutation):
+                self.refill()
+                if exclude_last_on_refill and len(chunks) > 0:
+                    drawn = np.zeros(self.n, dtype=bool)
+                    drawn[np.concatenate(chunks)] = True
+                    self.permutation = self.permutation[~drawn[self.permutation]]
+            chunk = self.permutation[self.cursor:self.cursor + k]
+            self.cursor += len(chunk)
+            k -= len(chunk)
+            chunks.append(chunk)
+        return np.concatenate(chunks)
+
+
+def shard_indices(indices, rank, world_size):
+    # Each rank takes an interleaved slice of the same global stream
+    return indices[rank::world_size]
+
+
 # From https://github.com/catalyst-team/catalyst
 class DatasetFromSampler(Dataset):
     """Dataset to create indexes from `Sampler`.
@@ -85,36 +156,46 @@ class DistributedSamplerWrapper(DistributedSampler):
 class IterationBasedSampler(Sampler):
     """
     Define epochs based on # of iterations.
+
+    Indices are drawn without replacement across epochs until all have been
+    used, then the pool is refilled. Under DDP, each rank draws the same global
+    stream (shared seed) and keeps its own shard, so this sampler does not need
+    to be wrapped in DistributedSamplerWrapper.
     """
-    def __init__(self, dataset, cfg):
+    distributed = True
+
+    def __init__(self, dataset, cfg, rank=None, world_size=None, seed=None):
         super().__init__()
         self.len_dataset = len(dataset)
         self.batch_size = cfg.batch_size
         self.num_iterations = cfg.num_iterations_per_epoch
         self.total_iterations = self.num_iterations * self.batch_size * cfg.world_size
-        self.available_indices = list(range(self.len_dataset))
-        self.unavailable_indices = []
+        self.rank, self.world_size = get_distributed_info(rank, world_size)
+        self.rng = np.random.default_rng(get_shared_seed(seed if seed is not None else cfg.seed))
+        self.cursor = PermutationCursor(self.len_dataset, self.rng)
 
     def __len__(self):
-        return self.total_iterations
+        return self.total_iterations // self.world_size
 
     def __iter__(self):
-        num_samples = self.total_iterations
-        iteration_indices = []
-        while num_samples > len(iteration_indices):
-            sampled_indices = np.random.choice(self.available_indices, min(num_samples, len(self.available_indices)), replace=False)
-            iteration_indices.extend(list(sampled_indices))
-            self.available_indices = list(set(self.available_indices) - set(iteration_indices))
-            if len(self.available_indices) == 0:
-                self.available_indices = list(range(self.len_dataset))
-        return iter(iteration_indices)
+        iteration_indices = self.cursor.take(self.total_iterations)
+        return iter(shard_indices(iteration_indices, self.rank, self.world_size).tolist())
 
 
 class WeightedSampler(Sampler):
+    """
+    Draws indices with replacement according to `dataset.sampling_weights`.
+
+    Draws are independent, so under DDP each rank only draws its own share of
+    the epoch from a per-rank stream (derived from the shared seed), instead
+    of every rank drawing the full epoch and discarding the rest.
+    """
+    distributed = True
 
-    def __init__(self, dataset, cfg):
+    def __init__(self, dataset, cfg, rank=None, world_size=None, seed=None):
         super().__init__()
         self.len_dataset = len(dataset)
+        self.rank, self.world_size = get_distributed_info(rank, world_size)
         if isinstance(cfg.num_iterations_per_epoch, int):
             self.total_iterations = cfg.num_iterations_per_epoch * cfg.batch_size * cfg.world_size
         else:
@@ -122,85 +203,112 @@ class WeightedSampler(Sampler):
         self.sampling_probas = dataset.sampling_weights / np.sum(dataset.sampling_weights)
         assert self.sampling_probas.min() > 0
         assert np.abs(1 - self.sampling_probas.sum() < 1e-6)
-        self.indices = np.arange(self.len_dataset)
+        # inverse CDF sampling, so the CDF is only computed once rather than every epoch
+        self.cdf = np.cumsum(self.sampling_probas)
+        self.cdf /= self.cdf[-1]
+        self.dtype = get_index_dtype(self.len_dataset)
+        self.rng = get_rank_rng(get_shared_seed(seed if seed is not None else cfg.seed), self.rank)
 
     def __len__(self):
-        return self.total_iterations
+        return int(np.ceil(self.total_iterations / self.world_size))
 
     def __iter__(self):
-        sampled_indices = np.random.choice(self.indices, self.total_iterations, replace=True, p=self.sampling_probas)
-        return iter(sampled_indices)
+        sampled_indices = np.searchsorted(self.cdf, self.rng.random(len(self)), side="right")
+        sampled_indices = np.minimum(sampled_indices, self.len_dataset - 1).astype(self.dtype)
+        return iter(sampled_indices.tolist())
 
 
 class Subsampler(Sampler):
     """
     This sampler is useful if you have a very large dataset, and you don't want
     to define an epoch as a single pass through the dataset. 
+
+    Under DDP, each rank keeps its own shard of the same global stream of
+    `N_sample` indices.
     """
-    def __init__(self, dataset, N_sample):
+    distributed = True
+
+    def __init__(self, dataset, N_sample, rank=None, world_size=None, seed=None):
         super().__init__(data_source=dataset)
         assert len(dataset) > N_sample, f"`N_sample` {N_sample} should be less than length of dataset {len(dataset)}"
         self.len_dataset = len(dataset)
         self.N_sample = N_sample
-        self.available_indices = list(range(len(dataset)))
+        self.rank, self.world_size = get_distributed_info(rank, world_size)
+        self.rng = np.random.default_rng(get_shared_seed(seed))
+        self.cursor = PermutationCursor(self.len_dataset, self.rng)
 
     def __iter__(self):
-        if len(self.available_indices) >= self.N_sample:
-            subsampled = np.random.choice(self.available_indices, self.N_sample, replace=False)
-            self.available_indices = list(set(self.available_indices) - set(subsampled))
-        else:
-            subsampled = list(self.available_indices) 
-            self.available_indices = list(set(range(self.len_dataset)) - set(subsampled))
-            N_remaining = self.N_sample - len(subsampled)
-            remainder = list(np.random.choice(self.available_indices, N_remaining, replace=False))
-            subsampled.extend(remainder)
-            self.available_indices = list(set(self.available_indices) - set(remainder))
+        # no duplicates within an epoch, even when the pool is refilled partway through
+        subsampled = self.cursor.take(self.N_sample, exclude_last_on_refill=True)
         assert len(subsampled) == self.N_sample
-        return iter(subsampled)
+        if self.world_size > 1:
+            # pad so that each rank gets the same number of samples, as in DistributedSampler
+            num_samples = len(self)
+            subsampled = np.resize(subsampled, num_samples * self.world_size)
+        return iter(shard_indices(subsampled, self.rank, self.world_size).tolist())
 
     def __len__(self):
-        return self.N_sample
+        return int(np.ceil(self.N_sample / self.world_size))
 
 
 class BalancedSampler(Sampler):
     """
     This sampler is for balanced sampling specifically for binary classification
     tasks.
+
+    Negatives and positives are drawn without replacement when there are enough
+    of them, so under DDP each rank keeps its own shard of the same global
+    stream (shared seed) to avoid overlap between ranks.
     """
-    def __init__(self, dataset, N_sample, pos_frac=0.5):
+    distributed = True
+
+    def __init__(self, dataset, N_sample, pos_frac=0.5, rank=None, world_size=None, seed=None):
         super().__init__(data_source=dataset)
         self.len_dataset = len(dataset)
-        self.negatives = np.where(np.asarray(dataset.labels) < 0.5)[0]
-        self.positives = np.where(np.asarray(dataset.labels) >= 0.5)[0]
+        labels = np.asarray(dataset.labels)
+        dtype = get_index_dtype(self.len_dataset)
+        self.negatives = np.where(labels < 0.5)[0].astype(dtype)
+        self.positives = np.where(labels >= 0.5)[0].astype(dtype)
         self.pos_N = int(N_sample * pos_frac)
         self.neg_N = int(N_sample * (1 - pos_frac))
+        self.rank, self.world_size = get_distributed_info(rank, world_size)
+        self.rng = np.random.default_rng(get_shared_seed(seed))
 
     def __iter__(self):
-        negatives = np.random.choice(self.negatives, self.neg_N, replace=len(self.negatives) < self.neg_N)
-        positives = np.random.choice(self.positives, self.pos_N, replace=len(self.positives) < self.pos_N)
+        negatives = self.rng.choice(self.negatives, self.neg_N, replace=len(self.negatives) < self.neg_N)
+        positives = self.rng.choice(self.positives, self.pos_N, replace=len(self.positives) < self.pos_N)
         indices = np.concatenate([negatives, positives])
         assert len(indices) == (self.pos_N + self.neg_N)
-        np.random.shuffle(indices)
-        return iter(indices.tolist())
+        self.rng.shuffle(indices)
+        if self.world_size > 1:
+            indices = np.resize(indices, len(self) * self.world_size)
+        return iter(shard_indices(indices, self.rank, self.world_size).tolist())
 
     def __len__(self):
-        return self.pos_N + self.neg_N
+        return int(np.ceil((self.pos_N + self.neg_N) / self.world_size))
 
 
 class Upsampler(Sampler):
     """
     This sampler is useful if you have a very SMALL dataset, and you don't want
     to define an epoch as a single pass through the dataset.
+
+    Under DDP, each rank only draws its own share of the epoch from a per-rank
+    stream, as in WeightedSampler.
     """
-    def __init__(self, dataset, upsample_factor):
+    distributed = True
+
+    def __init__(self, dataset, upsample_factor, rank=None, world_size=None, seed=None):
         super().__init__(data_source=dataset)
         self.len_dataset = len(dataset)
         self.upsample_factor = upsample_factor
+        self.dtype = get_index_dtype(self.len_dataset)
+        self.rank, self.world_size = get_distributed_info(rank, world_size)
+        self.rng = get_rank_rng(get_shared_seed(seed), self.rank)
 
     def __iter__(self):
-        upsampled = np.random.choice(np.arange(self.len_dataset), int(self.len_dataset * self.upsample_factor),
-                                     replace=True)
-        return iter(upsampled)
+        upsampled = self.rng.integers(0, self.len_dataset, len(self), dtype=self.dtype)
+        return iter(upsampled.tolist())
 
     def __len__(self):
-        return int(self.len_dataset * self.upsample_factor)
+        return int(np.ceil(int(self.len_dataset * self.upsample_factor) / self.world_size))
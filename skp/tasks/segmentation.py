@@ -6,8 +6,9 @@ import torch
 
 from functools import partial
 from monai.inferers import sliding_window_inference
-from neptune.utils import stringify_unsupported
 from torch.optim.lr_scheduler import ReduceLROnPlateau
+from .input_pipeline import InputPipeline
+from .metric_inputs import get_metric_inputs
 from .utils import build_dataloader
 
 
@@ -27,6 +28,8 @@ class Task(pl.LightningModule):
         super().__init__()
         self.cfg = cfg
         self.val_loss = []
+        if self.cfg.uint8_inputs:
+            self.input_pipeline = InputPipeline(self.cfg)
 
     def set(self, name, attr):
         if name == "metrics":
@@ -37,7 +40,16 @@ class Task(pl.LightningModule):
         for obj in ["model", "datasets", "optimizer", "scheduler", "metrics", "val_metric"]:
             assert hasattr(self, obj)
 
-        self.logger.experiment["cfg"] = stringify_unsupported(self.cfg.__dict__)
+        if self.logger is not None:
+            # imported here so that neptune is only loaded when logging is enabled
+            from neptune.utils import stringify_unsupported
+            self.logger.experiment["cfg"] = stringify_unsupported(self.cfg.__dict__)
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        if self.cfg.uint8_inputs:
+            # cast and normalize uint8 images on device, see tasks/input_pipeline.py
+            batch = self.input_pipeline(batch)
+        return batch
 
     def on_validation_epoch_start(self):
         self.model_inferer = partial(
@@ -65,8 +77,9 @@ class Task(pl.LightningModule):
         else:
             loss = self.model.criterion(out, batch["y"])
         self.val_loss.append(loss)
+        metric_inputs = get_metric_inputs(self.cfg, batch, out)
         for m in self.metrics:
-            m.update(out, batch["y"])
+            m.update(*metric_inputs)
         return loss
 
     def on_validation_epoch_end(self, *args, **kwargs):
@@ -89,8 +102,9 @@ class Task(pl.LightningModule):
             for k,v in metrics.items(): 
                 print(f"{k.ljust(max_strlen)} | {v.item():.4f}")
 
-        for k,v in metrics.items():
-            self.logger.experiment[f"val/{k}"].append(v)
+        if self.logger is not None:
+            for k,v in metrics.items():
+                self.logger.experiment[f"val/{k}"].append(v)
 
         self.log("val_metric", metrics["val_metric"], sync_dist=True)
 
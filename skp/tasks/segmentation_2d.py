@@ -5,8 +5,9 @@ import torch.nn as nn
 import torch
 
 from collections import defaultdict
-from neptune.utils import stringify_unsupported
 from torch.optim.lr_scheduler import ReduceLROnPlateau
+from .input_pipeline import InputPipeline
+from .metric_inputs import get_metric_inputs
 from .utils import build_dataloader
 
 
@@ -26,6 +27,8 @@ class Task(pl.LightningModule):
         super().__init__()
         self.cfg = cfg
         self.val_loss = defaultdict(list)
+        if self.cfg.uint8_inputs:
+            self.input_pipeline = InputPipeline(self.cfg)
 
     def set(self, name, attr):
         if name == "metrics":
@@ -36,7 +39,16 @@ class Task(pl.LightningModule):
         for obj in ["model", "datasets", "optimizer", "scheduler", "metrics", "val_metric"]:
             assert hasattr(self, obj)
 
-        self.logger.experiment["cfg"] = stringify_unsupported(self.cfg.__dict__)
+        if self.logger is not None:
+            # imported here so that neptune is only loaded when logging is enabled
+            from neptune.utils import stringify_unsupported
+            self.logger.experiment["cfg"] = stringify_unsupported(self.cfg.__dict__)
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        if self.cfg.uint8_inputs:
+            # cast and normalize uint8 images on device, see tasks/input_pipeline.py
+            batch = self.input_pipeline(batch)
+        return batch
 
     def _apply_mixaug(self, X, y):
         return apply_mixaug(X, y, self.mixaug)
@@ -55,8 +67,9 @@ class Task(pl.LightningModule):
         for k, v in out.items():
             if "loss" in k:
                 self.val_loss[k].append(v)
+        metric_inputs = get_metric_inputs(self.cfg, batch, out)
         for m in self.metrics:
-            m.update(out["logits"], batch["y"])
+            m.update(*metric_inputs)
         return out["loss"]
 
     def on_validation_epoch_end(self, *args, **kwargs):
@@ -82,8 +95,9 @@ class Task(pl.LightningModule):
 
         if self.trainer.state.stage != pl.trainer.states.RunningStage.SANITY_CHECKING: # don't log metrics during sanity check
 
-            for k,v in metrics.items():
-                self.logger.experiment[f"val/{k}"].append(v)
+            if self.logger is not None:
+                for k,v in metrics.items():
+                    self.logger.experiment[f"val/{k}"].append(v)
 
             self.log("val_metric", metrics["val_metric"], sync_dist=True)
 
@@ -3,6 +3,7 @@ import numpy as np
 from torch.utils.data import DataLoader
 from torch.utils.data.distributed import DistributedSampler
 from . import samplers as custom_samplers 
+from .val_cache import ValidationCache
 
 
 def build_dataloader(cfg, dataset, mode):
@@ -10,12 +11,22 @@ def build_dataloader(cfg, dataset, mode):
     def worker_init_fn(worker_id):                                                          
         np.random.seed(np.random.get_state()[1][0] + worker_id)
 
+    if mode == "val" and cfg.val_cache:
+        if getattr(dataset, "val_is_random", False):
+            print(f"WARNING: {type(dataset).__module__} is random during validation, not using validation cache ...")
+        else:
+            # post-transform validation samples are computed once, see tasks/val_cache.py
+            dataset = ValidationCache(dataset, cfg)
+
     dataloader_params = {}
     dataloader_params["num_workers"] = cfg.num_workers
     dataloader_params["drop_last"] = mode == "train"
     dataloader_params["shuffle"] = mode == "train"
     dataloader_params["pin_memory"] = cfg.pin_memory or True
     dataloader_params["collate_fn"] = dataset.collate_fn
+    if cfg.stack_cache_bytes and cfg.num_workers > 0:
+        # keep workers, and the stack cache of each (datasets/stack_cache.py), across epochs
+        dataloader_params["persistent_workers"] = True
 
     if mode == "train":
         dataloader_params["batch_size"] = cfg.batch_size
@@ -28,7 +39,8 @@ def build_dataloader(cfg, dataset, mode):
 
     if sampler:
         dataloader_params["shuffle"] = False
-        if cfg.args["strategy"] == "ddp":
+        if cfg.args["strategy"] == "ddp" and not getattr(sampler, "distributed", False):
+            # samplers with `distributed = True` shard across ranks natively
             sampler = custom_samplers.DistributedSamplerWrapper(sampler)
         print(f"Using sampler {sampler} for training ...")
         dataloader_params["sampler"] = sampler
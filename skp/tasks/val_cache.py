@@ -0,0 +1,202 @@
+"""
+Cache of post-transform validation samples, reused across epochs.
+
+Validation transforms are deterministic, so `Dataset.__getitem__` returns the
+same sample every epoch. With `cfg.val_cache = True`, `build_dataloader` wraps
+the validation dataset in `ValidationCache`, which runs the full `__getitem__`
+path once (using `cfg.num_workers` workers) and afterwards only reads the stored
+samples, skipping image decoding and transforms. Datasets which are random
+during validation on purpose set `val_is_random = True` and are not cached.
+
+Under DDP, the cache is built once by rank 0 and shared with the other ranks.
+
+Samples are stored in a compact dtype where this is lossless: float arrays which
+only hold integers in [0, 255] (e.g., unnormalized images after `.float()`) are
+stored as uint8 and converted back on read, so outputs are identical.
+
+If `cfg.val_cache_dir` is set, samples are written to a flat file which is
+memory-mapped on read, and can be reused across runs. Both files are written to
+a temporary directory which is then renamed, so a cache is either complete or
+absent:
+
+    <val_cache_dir>/<key>/data.bin
+    <val_cache_dir>/<key>/index.pkl
+
+Otherwise samples are kept in RAM in the main process (and shared with forked
+dataloader workers), and sent from rank 0 to the other ranks under DDP.
+
+`key` is a hash of the dataset module, the config (with run-specific entries
+removed), the validation transforms and the contents of the annotations file
+(or, for a compiled annotation index, its `meta.json` and the size and mtime of
+its column files), so any change to these creates a new cache.
+"""
+import hashlib
+import numpy as np
+import os
+import pickle
+import re
+import shutil
+import torch
+import torch.distributed as dist
+
+from datasets.annotations import META_FILE
+from .samplers import get_distributed_info
+from torch.utils.data import DataLoader, Dataset
+from tqdm import tqdm
+
+
+DATA_FILE = "data.bin"
+INDEX_FILE = "index.pkl"
+
+# config entries which do not affect validation samples
+IGNORE_KEYS = {
+    "args", "run_id", "save_dir", "n_train", "n_val", "world_size", "num_workers",
+    "neptune_mode", "val_cache", "val_cache_dir"
+}
+
+
+def _stable_repr(x):
+    # remove memory addresses, e.g., <function f at 0x7f...>, which change between runs
+    return re.sub(r" at 0x[0-9a-fA-F]+", "", repr(x))
+
+
+def get_cache_key(cfg, dataset):
+    h = hashlib.sha1()
+    h.update(type(dataset).__module__.encode())
+    h.update(str(len(dataset)).encode())
+    for k in sorted(cfg.__dict__.keys()):
+        if k in IGNORE_KEYS or k == "train_transforms":
+            continue
+        h.update(f"{k}={_stable_repr(cfg.__dict__[k])};".encode())
+    h.update(_stable_repr(getattr(dataset, "transforms", None)).encode())
+    if cfg.annotations_file and os.path.isdir(cfg.annotations_file):
+        # compiled annotation index (see datasets/annotations.py), keyed on meta.json
+        # and the name, size and mtime of each column file rather than their contents
+        for name in sorted(os.listdir(cfg.annotations_file)):
+            path = os.path.join(cfg.annotations_file, name)
+            if name == META_FILE:
+                with open(path, "rb") as f:
+                    h.update(hashlib.sha1(f.read()).digest())
+            else:
+                stat = os.stat(path)
+                h.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    elif cfg.annotations_file and os.path.isfile(cfg.annotations_file):
+        with open(cfg.annotations_file, "rb") as f:
+            h.update(hashlib.sha1(f.read()).digest())
+    return h.hexdigest()[:16]
+
+
+def compact(x):
+    # lossless conversion to a smaller dtype, returns (array, original dtype)
+    dtype = x.dtype
+    if np.issubdtype(dtype, np.floating) and x.size > 0 and x.min() >= 0 and x.max() <= 255 \
+            and np.array_equal(x, np.floor(x)):
+        x = x.astype(np.uint8)
+    return np.ascontiguousarray(x), dtype
+
+
+def _first(batch):
+    # DataLoader with batch_size=1, return the sample without collating
+    return batch[0]
+
+
+class ValidationCache(Dataset):
+
+    def __init__(self, dataset, cfg):
+        self.collate_fn = dataset.collate_fn
+        self.length = len(dataset)
+        self.key = get_cache_key(cfg, dataset)
+        self.data = None
+        self.mmap = None
+        rank, world_size = get_distributed_info()
+        if cfg.val_cache_dir:
+            self.cache_dir = os.path.join(cfg.val_cache_dir, self.key)
+            # rank 0 builds, the other ranks wait and read the same files
+            if rank == 0:
+                if not os.path.exists(os.path.join(self.cache_dir, INDEX_FILE)):
+                    if os.path.exists(self.cache_dir):
+                        # incomplete cache written by an earlier version
+                        shutil.rmtree(self.cache_dir)
+                    self.build(dataset, cfg, self.cache_dir)
+                else:
+                    print(f"Using validation cache {self.cache_dir} ...")
+            if world_size > 1:
+                dist.barrier()
+            with open(os.path.join(self.cache_dir, INDEX_FILE), "rb") as f:
+                self.index = pickle.load(f)
+        else:
+            self.cache_dir = None
+            cache = [self.build(dataset, cfg) if rank == 0 else None]
+            if world_size > 1:
+                # use `cfg.val_cache_dir` under DDP to avoid sending the cache to each rank
+                dist.broadcast_object_list(cache, src=0)
+            self.index, self.data = cache[0]
+        assert len(self.index) == self.length
+
+    def build(self, dataset, cfg, cache_dir=None):
+        print(f"Caching {len(dataset)} validation samples (key={self.key}) ...")
+        loader = DataLoader(dataset, batch_size=1, shuffle=False, num_workers=cfg.num_workers or 0, collate_fn=_first)
+        index, chunks, offset = [], [], 0
+        if cache_dir is not None:
+            # written to a temporary directory which is renamed to `cache_dir` when
+            # complete, so that data and index are published together
+            tmp_dir = f"{cache_dir}.tmp_{os.getpid()}"
+            os.makedirs(tmp_dir, exist_ok=True)
+            f = open(os.path.join(tmp_dir, DATA_FILE), "wb")
+        for sample in tqdm(loader, total=len(dataset)):
+            record = {}
+            for k, v in sample.items():
+                if isinstance(v, (torch.Tensor, np.ndarray)):
+                    is_tensor = isinstance(v, torch.Tensor)
+                    stored, dtype = compact(v.numpy() if is_tensor else v)
+                    record[k] = ("array", offset, stored.dtype.str, dtype.str, stored.shape, is_tensor)
+                    if cache_dir is not None:
+                        f.write(stored.tobytes())
+                    else:
+                        chunks.append(stored.reshape(-1).view(np.uint8))
+                    offset += stored.nbytes
+                else:
+                    record[k] = ("value", v)
+            index.append(record)
+        if cache_dir is None:
+            data = np.concatenate(chunks) if len(chunks) > 0 else np.zeros((0, ), dtype=np.uint8)
+            return index, data
+        f.close()
+        with open(os.path.join(tmp_dir, INDEX_FILE), "wb") as f:
+            pickle.dump(index, f)
+        try:
+            os.rename(tmp_dir, cache_dir)
+        except OSError:
+            # built by another run in the meantime, keys match so either copy is valid
+            shutil.rmtree(tmp_dir)
+
+    def get_data(self):
+        if self.data is not None:
+            return self.data
+        if self.mmap is None:
+            # opened lazily so that each dataloader worker maps the file itself
+            self.mmap = np.memmap(os.path.join(self.cache_dir, DATA_FILE), dtype=np.uint8, mode="r")
+        return self.mmap
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        data = self.get_data()
+        sample = {}
+        for k, record in self.index[i].items():
+            if record[0] == "value":
+                sample[k] = record[1]
+                continue
+            _, offset, stored_dtype, dtype, shape, is_tensor = record
+            stored_dtype, dtype = np.dtype(stored_dtype), np.dtype(dtype)
+            nbytes = int(np.prod(shape)) * stored_dtype.itemsize
+            x = data[offset:offset + nbytes].view(stored_dtype).reshape(shape).astype(dtype, copy=True)
+            sample[k] = torch.from_numpy(x) if is_tensor else x
+        return sample
+
+    def __getstate__(self):
+        # do not pickle open map when sending to spawned workers
+        state = self.__dict__.copy()
+        state["mmap"] = None
+        return state
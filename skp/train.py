@@ -1,32 +1,36 @@
+"""
+Heavy dependencies (torch, pytorch_lightning, timm, neptune and the losses,
+metrics and models) are imported where they are first used rather than at the
+top of this file, so that `--help` and argument errors return immediately and
+only the modules needed by the config are loaded. See
+benchmarks/import_time.py.
+"""
 import argparse
-import losses
-import metrics
-import neptune
 import os
 import pickle
-import pytorch_lightning as pl
 import sys
-import torch
 import uuid
 
+from configs.base import freeze, replace, thaw
 from importlib import import_module
-from losses import get_loss
-from optim import get_optimizer, get_scheduler
-from pytorch_lightning.loggers.neptune import NeptuneLogger
-from pytorch_lightning.plugins import TorchSyncBatchNorm
-from timm.layers import convert_sync_batchnorm
 
 
-class TimmSyncBatchNorm(TorchSyncBatchNorm):
-    """
-    Default SyncBN plugin for Lightning does not work with latest version of timm
-    EfficientNets because it uses the native PyTorch `convert_sync_batchnorm` function.
+def get_sync_batchnorm_plugin():
+    from pytorch_lightning.plugins import TorchSyncBatchNorm
+    from timm.layers import convert_sync_batchnorm
 
-    Use this plugin instead, which uses the timm helper and should work for non-timm
-    models as well.
-    """
-    def apply(self, model: torch.nn.Module) -> torch.nn.Module:
-        return convert_sync_batchnorm(model)
+    class TimmSyncBatchNorm(TorchSyncBatchNorm):
+        """
+        Default SyncBN plugin for Lightning does not work with latest version of timm
+        EfficientNets because it uses the native PyTorch `convert_sync_batchnorm` function.
+
+        Use this plugin instead, which uses the timm helper and should work for non-timm
+        models as well.
+        """
+        def apply(self, model):
+            return convert_sync_batchnorm(model)
+
+    return TimmSyncBatchNorm()
 
 
 def parse_args():
@@ -104,11 +108,16 @@ def load_config(args, overwrite_args):
             raise Exception(f"{key} is not specified in config")
     if isinstance(cfg.load_pretrained_backbone, list):
         cfg.load_pretrained_backbone = cfg.load_pretrained_backbone[cfg.fold]
+    if isinstance(cfg.data_dir, str) and "foldx" in cfg.data_dir:
+        # resolved here rather than in Dataset, since datasets get a frozen config
+        cfg.data_dir = cfg.data_dir.replace("foldx", f"fold{cfg.fold}")
     
     return cfg, args
 
 
 def symlink_best_model_path(trainer):
+    import pytorch_lightning as pl
+
     wd = os.getcwd()
     best_model_path = None
     for callback in trainer.callbacks:
@@ -125,7 +134,8 @@ def symlink_best_model_path(trainer):
 
 
 def get_trainer(cfg, args):
-    
+    import pytorch_lightning as pl
+
     save_dir = "."
     run_id = uuid.uuid4().hex[:8]
     cfg.run_id = run_id
@@ -149,9 +159,12 @@ def get_trainer(cfg, args):
             mode=cfg.val_track,
             save_top_k=getattr(cfg, "save_top_k") or 1,
         ),
-        pl.callbacks.LearningRateMonitor(logging_interval="step"),
     ]
 
+    if cfg.neptune_mode != "disabled":
+        # LearningRateMonitor raises without a logger
+        callbacks.append(pl.callbacks.LearningRateMonitor(logging_interval="step"))
+
     if cfg.early_stopping:
         print(">> Using early stopping ...")
         early_stopping = pl.callbacks.EarlyStopping(
@@ -165,15 +178,20 @@ def get_trainer(cfg, args):
 
     if cfg.args["strategy"] == "ddp": 
         strategy = pl.strategies.DDPStrategy(find_unused_parameters=False)
-        plugins = [TimmSyncBatchNorm()]
+        plugins = [get_sync_batchnorm_plugin()]
     else:
         strategy = cfg.args["strategy"]
         plugins = None
 
-    neptune_logger = NeptuneLogger(project=cfg.project, 
-                                   source_files=[f"configs/{cfg.config}.py", f"models/{cfg.model}.py", f"datasets/{cfg.dataset}.py"], 
-                                   mode=cfg.neptune_mode,
-                                   log_model_checkpoints=False)
+    if cfg.neptune_mode == "disabled":
+        # neptune is not imported at all, Tasks skip logging when there is no logger
+        neptune_logger = False
+    else:
+        from pytorch_lightning.loggers.neptune import NeptuneLogger
+        neptune_logger = NeptuneLogger(project=cfg.project, 
+                                       source_files=[f"configs/{cfg.config}.py", f"models/{cfg.model}.py", f"datasets/{cfg.dataset}.py"], 
+                                       mode=cfg.neptune_mode,
+                                       log_model_checkpoints=False)
     
     args_dict = args.__dict__
 
@@ -202,6 +220,13 @@ def main():
     args, overwrite_args = parse_args()
 
     cfg, args = load_config(args, overwrite_args)
+
+    import metrics
+    import pytorch_lightning as pl
+    import torch
+    from losses import get_loss
+    from optim import get_optimizer, get_scheduler
+
     cfg.world_size = args.num_nodes * (args.devices if args.devices else 1)
 
     print("\nENVIRONMENT\n")
@@ -213,14 +238,23 @@ def main():
     print(f"  world_size={cfg.world_size}, num_nodes={args.num_nodes}, num_gpus={args.devices if args.devices else 1}")
     print("\n")
     
-    model = import_module(f"models.{cfg.model}").Net(cfg)
+    # run_id and save_dir are set here, before the config is frozen
+    trainer, cfg = get_trainer(cfg, args)
+
+    # datasets, model and task read the config on every step, so use
+    # an immutable snapshot with fast attribute lookups from here on
+    cfg = freeze(cfg)
+
+    # with uint8 inputs, normalization is applied by the Task, see tasks/input_pipeline.py
+    model_cfg = replace(cfg, normalization="none") if cfg.uint8_inputs else cfg
+    model = import_module(f"models.{cfg.model}").Net(model_cfg)
     if not getattr(model, "has_loss", False):
         loss = get_loss(cfg)
         model.set_criterion(loss)
     ds_class = import_module(f"datasets.{cfg.dataset}").Dataset
     train_dataset = ds_class(cfg, "train")
     val_dataset = ds_class(cfg, "val")
-    cfg.n_train, cfg.n_val = len(train_dataset), len(val_dataset)
+    cfg = replace(cfg, n_train=len(train_dataset), n_val=len(val_dataset))
     print(f"TRAIN : N={cfg.n_train}")
     print(f"VAL   : N={cfg.n_val}\n")
     optimizer = get_optimizer(cfg, model)
@@ -234,8 +268,6 @@ def main():
     task.set("metrics", [getattr(metrics, m)(cfg) for m in cfg.metrics])
     task.set("val_metric", cfg.val_metric)
 
-    trainer, cfg = get_trainer(cfg, args)
-
     print(f"Run ID : {cfg.run_id}")
     
     trainer.fit(task)
@@ -246,7 +278,7 @@ def main():
     # arguments, since the original config would not be correct in that case
     # Although the parameters should be correct in Neptune
     with open(os.path.join(cfg.save_dir, "config.pkl"), "wb") as f:
-        pickle.dump(cfg, f)
+        pickle.dump(thaw(cfg), f)
 
     if cfg.neptune_mode == "offline":
         # Avoid multiple uploads in case using server which would potentially flag